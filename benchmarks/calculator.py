@@ -0,0 +1,88 @@
+"""
+:module calculator: Benchmarks of the BaseCalculator API.
+"""
+
+import os
+import shutil
+import tempfile
+
+from libpyvinyl.BaseCalculator import BaseCalculator, SpecializedCalculator
+
+from .common import make_random_image_calculator, make_specialized_calculator
+
+
+class CopySuite:
+    """ The copy constructor with growing parameter count and data size. """
+    params = ([0, 100, 1000], [16, 1024])
+    param_names = ['n_parameters', 'grid_size']
+
+    def setup(self, n_parameters, grid_size):
+        self.calculator = make_random_image_calculator(grid_size)
+        for i in range(n_parameters):
+            self.calculator.parameters.new_parameter("extra%d" %
+                                                     i).set_value(float(i))
+        self.calculator.backengine()
+
+    def time_call(self, n_parameters, grid_size):
+        self.calculator()
+
+    def time_call_copy_on_write(self, n_parameters, grid_size):
+        self.calculator(copy_on_write=True)
+
+    def peakmem_call(self, n_parameters, grid_size):
+        self.calculator()
+
+    def peakmem_call_copy_on_write(self, n_parameters, grid_size):
+        self.calculator(copy_on_write=True)
+
+
+class RunSuite:
+    """ Running the backengine through _run. """
+    params = [16, 256, 1024]
+    param_names = ['grid_size']
+
+    def setup(self, grid_size):
+        self.calculator = make_random_image_calculator(grid_size)
+        self.specialized = make_specialized_calculator()
+
+    def time_run_random_image(self, grid_size):
+        self.calculator._run()
+
+    def time_run_specialized(self, grid_size):
+        self.specialized._run()
+
+
+class PersistenceSuite:
+    """ Dumping and restoring calculators. """
+    params = [16, 1024]
+    param_names = ['grid_size']
+
+    def setup(self, grid_size):
+        self.tmpdir = tempfile.mkdtemp()
+        self.calculator = make_random_image_calculator(grid_size)
+        self.calculator.backengine()
+        self.dumpfile = self.calculator.dump(
+            os.path.join(self.tmpdir, 'calculator.dill'))
+        self.checkpoint = self.calculator.checkpoint(
+            os.path.join(self.tmpdir, 'checkpoint'))
+
+    def teardown(self, grid_size):
+        shutil.rmtree(self.tmpdir)
+
+    def time_dump(self, grid_size):
+        self.calculator.dump(os.path.join(self.tmpdir, 'calculator.dill'))
+
+    def time_load_dump(self, grid_size):
+        SpecializedCalculator('load', dumpfile=self.dumpfile)
+
+    def time_checkpoint(self, grid_size):
+        self.calculator.checkpoint(self.checkpoint)
+
+    def time_from_checkpoint(self, grid_size):
+        BaseCalculator.from_checkpoint(self.checkpoint)
+
+    def time_from_checkpoint_mmap(self, grid_size):
+        BaseCalculator.from_checkpoint(self.checkpoint, mmap=True)
+
+    def peakmem_load_dump(self, grid_size):
+        SpecializedCalculator('load', dumpfile=self.dumpfile)
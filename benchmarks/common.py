@@ -0,0 +1,43 @@
+"""
+:module common: Fixtures shared by the benchmark suites.
+"""
+
+import os
+import sys
+
+from libpyvinyl.BaseCalculator import SpecializedCalculator
+from libpyvinyl.Parameters import CalculatorParameters
+
+# RandomImageCalculator lives with the tests.
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'tests'))
+from RandomImageCalculator import RandomImageCalculator
+
+
+def make_parameters(n_parameters, n_intervals=0):
+    """ Parameters with n_parameters entries and n_intervals legal intervals each. """
+    parameters = CalculatorParameters()
+    for i in range(n_parameters):
+        parameter = parameters.new_parameter("par%d" % i,
+                                             unit="eV",
+                                             comment="Parameter %d" % i)
+        for j in range(n_intervals):
+            parameter.add_legal_interval(10 * j, 10 * j + 5)
+        parameter.set_value(1.0)
+    return parameters
+
+
+def make_specialized_calculator(n_parameters=0):
+    """ SpecializedCalculator with its two default and n_parameters extra parameters. """
+    calculator = SpecializedCalculator('specialized')
+    calculator.setParams()
+    for i in range(n_parameters):
+        calculator.parameters.new_parameter("extra%d" % i).set_value(float(i))
+    return calculator
+
+
+def make_random_image_calculator(grid_size):
+    """ RandomImageCalculator with a grid_size x grid_size result. """
+    calculator = RandomImageCalculator('random_image')
+    calculator.setParams(grid_size, grid_size)
+    return calculator
@@ -0,0 +1,15 @@
+"""
+:module imports: Benchmarks of the import time of libpyvinyl.
+"""
+
+
+class ImportSuite:
+    """ Importing libpyvinyl in a fresh interpreter. """
+    def timeraw_import_parameters(self):
+        return "import libpyvinyl.Parameters"
+
+    def timeraw_import_base_calculator(self):
+        return "import libpyvinyl.BaseCalculator"
+
+    def timeraw_import_instrument(self):
+        return "import libpyvinyl.Instrument"
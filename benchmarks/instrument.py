@@ -0,0 +1,48 @@
+"""
+:module instrument: Benchmarks of the Instrument and master parameters.
+"""
+
+from libpyvinyl.Instrument import Instrument
+
+from .common import make_specialized_calculator
+
+
+class InstrumentSuite:
+    """ Building instruments and propagating master parameters. """
+    params = ([2, 10, 50], [0, 100])
+    param_names = ['n_calculators', 'n_parameters']
+
+    def setup(self, n_calculators, n_parameters):
+        self.calculators = []
+        for i in range(n_calculators):
+            calculator = make_specialized_calculator(n_parameters)
+            calculator.name = "calculator%d" % i
+            self.calculators.append(calculator)
+        self.links = {
+            calculator.name: 'photon_energy'
+            for calculator in self.calculators
+        }
+        self.instrument = self.build()
+
+    def build(self):
+        instrument = Instrument('benchmark')
+        for calculator in self.calculators:
+            instrument.add_calculator(calculator)
+        instrument.add_master_parameter('photon_energy', self.links)
+        return instrument
+
+    def time_add_calculator(self, n_calculators, n_parameters):
+        self.build()
+
+    def time_set_master(self, n_calculators, n_parameters):
+        master = self.instrument.master
+        for i in range(100):
+            master['photon_energy'] = float(i)
+
+    def time_set_master_many(self, n_calculators, n_parameters):
+        master = self.instrument.master
+        for i in range(100):
+            master.set_many({'photon_energy': float(i)})
+
+    def time_run(self, n_calculators, n_parameters):
+        self.instrument.run()
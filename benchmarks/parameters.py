@@ -0,0 +1,156 @@
+"""
+:module parameters: Benchmarks of Parameter and CalculatorParameters.
+"""
+
+import copy
+import json
+import os
+import shutil
+import tempfile
+
+import numpy
+
+from libpyvinyl.Parameters import CalculatorParameters, Parameter
+
+from .common import make_parameters
+
+
+class CalculatorParametersSuite:
+    """ Creating, accessing and copying parameter collections. """
+    params = [10, 100, 1000]
+    param_names = ['n_parameters']
+
+    def setup(self, n_parameters):
+        self.parameters = make_parameters(n_parameters)
+        self.names = list(self.parameters.parameters.keys())
+        self.objects = [Parameter("par%d" % i) for i in range(n_parameters)]
+
+    def time_new_parameter(self, n_parameters):
+        make_parameters(n_parameters)
+
+    def time_add(self, n_parameters):
+        CalculatorParameters(list(self.objects))
+
+    def time_getitem(self, n_parameters):
+        parameters = self.parameters
+        for name in self.names:
+            parameters[name]
+
+    def time_setitem(self, n_parameters):
+        parameters = self.parameters
+        for name in self.names:
+            parameters[name] = 2.0
+
+    def time_deepcopy(self, n_parameters):
+        copy.deepcopy(self.parameters)
+
+    def time_copy_on_write(self, n_parameters):
+        self.parameters.copy_on_write()
+
+    def time_to_dict(self, n_parameters):
+        self.parameters.to_dict()
+
+    def time_print(self, n_parameters):
+        repr(self.parameters)
+
+    def peakmem_new_parameter(self, n_parameters):
+        make_parameters(n_parameters)
+
+
+class JsonSuite:
+    """ Writing and reading parameters as json. """
+    params = [10, 100, 1000]
+    param_names = ['n_parameters']
+
+    def setup(self, n_parameters):
+        self.tmpdir = tempfile.mkdtemp()
+        self.parameters = make_parameters(n_parameters, n_intervals=2)
+        self.fname = os.path.join(self.tmpdir, 'parameters.json')
+        self.parameters.to_json(self.fname)
+
+    def teardown(self, n_parameters):
+        shutil.rmtree(self.tmpdir)
+
+    def time_to_json(self, n_parameters):
+        self.parameters.to_json(self.fname)
+
+    def time_from_json(self, n_parameters):
+        CalculatorParameters.from_json(self.fname)
+
+
+class H5Suite:
+    """ Writing and reading parameters with array values as hdf5 and json. """
+    params = [10, 100]
+    param_names = ['n_parameters']
+
+    def setup(self, n_parameters):
+        self.tmpdir = tempfile.mkdtemp()
+        self.parameters = make_parameters(n_parameters, n_intervals=2)
+        for parameter in self.parameters.parameters.values():
+            parameter.value = numpy.linspace(0, 1, 10000)
+        self.fname = os.path.join(self.tmpdir, 'parameters.h5')
+        self.parameters.to_h5(self.fname)
+
+    def teardown(self, n_parameters):
+        shutil.rmtree(self.tmpdir)
+
+    def time_to_h5(self, n_parameters):
+        self.parameters.to_h5(self.fname)
+
+    def time_from_h5(self, n_parameters):
+        CalculatorParameters.from_h5(self.fname)
+
+    def time_to_json(self, n_parameters):
+        with open(os.path.join(self.tmpdir, 'parameters.json'), 'w') as fp:
+            json.dump(self.parameters.to_dict(), fp, default=list)
+
+
+class IsLegalSuite:
+    """ Checking values against interval and option constraints. """
+    params = ([1, 10, 100, 1000], [1000, 100000])
+    param_names = ['n_intervals', 'n_values']
+
+    def setup(self, n_intervals, n_values):
+        self.parameter = Parameter("test")
+        for j in range(n_intervals):
+            self.parameter.add_legal_interval(10 * j, 10 * j + 5)
+        self.parameter.add_illegal_interval(1, 2)
+        self.values = numpy.random.uniform(0, 10 * n_intervals, n_values)
+        self.scalars = list(self.values[:1000])
+        self.legal_scalars = [10 * (i % n_intervals) + 2.5 for i in range(1000)]
+        # Compile the constraints outside of the timing.
+        self.parameter.is_legal(1.0)
+
+    def time_is_legal(self, n_intervals, n_values):
+        is_legal = self.parameter.is_legal
+        for value in self.scalars:
+            is_legal(value)
+
+    def time_is_legal_many(self, n_intervals, n_values):
+        self.parameter.is_legal_many(self.values)
+
+    def time_set_value(self, n_intervals, n_values):
+        set_value = self.parameter.set_value
+        for value in self.legal_scalars:
+            set_value(value)
+
+
+class OptionsSuite:
+    """ Checking values against options. """
+    params = [10, 1000]
+    param_names = ['n_options']
+
+    def setup(self, n_options):
+        self.parameter = Parameter("test")
+        self.parameter.add_option(list(range(n_options)))
+        self.values = numpy.random.randint(0, 2 * n_options, 100000)
+        self.scalars = [int(v) for v in self.values[:1000]]
+        self.parameter.is_legal(1)
+
+    def time_is_legal(self, n_options):
+        is_legal = self.parameter.is_legal
+        for value in self.scalars:
+            is_legal(value)
+
+    def time_is_legal_many(self, n_options):
+        self.parameter.is_legal_many(self.values)
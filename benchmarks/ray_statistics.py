@@ -0,0 +1,37 @@
+"""
+:module ray_statistics: Benchmarks of the ray statistics of Shadow beams.
+"""
+
+import numpy
+
+from libpyvinyl.RayStatistics import (Histogram2D, Moments, beam_statistics,
+                                      histogram2d, reduce)
+
+
+class RayStatisticsSuite:
+    """ Histogramming and reducing random ray arrays. """
+    params = [10**4, 10**6]
+    param_names = ['n_rays']
+
+    def setup(self, n_rays):
+        rng = numpy.random.default_rng(0)
+        self.rays = rng.normal(size=(n_rays, 18))
+        self.rays[:, 9] = 1.0
+        self.batches = numpy.array_split(self.rays, 10)
+
+    def time_histogram2d(self, n_rays):
+        histogram2d(self.rays[:, 0], self.rays[:, 2], 101,
+                    ((-3, 3), (-3, 3)))
+
+    def time_numpy_histogram2d(self, n_rays):
+        numpy.histogram2d(self.rays[:, 0], self.rays[:, 2], 101,
+                          ((-3, 3), (-3, 3)))
+
+    def time_beam_statistics(self, n_rays):
+        beam_statistics(self.rays)
+
+    def time_reduce_batches(self, n_rays):
+        reduce(self.batches, [
+            Histogram2D(1, 3, 101, ((-3, 3), (-3, 3)), weighted=True),
+            Moments([1, 3], weighted=True)
+        ])
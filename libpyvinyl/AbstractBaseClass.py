@@ -29,6 +29,9 @@ class AbstractBaseClass(object, metaclass=ABCMeta):
     """
     :class AbstractBaseClass: Base class of libpyvinyl
     """
+    # Allows derived classes to use __slots__, classes without own __slots__
+    # still get a __dict__.
+    __slots__ = ()
 
     @abstractmethod
     def __init__(self):
@@ -26,18 +26,33 @@
 
 from abc import abstractmethod
 from libpyvinyl.AbstractBaseClass import AbstractBaseClass
+from libpyvinyl.H5Output import (DEFAULT_OPTIONS as H5_OUTPUT_DEFAULTS,
+                                  PARAMETERS_GROUP, PROVENANCE_GROUP,
+                                  check_options as check_h5_output,
+                                  submit as submit_h5, wait as wait_h5,
+                                  write_h5)
+from libpyvinyl.Instrumentation import measure, new_records
+from libpyvinyl.LazyImports import is_instance
 from libpyvinyl.Parameters import CalculatorParameters
-from tempfile import mkstemp
+from libpyvinyl.Parameters.Parameter import _json_round_trips
+from libpyvinyl.ResultCache import ResultCache, calculator_fingerprint
+from tempfile import mkdtemp, mkstemp
 import copy
-import dill
-import h5py
+import functools
+import importlib
+import itertools
+import json
 import sys
 import logging
-import numpy
 import os
 
-logging.basicConfig(format='%(asctime)s %(levelname)s:%(message)s',
-                    level=logging.WARNING)
+# dill, h5py and numpy are imported by the methods that need them, so that
+# importing libpyvinyl stays cheap.
+
+logger = logging.getLogger(__name__)
+
+# Name of the manifest file in checkpoint directories.
+_CHECKPOINT_MANIFEST = "manifest.json"
 
 
 class BaseCalculator(AbstractBaseClass):
@@ -64,9 +79,10 @@ class BaseCalculator(AbstractBaseClass):
         :param parameters: The parameters for this calculator.
         :type  parameters: Parameters
 
-        :param dumpfile: If given, load a previously dumped (aka pickled) calculator.
+        :param dumpfile: If given, load a previously dumped (aka pickled) calculator
+            or a checkpoint directory written by `checkpoint`.
 
-        :param kwargs: (key, value) pairs of further arguments to the calculator, e.g input_path, output_path.
+        :param kwargs: (key, value) pairs of further arguments to the calculator, e.g input, input_path, output_path.
 
         If both 'parameters' and 'dumpfile' are given, the dumpfile is loaded
         first. Passing a parameters object may be used to update some
@@ -105,6 +121,14 @@ class BaseCalculator(AbstractBaseClass):
             raise TypeError("name should be in str type.")
         # Set data
         self.__data = None
+        # In-memory input, e.g. the data of an upstream calculator.
+        self.__input = kwargs.get("input", None)
+        # Optional on-disk cache of results.
+        self.__cache = None
+        # Records of the instrumented stages, see Instrumentation.
+        self.__metrics = new_records()
+        # Options of the hdf5 output layer, see set_h5_output.
+        self.__h5_output = dict(H5_OUTPUT_DEFAULTS)
 
         if isinstance(parameters, (type(None), CalculatorParameters)):
             self.parameters = parameters
@@ -114,24 +138,73 @@ class BaseCalculator(AbstractBaseClass):
 
         # Must load after setting paramters to avoid being overrode by empty parameters.
         if dumpfile is not None:
-            self.__load_from_dump(dumpfile)
+            with measure(self, 'load', read=dumpfile):
+                if os.path.isdir(dumpfile):
+                    self.__load_from_checkpoint(dumpfile)
+                else:
+                    self.__load_from_dump(dumpfile)
 
         if "output_path" in kwargs:
             self.output_path = kwargs["output_path"]
 
-    def __call__(self, parameters=None, **kwargs):
+    def __init_subclass__(cls, **kwargs):
+        """ Instrument the saveH5 method of derived classes. """
+        super().__init_subclass__(**kwargs)
+        save = cls.__dict__.get('saveH5')
+        # Classes restored by value from dill dumps are already instrumented.
+        if save is not None and not getattr(save, '_instrumented', False):
+            cls.saveH5 = cls._instrument_save(save)
+
+    @staticmethod
+    def _instrument_save(save):
+        """ Wrap a saveH5 method to record its timing and written bytes. """
+        @functools.wraps(save)
+        def instrumented_save(self, *args, **kwargs):
+            def written():
+                if len(args) > 0 and isinstance(args[0], str):
+                    return args[0]
+                for key in ('fname', 'filename'):
+                    if isinstance(kwargs.get(key), str):
+                        return kwargs[key]
+                return getattr(self, 'output_path', None)
+
+            with measure(self, 'saveH5', written):
+                return save(self, *args, **kwargs)
+
+        instrumented_save._instrumented = True
+        return instrumented_save
+
+    def __call__(self, parameters=None, copy_on_write=False, **kwargs):
         """ The copy constructor
 
         :param parameters: The parameters for the new calculator.
         :type  parameters: CalculatorParameters
 
+        :param copy_on_write: If True, the new instance shares the data and
+            the input with this one instead of deep copying them, and gets
+            shallow copies of the parameters, see
+            CalculatorParameters.copy_on_write. Shared array data becomes
+            read-only in both instances, a rerun replaces it.
+        :type  copy_on_write: bool
+
         :param kwargs: key-value pairs of parameters to change in the new instance.
 
         :return: A new parameters instance with optionally changed parameters.
 
         """
 
-        new = copy.deepcopy(self)
+        if copy_on_write:
+            new = self.__shallow_copy(copy_parameters=parameters is None)
+            if is_instance(self.data, "numpy", "ndarray"):
+                # Neither side may modify the shared buffer in place.
+                if self.data.flags.writeable:
+                    data = self.data.view()
+                    data.flags.writeable = False
+                    self._set_data(data)
+                new._set_data(self.data)
+        else:
+            new = copy.deepcopy(self)
+            new.__metrics = new_records()
 
         new.__dict__.update(kwargs)
 
@@ -140,12 +213,116 @@ class BaseCalculator(AbstractBaseClass):
 
         return new
 
+    def __shallow_copy(self, copy_parameters=True):
+        """ Returns a shallow copy with its own records and, optionally,
+        copies of the parameters. This instance is left unchanged.
+        """
+        new = copy.copy(self)
+        if copy_parameters and self.parameters is not None:
+            new.parameters = self.parameters.copy_on_write()
+        new.__metrics = new_records()
+        return new
+
+    def scan(self, parameter_values: dict, workers=None):
+        """ Run copies of this calculator over a grid of parameter values.
+
+        This calculator, its data and its parameters are left unchanged.
+
+        :param parameter_values: Values to scan for each parameter name. The
+            grid is the cartesian product of all value lists.
+        :type  parameter_values: dict
+
+        :param workers: Number of worker processes. Default is the number of
+            processors on the machine. If 1, the scan runs in this process.
+        :type  workers: int
+
+        :return: One dict per grid point with the keys 'parameters' (the
+            values of this point), 'status' and 'data'.
+
+        Example:
+        ```
+        results = calculator.scan({"photon_energy": [6e3, 8e3, 10e3],
+                                   "pulse_energy": [1e-3, 2e-3]},
+                                  workers=4)
+        ```
+
+        """
+        import numpy
+
+        names = list(parameter_values.keys())
+        for name in names:
+            legal = self.parameters[name].is_legal_many(parameter_values[name])
+            if not numpy.all(legal):
+                illegal = numpy.asarray(parameter_values[name])[~legal]
+                raise ValueError(
+                    "Values {} of parameter '{}' are illegal.".format(
+                        list(illegal), name))
+
+        points = [
+            dict(zip(names, values))
+            for values in itertools.product(
+                *[parameter_values[name] for name in names])
+        ]
+
+        calculators = []
+        for point in points:
+            # Every point computes its own data, the data of this calculator
+            # is not sent to the workers.
+            calculator = self.__shallow_copy()
+            calculator._set_data(None)
+            for name in point:
+                calculator.parameters[name] = point[name]
+            calculators.append(calculator)
+
+        if workers == 1:
+            outcomes = [_run_scan_point(c) for c in calculators]
+        else:
+            from concurrent.futures import ProcessPoolExecutor
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                outcomes = list(executor.map(_run_scan_point, calculators))
+
+        return [{
+            'parameters': point,
+            'status': status,
+            'data': data
+        } for point, (status, data) in zip(points, outcomes)]
+
+    def __getstate__(self):
+        """ Replace hdf5 backed data by a reference to its file when pickling.
+
+        The records of this process are not pickled.
+        """
+        state = self.__dict__.copy()
+        state.pop('_BaseCalculator__metrics', None)
+        data = state.get('_BaseCalculator__data')
+        if is_instance(data, "h5py", "Dataset"):
+            data.file.flush()
+            state['_BaseCalculator__data'] = None
+            state['_BaseCalculator__h5_data'] = (data.file.filename, data.name)
+        return state
+
+    def __setstate__(self, state):
+        """ Reopen hdf5 backed data when unpickling. """
+        reference = state.pop('_BaseCalculator__h5_data', None)
+        if reference is not None:
+            import h5py
+            fname, dataset = reference
+            state['_BaseCalculator__data'] = h5py.File(fname, "r")[dataset]
+        self.__dict__.update(state)
+        self.__set_defaults()
+
+    def __set_defaults(self):
+        """ Add the attributes missing in calculators saved by older versions. """
+        self.__dict__.setdefault('_BaseCalculator__input', None)
+        self.__dict__.setdefault('_BaseCalculator__cache', None)
+
     def __load_from_dump(self, dumpfile):
         """ """
         """
         Load a dill dump and initialize self's internals.
 
         """
+        import dill
 
         with open(dumpfile, 'rb') as fhandle:
             try:
@@ -154,10 +331,183 @@ class BaseCalculator(AbstractBaseClass):
                 raise IOError(
                     "Cannot load calculator from {}.".format(dumpfile))
 
-        self.__dict__ = copy.deepcopy(tmp.__dict__)
+        # tmp is discarded, its state can be taken over without copying.
+        self.__dict__ = tmp.__dict__
+        self.__set_defaults()
 
         del tmp
 
+    def __load_from_checkpoint(self, dirname, mmap=False):
+        """
+        Load a checkpoint directory and initialize self's internals.
+
+        """
+        import dill
+        try:
+            with open(os.path.join(dirname, _CHECKPOINT_MANIFEST), 'r') as fp:
+                manifest = json.load(fp)
+        except (OSError, ValueError):
+            raise IOError("Cannot load calculator from {}.".format(dirname))
+
+        state = dict(manifest['attributes'])
+        if manifest['state'] is not None:
+            with open(os.path.join(dirname, manifest['state']), 'rb') as fhandle:
+                state.update(dill.load(fhandle))
+
+        if manifest['parameters'] is not None:
+            state['_BaseCalculator__parameters'] = CalculatorParameters.from_json(
+                os.path.join(dirname, manifest['parameters']))
+        state.setdefault('_BaseCalculator__parameters', None)
+
+        block = manifest['data']
+        data = None
+        if block['format'] == 'npy':
+            import numpy
+            data = numpy.load(os.path.join(dirname, block['file']),
+                              mmap_mode='r' if mmap else None)
+            if mmap:
+                # Lets checkpoint() recognize the unchanged block.
+                state['_BaseCalculator__mapped_block'] = id(data)
+        elif block['format'] == 'dill':
+            with open(os.path.join(dirname, block['file']), 'rb') as fhandle:
+                data = dill.load(fhandle)
+        elif block['format'] == 'h5':
+            state['_BaseCalculator__h5_data'] = (block['file'],
+                                                 block['dataset'])
+        state['_BaseCalculator__data'] = data
+        state['name'] = manifest['name']
+
+        self.__dict__ = {}
+        self.__setstate__(state)
+
+    @classmethod
+    def from_checkpoint(cls, dirname, mmap=False):
+        """
+        Restore a calculator from a checkpoint directory.
+
+        :param dirname: The directory written by `checkpoint`.
+        :type  dirname: str
+
+        :param mmap: If True, memory-map the data block instead of reading it.
+        :type  mmap: bool
+
+        :return: The restored calculator, an instance of the checkpointed class.
+
+        """
+        with open(os.path.join(dirname, _CHECKPOINT_MANIFEST), 'r') as fp:
+            manifest = json.load(fp)
+        module = importlib.import_module(manifest['module'])
+        klass = getattr(module, manifest['class'])
+
+        # The constructors of derived classes have different signatures.
+        calculator = klass.__new__(klass)
+        with measure(calculator, 'load', read=dirname):
+            calculator.__load_from_checkpoint(dirname, mmap=mmap)
+
+        return calculator
+
+    def checkpoint(self, dirname=None):
+        """
+        Write a checkpoint of this calculator to a directory.
+
+        The directory holds a json manifest, the parameters as json and the data
+        as a separate block: array data is written as raw .npy file that can be
+        memory-mapped on load, data in hdf5 files is referenced, other data is
+        pickled. An array block that is memory-mapped from the same directory
+        is not rewritten, so checkpointing a restored calculator again only
+        updates the manifest and the parameters.
+
+        :param dirname: The directory to write to. Default is a new directory
+            in the current working directory.
+        :type  dirname: str
+
+        :return: The checkpoint directory.
+
+        """
+        if dirname is None:
+            dirname = mkdtemp(suffix="_checkpoint",
+                              prefix=self.__class__.__name__,
+                              dir=os.getcwd())
+        os.makedirs(dirname, exist_ok=True)
+
+        with measure(self, 'checkpoint', dirname):
+            self.__write_checkpoint(dirname)
+
+        return dirname
+
+    def __write_checkpoint(self, dirname):
+        """ Write the checkpoint files, see checkpoint. """
+        import dill
+        state = self.__getstate__()
+        data = state.pop('_BaseCalculator__data')
+        h5_data = state.pop('_BaseCalculator__h5_data', None)
+        parameters = state.pop('_BaseCalculator__parameters')
+        mapped_block = state.pop('_BaseCalculator__mapped_block', None)
+        name = state.pop('name')
+
+        if h5_data is not None:
+            block = {
+                'format': 'h5',
+                'file': os.path.abspath(h5_data[0]),
+                'dataset': h5_data[1]
+            }
+        elif data is None:
+            block = {'format': 'none'}
+        elif is_instance(data, "numpy", "ndarray") and data.dtype != object:
+            import numpy
+            block = {'format': 'npy', 'file': 'data.npy'}
+            fname = os.path.join(dirname, block['file'])
+            is_current = (mapped_block == id(data)
+                          and isinstance(data, numpy.memmap)
+                          and os.path.isfile(fname)
+                          and os.path.samefile(data.filename, fname))
+            if not is_current:
+                numpy.save(fname, data)
+        else:
+            block = {'format': 'dill', 'file': 'data.dill'}
+            with open(os.path.join(dirname, block['file']), 'wb') as fhandle:
+                dill.dump(data, fhandle)
+
+        parameters_file = None
+        if parameters is not None:
+            if _json_round_trips(parameters.to_dict()):
+                parameters_file = 'parameters.json'
+                parameters.to_json(os.path.join(dirname, parameters_file))
+            else:
+                # Values json cannot represent, e.g. numpy arrays or tuples.
+                state['_BaseCalculator__parameters'] = parameters
+
+        # Remaining attributes go to the manifest if json restores them
+        # unchanged, e.g. tuples would come back as lists.
+        attributes = {}
+        pickled = {}
+        for key, value in state.items():
+            if _json_round_trips(value):
+                attributes[key] = value
+            else:
+                pickled[key] = value
+
+        state_file = None
+        if len(pickled) > 0:
+            state_file = 'state.dill'
+            with open(os.path.join(dirname, state_file), 'wb') as fhandle:
+                dill.dump(pickled, fhandle)
+
+        manifest = {
+            'module': self.__class__.__module__,
+            'class': self.__class__.__qualname__,
+            'name': name,
+            'parameters': parameters_file,
+            'data': block,
+            'attributes': attributes,
+            'state': state_file,
+        }
+        # The manifest is written last so partial checkpoints are not loaded.
+        tmp = os.path.join(dirname, _CHECKPOINT_MANIFEST + '.tmp')
+        with open(tmp, 'w') as fp:
+            json.dump(manifest, fp, indent=4)
+        os.replace(tmp, os.path.join(dirname, _CHECKPOINT_MANIFEST))
+
     @property
     def parameters(self):
         """ The parameters of this calculator. """
@@ -174,6 +524,34 @@ class BaseCalculator(AbstractBaseClass):
 
         self.__parameters = val
 
+    @property
+    def metrics(self):
+        """ Records of the instrumented stages (run, saveH5, dump, checkpoint,
+        load) of this calculator, the last Instrumentation.MAX_RECORDS ones,
+        see Instrumentation.measure. """
+
+        # Loaded calculators start without records.
+        metrics = self.__dict__.get('_BaseCalculator__metrics')
+        if metrics is None:
+            metrics = self.__metrics = new_records()
+        return metrics
+
+    @property
+    def cache(self):
+        """ The result cache of this calculator, None if caching is disabled. """
+
+        return self.__cache
+
+    @cache.setter
+    def cache(self, val):
+
+        if not isinstance(val, (type(None), ResultCache)):
+            raise TypeError(
+                """Passed argument 'cache' has wrong type. Expected ResultCache, found {}."""
+                .format(type(val)))
+
+        self.__cache = val
+
     def dump(self, fname=None):
         """
         Dump class instance to file.
@@ -181,6 +559,7 @@ class BaseCalculator(AbstractBaseClass):
         :param fname: Filename (path) of the file to write.
 
         """
+        import dill
 
         if fname is None:
             _, fname = mkstemp(
@@ -188,11 +567,9 @@ class BaseCalculator(AbstractBaseClass):
                 prefix=self.__class__.__name__[-1],
                 dir=os.getcwd(),
             )
-        try:
+        with measure(self, 'dump', fname):
             with open(fname, "wb") as file_handle:
                 dill.dump(self, file_handle)
-        except:
-            raise
 
         return fname
 
@@ -207,6 +584,239 @@ class BaseCalculator(AbstractBaseClass):
 
         """
 
+    def set_h5_output(self, **options):
+        """ Configure how _write_h5, and thereby saveH5, writes hdf5 files.
+
+        :param chunks: Chunk shape of the datasets, True for automatic chunking
+            or None for contiguous datasets. Default is None.
+
+        :param compression: None, 'gzip' or 'lzf'. Default is None.
+
+        :param compression_opts: The gzip compression level (0-9).
+
+        :param shuffle: If True, apply the shuffle filter before compression.
+
+        :param background: If True, the file is written by a background thread
+            and saveH5 returns immediately, see wait_for_writes. The data must
+            then not be modified in place until the write is finished.
+
+        :param provenance: If True (default), the parameters and the
+            provenance of the calculator are written along with the data, so
+            that from_h5 can restore the calculator from the file alone.
+
+        Example:
+        ```
+        calculator.set_h5_output(compression='gzip', compression_opts=4,
+                                 shuffle=True, background=True)
+        calculator.saveH5("output.h5")
+        calculator.wait_for_writes()
+        ```
+
+        """
+        self.__h5_output = check_h5_output(options)
+
+    @property
+    def h5_output(self):
+        """ The options of the hdf5 output layer, see set_h5_output. """
+        # Calculators dumped by older versions have no output options.
+        return dict(
+            self.__dict__.get('_BaseCalculator__h5_output',
+                              H5_OUTPUT_DEFAULTS))
+
+    def _write_h5(self, fname, datasets, attributes=None):
+        """ Write datasets to an hdf5 file with the options of set_h5_output.
+
+        Derived classes use this in saveH5 instead of creating datasets
+        directly.
+
+        If the data of this calculator is an hdf5 dataset in fname, see
+        _create_h5_data, the file is not overwritten. The other datasets,
+        parameters and provenance are added to it synchronously.
+
+        :param fname: The file to write, it is overwritten.
+        :type  fname: str
+
+        :param datasets: Dict path -> data of the datasets to write.
+        :type  datasets: dict
+
+        :param attributes: Dict path -> dict of attributes.
+        :type  attributes: dict
+
+        :return: The future of the write in background mode, else None.
+
+        """
+        options = self.h5_output
+        background = options.pop('background')
+        parameters = None
+        if options.pop('provenance', True):
+            attributes = dict(attributes or {})
+            attributes[PROVENANCE_GROUP] = self.__provenance()
+            parameters = self.parameters
+            if background and parameters is not None:
+                # The parameters may change before the write is finished.
+                parameters = copy.deepcopy(parameters)
+
+        data = self.__data
+        if (is_instance(data, "h5py", "Dataset") and data.id.valid
+                and os.path.abspath(data.file.filename) == os.path.abspath(fname)):
+            # The data already lives in the file, which is still open.
+            datasets = {
+                path: value
+                for path, value in datasets.items() if value is not data
+            }
+            dataset = data.name
+            self.__close_h5_data()
+            try:
+                write_h5(fname, datasets, attributes, options, parameters,
+                         mode="a")
+            finally:
+                self.open_h5_data(fname, dataset)
+            return None
+
+        if background:
+            return submit_h5(self, fname, datasets, attributes, options,
+                             parameters)
+
+        write_h5(fname, datasets, attributes, options, parameters)
+        return None
+
+    def __provenance(self):
+        """ The provenance attributes written by _write_h5. """
+        # Data, parameters and input are stored separately or not at all,
+        # per-process records are dropped. Attributes json does not restore
+        # unchanged are pickled.
+        skipped = ('_BaseCalculator__data', '_BaseCalculator__h5_data',
+                   '_BaseCalculator__parameters', '_BaseCalculator__input',
+                   '_BaseCalculator__metrics', '_BaseCalculator__mapped_block',
+                   'name')
+        attributes = {}
+        pickled = {}
+        for key, value in self.__getstate__().items():
+            if key in skipped:
+                continue
+            if _json_round_trips(value):
+                attributes[key] = value
+            else:
+                pickled[key] = value
+
+        provenance = {
+            'module': self.__class__.__module__,
+            'class': self.__class__.__qualname__,
+            'name': self.name,
+            'attributes': json.dumps(attributes),
+        }
+        if len(pickled) > 0:
+            import dill
+            import numpy
+            for key in list(pickled):
+                try:
+                    pickled[key] = dill.dumps(pickled[key])
+                except Exception:
+                    del pickled[key]
+                    logger.warning("Attribute %s of %s is not saved.",
+                                   key,
+                                   self.name,
+                                   exc_info=True)
+            provenance['pickled'] = numpy.void(dill.dumps(pickled))
+        try:
+            provenance['fingerprint'] = self.fingerprint()
+        except Exception:
+            # E.g. an input that cannot be pickled, the file is still written.
+            logger.debug("No fingerprint of %s.", self.name, exc_info=True)
+        return provenance
+
+    def fingerprint(self):
+        """ Hash of the class, parameters and input of this calculator.
+
+        Calculators with equal fingerprints compute the same result, see
+        ResultCache.
+
+        :return: The hex digest.
+
+        """
+        return calculator_fingerprint(self)
+
+    @staticmethod
+    def fingerprint_from_h5(fname):
+        """ Read the fingerprint of the calculator that wrote an hdf5 file.
+
+        Only the attributes are read, not the data.
+
+        :param fname: A file written by saveH5.
+        :type  fname: str
+
+        :return: The fingerprint, None if the file has no provenance or the
+            fingerprint could not be computed.
+
+        """
+        import h5py
+        with h5py.File(fname, "r") as h5:
+            if PROVENANCE_GROUP not in h5:
+                return None
+            return h5[PROVENANCE_GROUP].attrs.get('fingerprint')
+
+    @classmethod
+    def from_h5(cls, fname, dataset="/data", lazy=False):
+        """
+        Restore a calculator from an hdf5 file written by saveH5.
+
+        :param fname: A file written with provenance, see set_h5_output.
+        :type  fname: str
+
+        :param dataset: The dataset holding the data.
+        :type  dataset: str
+
+        :param lazy: If True, the data is read from the file on access
+            instead of loading it, see open_h5_data.
+        :type  lazy: bool
+
+        :return: The restored calculator, an instance of the class that wrote
+            the file.
+
+        """
+        import h5py
+        with h5py.File(fname, "r") as h5:
+            if PROVENANCE_GROUP not in h5:
+                raise IOError(
+                    "{} was written without provenance.".format(fname))
+            provenance = dict(h5[PROVENANCE_GROUP].attrs)
+            parameters = None
+            if PARAMETERS_GROUP in h5:
+                parameters = CalculatorParameters._from_h5_group(
+                    h5[PARAMETERS_GROUP])
+            data = None
+            if not lazy and dataset in h5:
+                data = h5[dataset][()]
+
+        module = importlib.import_module(provenance['module'])
+        klass = getattr(module, provenance['class'])
+
+        # The constructors of derived classes have different signatures.
+        calculator = klass.__new__(klass)
+        with measure(calculator, 'load', read=fname):
+            state = json.loads(provenance['attributes'])
+            if 'pickled' in provenance:
+                import dill
+                pickled = dill.loads(provenance['pickled'].tobytes())
+                for key in pickled:
+                    state[key] = dill.loads(pickled[key])
+            state['name'] = provenance['name']
+            state['_BaseCalculator__parameters'] = parameters
+            state['_BaseCalculator__data'] = data
+            if lazy:
+                state['_BaseCalculator__h5_data'] = (fname, dataset)
+            calculator.__setstate__(state)
+
+        return calculator
+
+    def wait_for_writes(self):
+        """ Wait until all background writes of this calculator are finished.
+
+        Errors raised while writing are raised here.
+
+        """
+        wait_h5(self)
+
     @property
     def data(self):
         return self.__data
@@ -215,36 +825,340 @@ class BaseCalculator(AbstractBaseClass):
     def data(self, val):
         raise AttributeError("Attribute 'data' is read-only.")
 
+    def _create_h5_data(self,
+                        shape,
+                        dtype="f8",
+                        fname=None,
+                        dataset="/data",
+                        chunks=True,
+                        **kwargs):
+        """ Create a chunked hdf5 dataset and use it as data of this calculator.
+
+        The backengine then writes its result slice by slice into the returned
+        dataset instead of holding it in memory. After the run, the data is
+        reopened read-only, downstream code reads it slice by slice.
+
+        :param shape: The shape of the dataset.
+        :type  shape: tuple
+
+        :param dtype: The data type of the dataset.
+
+        :param fname: The file to create the dataset in. Default is output_path.
+        :type  fname: str
+
+        :param dataset: The path of the dataset inside the file.
+        :type  dataset: str
+
+        :param chunks: The chunk shape, True for automatic chunking.
+
+        :param kwargs: Further arguments to h5py.Group.create_dataset, e.g.
+            compression.
+
+        :return: The writable h5py dataset.
+
+        """
+        import h5py
+
+        if fname is None:
+            fname = self.output_path
+        self.__close_h5_data()
+
+        h5 = h5py.File(fname, "a")
+        if dataset in h5:
+            del h5[dataset]
+        self.__data = h5.create_dataset(dataset,
+                                        shape=shape,
+                                        dtype=dtype,
+                                        chunks=chunks,
+                                        **kwargs)
+        return self.__data
+
+    def open_h5_data(self, fname=None, dataset="/data", mmap=False):
+        """ Use a dataset of an hdf5 file as data without reading it.
+
+        :param fname: The file to open. Default is output_path.
+        :type  fname: str
+
+        :param dataset: The path of the dataset inside the file.
+        :type  dataset: str
+
+        :param mmap: If True, memory-map the dataset into a numpy array. Only
+            possible for contiguous, uncompressed datasets.
+        :type  mmap: bool
+
+        :return: The read-only h5py dataset or numpy memmap.
+
+        """
+        import h5py
+
+        if fname is None:
+            fname = self.output_path
+        self.__close_h5_data()
+
+        h5 = h5py.File(fname, "r")
+        data = h5[dataset]
+        if mmap:
+            offset = data.id.get_offset()
+            if offset is None or data.chunks is not None:
+                h5.close()
+                raise ValueError(
+                    "Only contiguous, uncompressed datasets can be memory-mapped."
+                )
+            import numpy
+            data = numpy.memmap(fname,
+                                dtype=data.dtype,
+                                mode="r",
+                                offset=offset,
+                                shape=data.shape)
+            h5.close()
+
+        self.__data = data
+        return data
+
+    def __finish_h5_data(self):
+        """ Reopen data written by the backengine in read-only mode. """
+        data = self.__data
+        if is_instance(data, "h5py", "Dataset") and data.file.mode != "r":
+            fname, dataset = data.file.filename, data.name
+            self.open_h5_data(fname, dataset)
+
+    def __close_h5_data(self):
+        """ Close the file backing the current data, if any. """
+        data = self.__data
+        if is_instance(data, "h5py", "Dataset") and data.id.valid:
+            data.file.close()
+
+    @property
+    def input(self):
+        """ The in-memory input of this calculator, e.g. the data of the
+        upstream calculator in an Instrument. """
+        return self.__input
+
+    @input.setter
+    def input(self, val):
+        self.__input = val
+
     @abstractmethod
     def backengine(self):
         pass
 
+    def backengine_command(self):
+        """
+        The command line of an external backengine executable.
+
+        Calculators whose backengine is an external program may return its
+        argument list here, arun then runs it as an asyncio subprocess instead
+        of blocking a thread. After the program succeeded,
+        collect_backengine_output is called to read its result.
+
+        :return: The argument list, or None if the backengine is Python code.
+        :rtype: list
+
+        """
+        return None
+
+    def collect_backengine_output(self):
+        """
+        Read the output of the external backengine, see backengine_command.
+
+        Derived classes typically read the files written by the program and
+        set the data.
+
+        :return: status code.
+
+        """
+        return 0
+
     @classmethod
-    def run_from_cli(cls):
+    def run_from_cli(cls, argv=None):
         """
         Method to start calculator computations from command line.
 
-        :return: exit with status code
+        Any number of dumpfiles or checkpoint directories, and manifest files
+        listing one of them per line, are processed in one interpreter,
+        optionally by a pool of worker processes. The status of each file is
+        printed.
+
+        Example:
+        ```
+        python my_calculator.py a.dill b.dill --manifest jobs.txt --workers 4
+        ```
+
+        :param argv: The command line arguments. Default is sys.argv[1:].
+        :type  argv: list
+
+        :return: exit with status code, 0 if all calculations succeeded.
+
+        """
+        import argparse
+
+        logging.basicConfig(format='%(asctime)s %(levelname)s:%(message)s',
+                            level=logging.WARNING)
+        parser = argparse.ArgumentParser(
+            description="Run {} calculators from dumpfiles.".format(
+                cls.__name__))
+        parser.add_argument("dumpfiles",
+                            nargs="*",
+                            help="Dumpfiles or checkpoint directories.")
+        parser.add_argument("--manifest",
+                            action="append",
+                            default=[],
+                            help="File listing one dumpfile per line.")
+        parser.add_argument("--workers",
+                            type=int,
+                            default=1,
+                            help="Number of worker processes.")
+        # Options may come between dumpfiles, e.g. a.dill --workers 2 b.dill.
+        args = parser.parse_intermixed_args(argv)
+
+        dumpfiles = list(args.dumpfiles)
+        for manifest in args.manifest:
+            with open(manifest, 'r') as fhandle:
+                dumpfiles += [
+                    line.strip() for line in fhandle
+                    if line.strip() and not line.startswith("#")
+                ]
+        if len(dumpfiles) == 0:
+            parser.error("No dumpfile given.")
+
+        # Files given more than once, e.g. also in a manifest, run once.
+        dumpfiles = list(dict.fromkeys(dumpfiles))
+        statuses = cls.run_dumpfiles(dumpfiles, workers=args.workers)
+        for fname in dumpfiles:
+            print("{}: {}".format(fname, statuses[fname]))
+
+        if len(dumpfiles) == 1:
+            sys.exit(statuses[dumpfiles[0]])
+        sys.exit(int(any(status != 0 for status in statuses.values())))
+
+    @classmethod
+    def run_dumpfiles(cls, dumpfiles, workers=1):
+        """
+        Load and run calculators from dumpfiles or checkpoint directories.
+
+        :param dumpfiles: The files to process.
+        :type  dumpfiles: list
+
+        :param workers: Number of worker processes. If 1, the files are
+            processed in this process. None for the number of processors.
+        :type  workers: int
+
+        :return: Dict fname -> status code. Files that could not be loaded or
+            whose run raised an error have status 1. Files listed more than
+            once are run once.
 
         """
-        if len(sys.argv) == 2:
-            fname = sys.argv[1]
-            calculator = cls(fname)
-            status = calculator._run()
-            sys.exit(status)
+        dumpfiles = list(dict.fromkeys(dumpfiles))
+        if workers == 1:
+            outcomes = [_run_dumpfile(cls, fname) for fname in dumpfiles]
+        else:
+            from concurrent.futures import ProcessPoolExecutor
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                outcomes = list(
+                    executor.map(_run_dumpfile, [cls] * len(dumpfiles),
+                                 dumpfiles))
+        return dict(zip(dumpfiles, outcomes))
 
     def _run(self):
         """
         Method to do computations. By default starts backengine.
 
+        If a result cache is set, the backengine is skipped when a result for
+        the same calculator class, parameters and input is cached.
+
         :return: status code.
 
         """
-        result = self.backengine()
+        with measure(self, 'run') as record:
+            result = self.__run()
+            if record is not None:
+                record['status'] = result
+        return result
+
+    async def arun(self, executor=None):
+        """
+        Asynchronous version of _run.
+
+        If backengine_command returns a command line, the external program is
+        run as an asyncio subprocess and collect_backengine_output is called
+        afterwards. Otherwise _run is executed in an executor. Many
+        calculators can so be kept in flight from a single event loop.
+
+        Example:
+        ```
+        async def run_all(calculators):
+            return await asyncio.gather(*[c.arun() for c in calculators])
 
+        statuses = asyncio.run(run_all(calculators))
+        ```
+
+        :param executor: The executor for Python backengines. Default is the
+            default executor of the event loop.
+        :type  executor: concurrent.futures.Executor
+
+        :return: status code.
+
+        """
+        import asyncio
+
+        command = self.backengine_command()
+        if command is None:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(executor, self._run)
+
+        with measure(self, 'run') as record:
+            key, found = self.__load_cached()
+            if found:
+                result = 0
+            else:
+                process = await asyncio.create_subprocess_exec(*command)
+                result = await process.wait()
+                if result == 0:
+                    result = self.collect_backengine_output()
+                result = self.__finish_run(result, key)
+            if record is not None:
+                record['status'] = result
+        return result
+
+    def __run(self):
+        """ Run the backengine or restore its result from the cache. """
+        key, found = self.__load_cached()
+        if found:
+            return 0
+
+        return self.__finish_run(self.backengine(), key)
+
+    def __load_cached(self):
+        """ Restore the data from the cache.
+
+        :return: Tuple (key, found), the key is None without cache.
+
+        """
+        cache = self.cache
+        if cache is None:
+            return None, False
+        key = cache.key(self)
+        found, data = cache.load(key)
+        if found:
+            self._set_data(data)
+        return key, found
+
+    def __finish_run(self, result, key):
+        """ Finish the data of a backengine run and store it in the cache.
+
+        :return: status code.
+
+        """
         if result is None:
             result = 0
 
+        self.__finish_h5_data()
+
+        # Data kept in hdf5 files is not copied into the cache.
+        if key is not None and result == 0 and not is_instance(
+                self.data, "h5py", "Dataset"):
+            self.cache.store(key, self.data)
+
         return result
 
     def _set_data(self, data):
@@ -258,6 +1172,22 @@ class BaseCalculator(AbstractBaseClass):
         self.__data = data
 
 
+def _run_dumpfile(cls, fname):
+    """ Load and run a single dumpfile, possibly in a worker process. """
+    try:
+        calculator = cls(os.path.basename(fname), dumpfile=fname)
+        return calculator._run()
+    except Exception:
+        logger.exception("Running dumpfile %s failed.", fname)
+        return 1
+
+
+def _run_scan_point(calculator):
+    """ Run a single scan point, executed in a worker process. """
+    status = calculator._run()
+    return status, calculator.data
+
+
 # Mocks for testing. Have to be here to work around bug in dill that does not
 # like classes to be defined outside of __main__.
 class SpecializedCalculator(BaseCalculator):
@@ -279,6 +1209,7 @@ class SpecializedCalculator(BaseCalculator):
         self.parameters['pulse_energy'].set_value(pulse_energy)
 
     def backengine(self):
+        import numpy
         self._BaseCalculator__data = numpy.random.normal(
             loc=self.parameters['photon_energy'].value,
             scale=0.001 * self.parameters['photon_energy'].value,
@@ -287,10 +1218,7 @@ class SpecializedCalculator(BaseCalculator):
         return 0
 
     def saveH5(self, openpmd=False):
-        with h5py.File(self.output_path, "w") as h5:
-            ds = h5.create_dataset("/data", data=self.data)
-
-            h5.close()
+        return self._write_h5(self.output_path, {"/data": self.data})
 
 
 # This project has received funding from the European Union's Horizon 2020 research and innovation programme under grant agreement No. 823852.
@@ -0,0 +1,221 @@
+"""
+:module H5Output: Module hosting the hdf5 output layer shared by all calculators.
+"""
+
+####################################################################################
+#                                                                                  #
+# This file is part of libpyvinyl - The APIs for Virtual Neutron and x-raY            #
+# Laboratory.                                                                      #
+#                                                                                  #
+# Copyright (C) 2020  Carsten Fortmann-Grote                                       #
+#                                                                                  #
+# This program is free software: you can redistribute it and/or modify it under    #
+# the terms of the GNU Lesser General Public License as published by the Free      #
+# Software Foundation, either version 3 of the License, or (at your option) any    #
+# later version.                                                                   #
+#                                                                                  #
+# This program is distributed in the hope that it will be useful, but WITHOUT ANY  #
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A  #
+# PARTICULAR PURPOSE.  See the GNU Lesser General Public License for more details. #
+#                                                                                  #
+# You should have received a copy of the GNU Lesser General Public License along   #
+# with this program.  If not, see <https://www.gnu.org/licenses/                   #
+#                                                                                  #
+####################################################################################
+
+import logging
+import threading
+import weakref
+from libpyvinyl.Instrumentation import measure
+
+logger = logging.getLogger(__name__)
+
+# Default output options, contiguous and uncompressed datasets written
+# synchronously, with parameters and provenance.
+DEFAULT_OPTIONS = {
+    'chunks': None,
+    'compression': None,
+    'compression_opts': None,
+    'shuffle': False,
+    'background': False,
+    'provenance': True,
+}
+
+# Groups holding the parameters and the provenance attributes of the
+# calculator that wrote a file.
+PARAMETERS_GROUP = "/parameters"
+PROVENANCE_GROUP = "/provenance"
+
+# A single writer thread, hdf5 serializes file access anyway.
+_executor = None
+_executor_lock = threading.Lock()
+
+# Pending background writes per calculator.
+_pending = weakref.WeakKeyDictionary()
+
+
+def check_options(options):
+    """
+    Check output options and complete them with the defaults.
+
+    :param options: The options to check.
+    :type  options: dict
+
+    :return: The complete options.
+
+    """
+    for key in options:
+        if key not in DEFAULT_OPTIONS:
+            raise KeyError("Unknown hdf5 output option '{}'.".format(key))
+    if options.get('compression') not in (None, 'gzip', 'lzf'):
+        raise ValueError("compression should be None, 'gzip' or 'lzf'.")
+    complete = dict(DEFAULT_OPTIONS)
+    complete.update(options)
+    return complete
+
+
+def dataset_options(data, options):
+    """
+    Keyword arguments to h5py.Group.create_dataset for the given data.
+
+    Scalars and empty arrays cannot be chunked and are written without filters.
+
+    :param data: The data of the dataset.
+
+    :param options: The output options, see DEFAULT_OPTIONS.
+    :type  options: dict
+
+    """
+    import numpy
+    data = numpy.asarray(data)
+    if data.ndim == 0 or data.size == 0:
+        return {}
+
+    kwargs = {}
+    chunks = options['chunks']
+    if options['compression'] is not None or options['shuffle']:
+        # Filters need chunked storage.
+        if chunks is None:
+            chunks = True
+        if options['compression'] is not None:
+            kwargs['compression'] = options['compression']
+            if options['compression_opts'] is not None:
+                kwargs['compression_opts'] = options['compression_opts']
+        if options['shuffle']:
+            kwargs['shuffle'] = True
+    if chunks is not None:
+        if chunks is not True:
+            # Chunks may not exceed the dataset shape.
+            chunks = tuple(
+                min(chunk, size) for chunk, size in zip(chunks, data.shape))
+        kwargs['chunks'] = chunks
+    return kwargs
+
+
+def write_h5(fname,
+             datasets,
+             attributes=None,
+             options=None,
+             parameters=None,
+             mode="w"):
+    """
+    Write datasets, attributes and parameters to an hdf5 file.
+
+    :param fname: The file to write.
+    :type  fname: str
+
+    :param datasets: Dict path -> data of the datasets to write.
+    :type  datasets: dict
+
+    :param attributes: Dict path -> dict of attributes of groups or datasets.
+    :type  attributes: dict
+
+    :param options: The output options, see DEFAULT_OPTIONS.
+    :type  options: dict
+
+    :param parameters: Parameters to write to PARAMETERS_GROUP. If they
+        cannot be written, the file is written without them and a warning is
+        logged.
+    :type  parameters: CalculatorParameters
+
+    :param mode: "w" overwrites the file, "a" adds to it and replaces the
+        datasets and parameters written before, other content is kept.
+    :type  mode: str
+
+    """
+    import h5py
+    options = check_options(options or {})
+    with h5py.File(fname, mode) as h5:
+        for path in datasets:
+            data = datasets[path]
+            if path in h5:
+                del h5[path]
+            h5.create_dataset(path,
+                              data=data,
+                              **dataset_options(data, options))
+        if parameters is not None:
+            if PARAMETERS_GROUP in h5:
+                del h5[PARAMETERS_GROUP]
+            try:
+                parameters._to_h5_group(
+                    h5.create_group(PARAMETERS_GROUP, track_order=True))
+            except Exception:
+                del h5[PARAMETERS_GROUP]
+                logger.warning("Parameters not written to %s.",
+                               fname,
+                               exc_info=True)
+        if attributes is not None:
+            for path in attributes:
+                node = h5[path] if path in h5 else h5.require_group(path)
+                for key in attributes[path]:
+                    node.attrs[key] = attributes[path][key]
+
+
+def _measured_write_h5(calculator, fname, datasets, attributes, options,
+                       parameters):
+    """ Run write_h5 recorded as 'write' stage of the calculator. """
+    with measure(calculator, 'write', fname):
+        write_h5(fname, datasets, attributes, options, parameters)
+
+
+def submit(calculator,
+           fname,
+           datasets,
+           attributes=None,
+           options=None,
+           parameters=None):
+    """
+    Write in the background writer thread, see write_h5.
+
+    :param calculator: The calculator the write belongs to, see wait.
+    :type  calculator: BaseCalculator
+
+    :return: The future of the write.
+
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            from concurrent.futures import ThreadPoolExecutor
+            _executor = ThreadPoolExecutor(max_workers=1,
+                                           thread_name_prefix="libpyvinyl-h5")
+        future = _executor.submit(_measured_write_h5, calculator, fname,
+                                  datasets, attributes, options, parameters)
+        _pending.setdefault(calculator, []).append(future)
+    return future
+
+
+def wait(calculator):
+    """
+    Wait for all background writes of a calculator.
+
+    Errors of the writes are raised here.
+
+    :param calculator: The calculator to wait for.
+    :type  calculator: BaseCalculator
+
+    """
+    with _executor_lock:
+        futures = _pending.pop(calculator, [])
+    for future in futures:
+        future.result()
@@ -3,7 +3,13 @@
 """
 
 from libpyvinyl.Parameters.Collections import InstrumentParameters
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from pathlib import Path
+import queue
+import threading
+
+# Marks the end of the shot stream between pipeline stages.
+_END_OF_STREAM = object()
 
 
 class Instrument():
@@ -19,6 +25,13 @@ class Instrument():
         self.__name = name
         self.__calculators = {}
         self.__parameters = InstrumentParameters()
+        # Explicit input links per calculator, None for the default chain.
+        self.__inputs = {}
+        # State of the parameters and inputs at the last run of each
+        # calculator, recorded once dirty_calculators or skip_unchanged is
+        # used.
+        self.__states = {}
+        self.__track_states = False
         if calculators is not None:
             for calculator in calculators:
                 self.add_calculator(calculator)
@@ -75,10 +88,415 @@ class Instrument():
     def list_parameters(self):
         print(self.parameters)
 
-    def add_calculator(self, calculator):
+    def add_calculator(self, calculator, inputs=None):
+        """Add a calculator to the instrument.
+
+        :param calculator: The calculator to add.
+        :type calculator: BaseCalculator
+        :param inputs: Names of the calculators whose data is the input of
+            this one. Default is the previously added calculator, so that
+            calculators added one after the other form a chain. Pass an empty
+            list for a calculator without upstream calculator.
+        :type inputs: list
+        """
         self.__calculators[calculator.name] = calculator
         self.__parameters.add(calculator.name, calculator.parameters)
+        self.__inputs[calculator.name] = None if inputs is None else list(
+            inputs)
+        self.__states.clear()
+
+    def add_link(self, source, target):
+        """Use the data of one calculator as input of another one.
+
+        :param source: The name of the upstream calculator.
+        :type source: str
+        :param target: The name of the downstream calculator.
+        :type target: str
+        """
+        inputs = self.inputs_of(target)
+        if source not in inputs:
+            inputs.append(source)
+        self.__inputs[target] = inputs
+        self.__states.clear()
+
+    def inputs_of(self, calculator_name):
+        """The names of the calculators feeding a calculator.
+
+        :param calculator_name: The name of the calculator.
+        :type calculator_name: str
+        :return: The names of the upstream calculators.
+        :rtype: list
+        """
+        inputs = self.__inputs[calculator_name]
+        if inputs is not None:
+            return list(inputs)
+        names = list(self.calculators.keys())
+        index = names.index(calculator_name)
+        return [] if index == 0 else [names[index - 1]]
 
     def remove_calculator(self, calculator_name):
         del self.__calculators[calculator_name]
         del self.__parameters[calculator_name]
+        del self.__inputs[calculator_name]
+        for inputs in self.__inputs.values():
+            if inputs is not None and calculator_name in inputs:
+                inputs.remove(calculator_name)
+        self.__states.clear()
+
+    def graph(self):
+        """The data dependencies between the calculators.
+
+        :return: Dict calculator name -> names of its upstream calculators,
+            in topological order.
+        :rtype: dict
+        :raises ValueError: If the links contain a cycle.
+        :raises KeyError: If a link refers to an unknown calculator.
+        """
+        inputs = {name: self.inputs_of(name) for name in self.calculators}
+        consumers = {name: [] for name in inputs}
+        for name in inputs:
+            for source in inputs[name]:
+                if source not in consumers:
+                    raise KeyError(
+                        "Calculator '{}' linked to '{}' is not in the instrument."
+                        .format(source, name))
+                consumers[source].append(name)
+
+        waiting = {name: len(inputs[name]) for name in inputs}
+        ready = [name for name in inputs if waiting[name] == 0]
+        order = []
+        while ready:
+            name = ready.pop(0)
+            order.append(name)
+            for consumer in consumers[name]:
+                waiting[consumer] -= 1
+                if waiting[consumer] == 0:
+                    ready.append(consumer)
+        if len(order) != len(inputs):
+            raise ValueError("The links between calculators {} form a cycle.".format(
+                [name for name in inputs if name not in order]))
+        return {name: inputs[name] for name in order}
+
+    def report(self):
+        """The instrumentation records of all calculators, see
+        `libpyvinyl.Instrumentation.summarize` for totals per stage.
+
+        :return: The records in order of the calculators.
+        :rtype: list
+        """
+        records = []
+        for calculator in self.calculators.values():
+            records += calculator.metrics
+        return records
+
+    def run(self, shots=1, pipelined=False, workers=None, skip_unchanged=False):
+        """Run the calculators along their data dependencies.
+
+        The data of each calculator is handed in memory to its downstream
+        calculators through their `input` attribute, no intermediate file is
+        written. A calculator with several upstream calculators gets a dict
+        name -> data as input. Calculators that do not depend on each other,
+        e.g. several detectors fed by one source, run concurrently in a thread
+        pool.
+
+        :param shots: Number of times the whole graph is executed.
+        :type shots: int
+        :param pipelined: If True, every calculator of a chain runs in its own
+            thread so that stage N of shot k overlaps with stage N+1 of shot
+            k-1. The backengines must then create a new `data` object on each
+            run instead of modifying the previous one in place.
+        :type pipelined: bool
+        :param workers: Number of threads for independent branches. If 1, the
+            calculators run one after the other in this thread.
+        :type workers: int
+        :param skip_unchanged: If True, only the calculators returned by
+            `dirty_calculators` run again, all others keep their data. E.g.
+            after changing a sample parameter, the source and beamline stages
+            are not rerun.
+        :type skip_unchanged: bool
+        :return: The data of the last calculator for each shot. If the graph
+            ends in several calculators, a dict name -> data for each shot.
+        :rtype: list
+        """
+        if shots < 1:
+            raise ValueError("shots should be a positive integer.")
+        if skip_unchanged:
+            self.__track_states = True
+        graph = self.graph()
+        if len(graph) == 0:
+            return []
+        if pipelined and len(graph) > 1:
+            if not self.__is_chain(graph):
+                raise ValueError(
+                    "Pipelined runs need a linear chain of calculators.")
+            return self.__run_pipelined(
+                [self.calculators[name] for name in graph], shots)
+
+        sinks = self.__sinks(graph)
+        results = []
+        for shot in range(shots):
+            if workers == 1 or self.__is_chain(graph):
+                data = self.__run_serial(graph, skip_unchanged)
+            else:
+                data = self.__run_parallel(graph, workers, skip_unchanged)
+            if len(sinks) == 1:
+                results.append(data[sinks[0]])
+            else:
+                results.append({name: data[name] for name in sinks})
+        return results
+
+    @staticmethod
+    def __sinks(graph):
+        """The calculators no other calculator depends on."""
+        sources = set()
+        for inputs in graph.values():
+            sources.update(inputs)
+        return [name for name in graph if name not in sources]
+
+    def __is_chain(self, graph):
+        """True if the graph is a single linear chain."""
+        return (all(len(inputs) <= 1 for inputs in graph.values())
+                and len(self.__sinks(graph)) == 1
+                and sum(len(inputs) == 0 for inputs in graph.values()) == 1)
+
+    def dirty_calculators(self):
+        """The calculators that need to run again.
+
+        A calculator is dirty if it never ran as part of this instrument, if
+        the version of its parameters changed since its last run, e.g. by
+        setting a master parameter, or if one of its upstream calculators is
+        dirty. For calculators without upstream calculator, setting another
+        input object counts as well, changes of the input in place do not.
+
+        States are recorded by the runs following the first call of this
+        method or of a run with skip_unchanged.
+
+        :return: The names of the dirty calculators in topological order.
+        :rtype: list
+        """
+        self.__track_states = True
+        graph = self.graph()
+        dirty = []
+        for name in graph:
+            if self.__changed(name, graph) or any(source in dirty
+                                                  for source in graph[name]):
+                dirty.append(name)
+        return dirty
+
+    def __state(self, name, graph):
+        """The state of the parameters and inputs of a calculator."""
+        calculator = self.calculators[name]
+        parameters = calculator.parameters
+        # The input of a source is set from outside the instrument, it is
+        # tracked by identity.
+        source_input = calculator.input if len(graph[name]) == 0 else None
+        return (id(parameters),
+                None if parameters is None else parameters.version,
+                source_input)
+
+    def __changed(self, name, graph):
+        """True if a calculator's state differs from its last run."""
+        if name not in self.__states:
+            return True
+        previous = self.__states[name]
+        current = self.__state(name, graph)
+        return previous[:2] != current[:2] or previous[2] is not current[2]
+
+    def __record_state(self, name, graph):
+        """Record the state of a calculator after it ran."""
+        if self.__track_states:
+            self.__states[name] = self.__state(name, graph)
+
+    def __prepare(self, name, graph, results, changed, skip_unchanged):
+        """Set the input of a calculator from the results of its upstream
+        calculators.
+
+        :return: False if the calculator can keep its previous data.
+        """
+        calculator = self.calculators[name]
+        sources = graph[name]
+        if len(sources) == 1:
+            calculator.input = results[sources[0]]
+        elif len(sources) > 1:
+            calculator.input = {source: results[source] for source in sources}
+        if not skip_unchanged:
+            return True
+
+        return (self.__changed(name, graph)
+                or any(source in changed for source in sources))
+
+    def __run_serial(self, graph, skip_unchanged):
+        """Run the calculators one after the other in topological order."""
+        results = {}
+        changed = set()
+        for name in graph:
+            calculator = self.calculators[name]
+            if self.__prepare(name, graph, results, changed, skip_unchanged):
+                self.__run_checked(calculator)
+                self.__record_state(name, graph)
+                changed.add(name)
+            results[name] = calculator.data
+        return results
+
+    def __run_parallel(self, graph, workers, skip_unchanged):
+        """Run the calculators in a thread pool as soon as their inputs are
+        available."""
+        consumers = {name: [] for name in graph}
+        for name in graph:
+            for source in graph[name]:
+                consumers[source].append(name)
+        waiting = {name: len(graph[name]) for name in graph}
+        results = {}
+        changed = set()
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {}
+            ready = [name for name in graph if waiting[name] == 0]
+            while ready or futures:
+                finished = []
+                for name in ready:
+                    if self.__prepare(name, graph, results, changed,
+                                      skip_unchanged):
+                        future = executor.submit(self.__run_checked,
+                                                 self.calculators[name])
+                        futures[future] = name
+                    else:
+                        finished.append(name)
+                ready = []
+
+                if len(finished) == 0:
+                    done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        name = futures.pop(future)
+                        try:
+                            future.result()
+                        except Exception:
+                            for pending in futures:
+                                pending.cancel()
+                            raise
+                        self.__record_state(name, graph)
+                        changed.add(name)
+                        finished.append(name)
+
+                for name in finished:
+                    results[name] = self.calculators[name].data
+                    for consumer in consumers[name]:
+                        waiting[consumer] -= 1
+                        if waiting[consumer] == 0:
+                            ready.append(consumer)
+        return results
+
+    def __run_pipelined(self, chain, shots):
+        """Run the chain with one thread per calculator connected by queues."""
+        queues = [queue.Queue() for i in range(len(chain) + 1)]
+        errors = []
+        threads = []
+        for i, calculator in enumerate(chain):
+            thread = threading.Thread(target=self.__stage_worker,
+                                      args=(calculator, queues[i],
+                                            queues[i + 1], errors),
+                                      daemon=True)
+            thread.start()
+            threads.append(thread)
+
+        first_input = chain[0].input
+        for shot in range(shots):
+            queues[0].put((shot, first_input))
+        queues[0].put(_END_OF_STREAM)
+
+        for thread in threads:
+            thread.join()
+        if errors:
+            raise errors[0]
+
+        results = [None] * shots
+        while True:
+            item = queues[-1].get()
+            if item is _END_OF_STREAM:
+                break
+            shot, data = item
+            results[shot] = data
+        return results
+
+    def __stage_worker(self, calculator, inbox, outbox, errors):
+        """Process shots from inbox until the end of the stream is reached."""
+        while True:
+            item = inbox.get()
+            if item is _END_OF_STREAM:
+                outbox.put(item)
+                return
+            # After a failure the remaining shots are drained without running.
+            if errors:
+                continue
+            shot, data = item
+            try:
+                outbox.put((shot, self.__run_stage(calculator, data)))
+            except Exception as e:
+                errors.append(e)
+
+    async def arun(self, shots=1):
+        """Asynchronous version of `run` without pipelining.
+
+        Each calculator is awaited through its `arun` method, so external
+        backengines do not block the event loop and many instruments can be
+        run concurrently from one loop. Independent branches of the graph run
+        concurrently.
+
+        :param shots: Number of times the whole graph is executed.
+        :type shots: int
+        :return: The data of the last calculator for each shot. If the graph
+            ends in several calculators, a dict name -> data for each shot.
+        :rtype: list
+        """
+        import asyncio
+
+        if shots < 1:
+            raise ValueError("shots should be a positive integer.")
+        graph = self.graph()
+        if len(graph) == 0:
+            return []
+        sinks = self.__sinks(graph)
+
+        async def run_calculator(name, tasks, results):
+            for source in graph[name]:
+                await tasks[source]
+            self.__prepare(name, graph, results, set(), False)
+            calculator = self.calculators[name]
+            self.__check_status(calculator, await calculator.arun())
+            self.__record_state(name, graph)
+            results[name] = calculator.data
+
+        results = []
+        for shot in range(shots):
+            data = {}
+            tasks = {}
+            for name in graph:
+                tasks[name] = asyncio.ensure_future(
+                    run_calculator(name, tasks, data))
+            await asyncio.gather(*tasks.values())
+            if len(sinks) == 1:
+                results.append(data[sinks[0]])
+            else:
+                results.append({name: data[name] for name in sinks})
+        return results
+
+    @staticmethod
+    def __check_status(calculator, status):
+        """Raise if a calculator returned a non-zero status."""
+        if status != 0:
+            raise RuntimeError(
+                "Calculator '{}' returned status {}.".format(
+                    calculator.name, status))
+
+    @staticmethod
+    def __run_stage(calculator, data):
+        """Run a single calculator on the given input and return its data."""
+        calculator.input = data
+        status = calculator._run()
+        Instrument.__check_status(calculator, status)
+        return calculator.data
+
+    @staticmethod
+    def __run_checked(calculator):
+        """Run a calculator whose input is set already."""
+        Instrument.__check_status(calculator, calculator._run())
@@ -0,0 +1,234 @@
+"""
+:module Instrumentation: Module hosting the timing and memory instrumentation
+of calculators.
+"""
+
+####################################################################################
+#                                                                                  #
+# This file is part of libpyvinyl - The APIs for Virtual Neutron and x-raY            #
+# Laboratory.                                                                      #
+#                                                                                  #
+# Copyright (C) 2020  Carsten Fortmann-Grote                                       #
+#                                                                                  #
+# This program is free software: you can redistribute it and/or modify it under    #
+# the terms of the GNU Lesser General Public License as published by the Free      #
+# Software Foundation, either version 3 of the License, or (at your option) any    #
+# later version.                                                                   #
+#                                                                                  #
+# This program is distributed in the hope that it will be useful, but WITHOUT ANY  #
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A  #
+# PARTICULAR PURPOSE.  See the GNU Lesser General Public License for more details. #
+#                                                                                  #
+# You should have received a copy of the GNU Lesser General Public License along   #
+# with this program.  If not, see <https://www.gnu.org/licenses/                   #
+#                                                                                  #
+####################################################################################
+
+from collections import deque
+from contextlib import contextmanager
+import json
+import os
+import sys
+import threading
+import time
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows.
+    resource = None
+
+# Callables receiving every record, see add_hook.
+_hooks = []
+
+# Number of records kept per calculator, older records are dropped. Hooks
+# receive all records, e.g. to keep a complete log with JsonLinesHook.
+MAX_RECORDS = 1000
+
+# Stages currently measured in this thread, nested measurements of the same
+# stage, e.g. through super().saveH5(), are only recorded once.
+_active = threading.local()
+
+
+def add_hook(hook):
+    """
+    Register a callable that is called with every record.
+
+    :param hook: Callable taking the record dict as only argument.
+
+    """
+    _hooks.append(hook)
+
+
+def remove_hook(hook):
+    """
+    Unregister a callable registered with add_hook.
+
+    :param hook: The callable to remove.
+
+    """
+    _hooks.remove(hook)
+
+
+def new_records():
+    """
+    An empty record list of a calculator, holding up to MAX_RECORDS records.
+
+    """
+    return deque(maxlen=MAX_RECORDS)
+
+
+def peak_rss():
+    """
+    The peak resident set size of this process in bytes, None if unknown.
+
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes.
+    if sys.platform != "darwin":
+        peak *= 1024
+    return peak
+
+
+def path_size(path):
+    """
+    Size of a file, or of all files below a directory, in bytes.
+
+    :param path: The file or directory.
+    :type  path: str
+
+    :return: The size in bytes, None if the path does not exist.
+
+    """
+    if path is None or not os.path.exists(path):
+        return None
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    size = 0
+    for dirpath, _, fnames in os.walk(path):
+        for fname in fnames:
+            size += os.path.getsize(os.path.join(dirpath, fname))
+    return size
+
+
+@contextmanager
+def measure(calculator, stage, path=None, read=None):
+    """
+    Record wall time, CPU time, peak RSS and bytes written or read of a stage.
+
+    The record is appended to calculator.metrics, which keeps the last
+    MAX_RECORDS records, and passed to all hooks.
+
+    :param calculator: The calculator running the stage.
+    :type  calculator: BaseCalculator
+
+    :param stage: The name of the stage, e.g. 'run' or 'saveH5'.
+    :type  stage: str
+
+    :param path: File or directory written by the stage, or a callable
+        returning it after the stage finished.
+
+    :param read: File or directory read by the stage.
+
+    """
+    active = getattr(_active, "stages", None)
+    if active is None:
+        active = _active.stages = set()
+    key = (id(calculator), stage)
+    if key in active:
+        yield None
+        return
+
+    active.add(key)
+    record = {'stage': stage, 'start': time.time()}
+    peak_before = peak_rss()
+    wall = time.perf_counter()
+    cpu = time.process_time()
+    try:
+        yield record
+    finally:
+        active.discard(key)
+        # Looked up at the end, loading a dump replaces the name.
+        record['calculator'] = getattr(calculator, 'name', None)
+        record['class'] = calculator.__class__.__name__
+        record['wall_time'] = time.perf_counter() - wall
+        record['cpu_time'] = time.process_time() - cpu
+        record['peak_rss'] = peak_rss()
+        if peak_before is None:
+            record['peak_rss_increase'] = None
+        else:
+            record['peak_rss_increase'] = record['peak_rss'] - peak_before
+        if callable(path):
+            path = path()
+        record['bytes_written'] = path_size(path)
+        record['bytes_read'] = path_size(read)
+
+        calculator.metrics.append(record)
+        for hook in list(_hooks):
+            hook(record)
+
+
+def summarize(records):
+    """
+    Sum up records per calculator and stage.
+
+    :param records: The records, e.g. Instrument.report().
+    :type  records: list
+
+    :return: Dict (calculator, stage) -> dict with the number of calls and the
+        summed wall time, CPU time and bytes written and read, and the maximum
+        peak RSS.
+
+    """
+    summary = {}
+    for record in records:
+        key = (record['calculator'], record['stage'])
+        entry = summary.setdefault(
+            key, {
+                'calls': 0,
+                'wall_time': 0.0,
+                'cpu_time': 0.0,
+                'bytes_written': 0,
+                'bytes_read': 0,
+                'peak_rss': None
+            })
+        entry['calls'] += 1
+        entry['wall_time'] += record['wall_time']
+        entry['cpu_time'] += record['cpu_time']
+        entry['bytes_written'] += record['bytes_written'] or 0
+        # Records written by older versions have no bytes read
+        entry['bytes_read'] += record.get('bytes_read') or 0
+        if record['peak_rss'] is not None:
+            entry['peak_rss'] = max(entry['peak_rss'] or 0, record['peak_rss'])
+    return summary
+
+
+class JsonLinesHook():
+    """
+    :class JsonLinesHook: Hook appending every record as one json line to a
+    local metrics file.
+
+    Example:
+    ```
+    hook = JsonLinesHook("metrics.jsonl")
+    add_hook(hook)
+    instrument.run()
+    remove_hook(hook)
+    ```
+    """
+    def __init__(self, fname):
+        """
+        :param fname: The metrics file to append to.
+        :type  fname: str
+
+        """
+        self.fname = fname
+        self.__lock = threading.Lock()
+
+    def __call__(self, record):
+        line = json.dumps(record)
+        with self.__lock:
+            with open(self.fname, 'a') as fp:
+                fp.write(line + "\n")
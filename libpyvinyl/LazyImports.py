@@ -0,0 +1,50 @@
+"""
+:module LazyImports: Module hosting helpers for heavy dependencies (dill, h5py,
+numpy) that are only imported on the code paths that need them.
+"""
+
+####################################################################################
+#                                                                                  #
+# This file is part of libpyvinyl - The APIs for Virtual Neutron and x-raY            #
+# Laboratory.                                                                      #
+#                                                                                  #
+# Copyright (C) 2020  Carsten Fortmann-Grote                                       #
+#                                                                                  #
+# This program is free software: you can redistribute it and/or modify it under    #
+# the terms of the GNU Lesser General Public License as published by the Free      #
+# Software Foundation, either version 3 of the License, or (at your option) any    #
+# later version.                                                                   #
+#                                                                                  #
+# This program is distributed in the hope that it will be useful, but WITHOUT ANY  #
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A  #
+# PARTICULAR PURPOSE.  See the GNU Lesser General Public License for more details. #
+#                                                                                  #
+# You should have received a copy of the GNU Lesser General Public License along   #
+# with this program.  If not, see <https://www.gnu.org/licenses/                   #
+#                                                                                  #
+####################################################################################
+
+import sys
+
+
+def is_instance(obj, module, name):
+    """
+    Check the type of an object against a class of a module without importing
+    the module.
+
+    An object can only be an instance of the class if its module has been
+    imported already, so e.g. checking for hdf5 datasets does not import h5py.
+
+    :param obj: The object to check.
+
+    :param module: The name of the module defining the class, e.g. 'h5py'.
+    :type  module: str
+
+    :param name: The name of the class in the module, e.g. 'Dataset'.
+    :type  name: str
+
+    :return: True if obj is an instance of module.name.
+
+    """
+    module = sys.modules.get(module)
+    return module is not None and isinstance(obj, getattr(module, name))
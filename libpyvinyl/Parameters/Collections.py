@@ -1,8 +1,20 @@
 # Created by Mads Bertelsen and modified by Juncheng E
 
+import copy
 import json
 from libpyvinyl.AbstractBaseClass import AbstractBaseClass
-from .Parameter import Parameter
+from .Parameter import Parameter, _VERSIONS
+
+# Changed whenever the Parameter object behind a name may have changed, i.e.
+# parameters or calculators were added or deleted, or parameters were shared
+# or unshared by copy-on-write. Invalidates the links compiled by
+# MasterParameters.
+_layout = 0
+
+
+def _layout_changed():
+    global _layout
+    _layout += 1
 
 
 class CalculatorParameters(AbstractBaseClass):
@@ -16,6 +28,8 @@ class CalculatorParameters(AbstractBaseClass):
         Creates a Parameters object, optionally with list of parameter objects
         """
         self.parameters = {}
+        # Changed when parameters are added or deleted, see version
+        self._revision = 0
         if parameters is not None:
             self.add(parameters)
 
@@ -50,6 +64,8 @@ class CalculatorParameters(AbstractBaseClass):
                         "Duplicate parameter name in parameters!")
 
                 self.parameters[par.name] = par
+            self._revision = next(_VERSIONS)
+            _layout_changed()
             return
 
         # handle case where single parameter is given
@@ -58,6 +74,8 @@ class CalculatorParameters(AbstractBaseClass):
             raise RuntimeError("Duplicate parameter name in parameters!")
 
         self.parameters[parameter.name] = parameter
+        self._revision = next(_VERSIONS)
+        _layout_changed()
 
     def new_parameter(self, *args, **kwargs):
         """
@@ -80,23 +98,57 @@ class CalculatorParameters(AbstractBaseClass):
         """
         Sets value of parameter with given key to given value
         """
-        self.parameters[key].set_value(value)
+        self[key].set_value(value)
 
     def __delitem__(self, key):
         """
         Deletes parameter with given key
         """
         del self.parameters[key]
+        self._revision = next(_VERSIONS)
+        _layout_changed()
+
+    @property
+    def version(self):
+        """
+        Number that changes whenever a parameter is added, deleted or set
+        through set_value, e.g. by a master parameter. Compare versions for
+        equality to find out whether the parameters changed.
+        """
+        # Collections and parameters pickled by older versions have no
+        # revision or version
+        version = self.__dict__.get('_revision', 0)
+        for parameter in self.parameters.values():
+            version = max(version, getattr(parameter, '_version', 0))
+        return version
+
+    def copy_on_write(self):
+        """
+        Returns a copy holding shallow copies of the Parameter objects
+
+        The copy is isolated from this collection, also from Parameter objects
+        obtained from it before, while the values and the compiled constraints
+        are shared instead of deep copied. Parameters are small slotted
+        objects, so this is much cheaper than copy.deepcopy. Array values are
+        shared, modify them by setting a new array, not in place.
+        """
+        new = copy.copy(self)
+        new.parameters = {
+            key: copy.copy(parameter)
+            for key, parameter in self.parameters.items()
+        }
+        _layout_changed()
+        return new
 
     def print_indented(self, indents):
         """
         returns string describing this object, can optionally be indented
         """
-        string = indents * " " + " - Parameters object -\n"
-        for key in self.parameters:
-            string += indents * " " + self.parameters[key].print_line() + "\n"
+        lines = [indents * " " + " - Parameters object -"]
+        for parameter in self.parameters.values():
+            lines.append(indents * " " + parameter.print_line())
 
-        return string
+        return "\n".join(lines) + "\n"
 
     def __repr__(self):
         return self.print_indented(0)
@@ -131,10 +183,10 @@ class CalculatorParameters(AbstractBaseClass):
         return parameters
 
     def to_dict(self):
-        params = {}
-        for key in self.parameters:
-            params[key] = self.parameters[key].__dict__
-        return params
+        return {
+            key: parameter.to_dict()
+            for key, parameter in self.parameters.items()
+        }
 
     def to_json(self, fname: str):
         """
@@ -147,6 +199,63 @@ class CalculatorParameters(AbstractBaseClass):
         with open(fname, 'w') as fp:
             json.dump(self.to_dict(), fp, indent=4)
 
+    def to_h5(self, fname: str, group: str = "/"):
+        """
+        Save this parameters class to a binary hdf5 file.
+
+        Every parameter is a subgroup holding its value, constraints and
+        options as typed datasets, so array values are stored natively.
+
+        :param fname: Write to this file, it is overwritten.
+        :type  fname: str
+
+        :param group: The group of the file to write the parameters to.
+        :type  group: str
+
+        """
+        import h5py
+        with h5py.File(fname, 'w', track_order=True) as h5:
+            h5group = h5
+            if group.strip('/') != '':
+                h5group = h5.create_group(group, track_order=True)
+            self._to_h5_group(h5group)
+
+    def _to_h5_group(self, h5group):
+        """
+        Writes one subgroup per parameter into an h5py group
+        """
+        for key, parameter in self.parameters.items():
+            parameter.to_h5(h5group.create_group(key, track_order=True))
+
+    @classmethod
+    def from_h5(cls, fname: str, group: str = "/"):
+        """
+        Initialize an instance from an hdf5 file written by to_h5.
+
+        Only the given group is read, e.g. the parameters of a single
+        calculator in an instrument file.
+
+        :param fname: The filename (path) of the hdf5 file.
+        :type  fname: str
+
+        :param group: The group holding the parameters.
+        :type  group: str
+
+        """
+        import h5py
+        with h5py.File(fname, 'r') as h5:
+            return cls._from_h5_group(h5[group])
+
+    @classmethod
+    def _from_h5_group(cls, h5group):
+        """
+        Reads the parameters written by _to_h5_group from an h5py group
+        """
+        parameters = cls()
+        for key in h5group:
+            parameters.add(Parameter.from_h5(h5group[key]))
+        return parameters
+
 
 class MasterParameter(Parameter):
     """
@@ -155,6 +264,8 @@ class MasterParameter(Parameter):
     system is added that contains information on which Parameters objects this
     master parameter should control parameters from.
     """
+    __slots__ = ('links', )
+
     def __init__(self, *args, **kwargs):
         """
         Create MasterParameter with uninitialized links
@@ -165,8 +276,12 @@ class MasterParameter(Parameter):
     def add_links(self, links):
         """
         Links is a dict with key being reference to calculator and name of parameter to overwrite
+
+        Changing the links dict in place afterwards is not noticed by
+        MasterParameters, call add_links again instead.
         """
         self.links = links
+        _layout_changed()
 
 
 class MasterParameters(CalculatorParameters):
@@ -185,20 +300,84 @@ class MasterParameters(CalculatorParameters):
         responsible.
         """
         self.parameters_dict = parameters_dict
+        # Linked Parameter objects per master parameter, see __targets
+        self._compiled = {}
         super().__init__(*args, **kwargs)
 
+    def __targets(self, key):
+        """
+        Returns the Parameter objects linked to a master parameter
+
+        The links are resolved once and reused until parameters or calculators
+        are added, deleted or copied on write. Adding calculators by changing
+        parameters_dict directly is not noticed.
+        """
+        # MasterParameters pickled by older versions have no compiled links
+        compiled = self.__dict__.setdefault('_compiled', {})
+        entry = compiled.get(key)
+        if entry is not None and entry[0] == _layout:
+            return entry[1]
+
+        links = self.parameters[key].links
+        targets = []
+        if links is not None:
+            for calculator in links:
+                targets.append(self.parameters_dict[calculator][links[calculator]])
+        # Resolving may unshare parameters, so the layout is read afterwards
+        compiled[key] = (_layout, targets)
+        return targets
+
+    def set_many(self, values):
+        """
+        Sets several master parameters and all their linked parameters at once
+
+        All values are checked against the constraints of the master
+        parameters and of their linked parameters first. Nothing is changed if
+        any of them is illegal.
+
+        :param values: Dict master parameter name -> value.
+        :type  values: dict
+
+        :raises ValueError: If a value is illegal for a master parameter or one
+            of its linked parameters, or if two master parameters set the same
+            parameter to different values.
+        """
+        assignments = []
+        assigned = {}
+        for key in values:
+            value = values[key]
+            master_parameter = self.parameters[key]
+            for parameter in [master_parameter] + self.__targets(key):
+                if not parameter.is_legal(value):
+                    raise ValueError(
+                        "Value {} of master parameter '{}' illegal for "
+                        "parameter '{}'.".format(value, key, parameter.name))
+                if len(values) > 1:
+                    previous = assigned.get(id(parameter))
+                    if previous is not None and previous[1] != value:
+                        raise ValueError(
+                            "Master parameters '{}' and '{}' set parameter "
+                            "'{}' to different values.".format(
+                                previous[0], key, parameter.name))
+                    assigned[id(parameter)] = (key, value)
+                assignments.append((parameter, value))
+
+        # Checked above already, so set_value is bypassed
+        version = next(_VERSIONS)
+        for parameter, value in assignments:
+            parameter.value = value
+            parameter._version = version
+
     def __setitem__(self, key, value):
         """
         Set item that propagates change throughout all links
-        """
-        master_parameter = self.parameters[key]
-
-        if master_parameter.links is not None:
-            for calculator in master_parameter.links:
-                calculator_par_name = master_parameter.links[calculator]
-                self.parameters_dict[calculator][calculator_par_name] = value
 
-        self.parameters[key].set_value(value)
+        If the value is illegal for any linked parameter, nothing is changed.
+        """
+        try:
+            self.set_many({key: value})
+        except ValueError as e:
+            print("WARNING: " + str(e) + " Ignored.")
 
 
 class InstrumentParameters(AbstractBaseClass):
@@ -266,6 +445,67 @@ class InstrumentParameters(AbstractBaseClass):
         with open(fname, 'w') as fp:
             json.dump(self.to_dict(), fp, indent=4)
 
+    def to_h5(self, fname: str):
+        """
+        Save this parameters class to a binary hdf5 file.
+
+        The file holds a group 'Master' with the master parameters and their
+        links and a group 'Calculators' with one group per calculator, see
+        CalculatorParameters.to_h5.
+
+        :param fname: Write to this file, it is overwritten.
+        :type  fname: str
+
+        """
+        import h5py
+        with h5py.File(fname, 'w', track_order=True) as h5:
+            self.master._to_h5_group(
+                h5.create_group('Master', track_order=True))
+            calculators = h5.create_group('Calculators', track_order=True)
+            for key in self.parameters_dict:
+                self.parameters_dict[key]._to_h5_group(
+                    calculators.create_group(key, track_order=True))
+
+    @classmethod
+    def from_h5(cls, fname: str):
+        """
+        Initialize an instance from an hdf5 file written by to_h5.
+
+        :param fname: The filename (path) of the hdf5 file.
+        :type  fname: str
+
+        """
+        import h5py
+        parameters = cls()
+        with h5py.File(fname, 'r') as h5:
+            calculators = h5['Calculators']
+            for key in calculators:
+                parameters.add(
+                    key, CalculatorParameters._from_h5_group(calculators[key]))
+            master = h5['Master']
+            for key in master:
+                parameters.master.add(MasterParameter.from_h5(master[key]))
+
+        return parameters
+
+    @staticmethod
+    def calculator_from_h5(fname: str, key: str):
+        """
+        Load the parameters of a single calculator from an hdf5 file written
+        by to_h5 without reading the others.
+
+        :param fname: The filename (path) of the hdf5 file.
+        :type  fname: str
+
+        :param key: The name of the calculator.
+        :type  key: str
+
+        :return: The parameters of the calculator.
+        :rtype: CalculatorParameters
+
+        """
+        return CalculatorParameters.from_h5(fname, 'Calculators/' + key)
+
     def add(self, key, parameters):
         """
         Here key could be a calculator object or a reference to such an object, like its name
@@ -276,6 +516,7 @@ class InstrumentParameters(AbstractBaseClass):
                 + " was provided with something else.")
 
         self.parameters_dict[key] = parameters
+        _layout_changed()
 
     def add_master_parameter(self, name, links, **kwargs):
         """
@@ -305,6 +546,7 @@ class InstrumentParameters(AbstractBaseClass):
         Allows deletion of parameters of calculator with given name
         """
         del self.parameters_dict[key]
+        _layout_changed()
 
     def __repr__(self):
         """
@@ -1,13 +1,197 @@
 # Created by Mads Bertelsen and modified by Juncheng E
 
+import bisect
+import copy
+import itertools
+import json
 import math
 from libpyvinyl.AbstractBaseClass import AbstractBaseClass
 
 
+class _IntervalIndex():
+    """
+    Sorted, merged open intervals for membership checks by bisection
+    """
+    def __init__(self, intervals):
+        merged = []
+        for min_value, max_value in sorted(
+            (interval[0], interval[1]) for interval in intervals):
+            # An open interval without extent contains no value
+            if not min_value < max_value:
+                continue
+            # Only overlapping intervals are merged, (1, 2) and (2, 3) still
+            # exclude 2
+            if len(merged) > 0 and min_value < merged[-1][1]:
+                merged[-1][1] = max(merged[-1][1], max_value)
+            else:
+                merged.append([min_value, max_value])
+
+        self.starts = [interval[0] for interval in merged]
+        self.ends = [interval[1] for interval in merged]
+
+    def __contains__(self, value):
+        # The last interval starting below value is the only candidate
+        i = bisect.bisect_left(self.starts, value) - 1
+        return i >= 0 and value < self.ends[i]
+
+    def contains_many(self, values):
+        """
+        Returns a boolean array, True where the value is inside an interval
+        """
+        import numpy
+        if len(self.starts) == 0:
+            return numpy.zeros(values.shape, dtype=bool)
+        i = numpy.searchsorted(self.starts, values, side='left') - 1
+        ends = numpy.asarray(self.ends)[numpy.maximum(i, 0)]
+        return (i >= 0) & (values < ends)
+
+
+# Slot names per Parameter class, see Parameter._fields
+_FIELDS = {}
+
+def _write_h5_item(group, key, value):
+    """
+    Writes a value as dataset of an hdf5 group, with its python type as
+    attribute '<key>_type'. Arrays, numbers, strings and homogeneous lists
+    are stored natively, other values as json if json restores them
+    unchanged, else pickled with dill. None is not written.
+    """
+    import h5py
+    import numpy
+    if value is None:
+        return
+
+    if isinstance(value, numpy.ndarray) or isinstance(value, numpy.generic):
+        kind, data = 'ndarray', numpy.asarray(value)
+    elif isinstance(value, (list, tuple)):
+        kind, data = 'list', None
+        try:
+            data = numpy.asarray(value)
+        except ValueError:
+            # Ragged lists
+            pass
+        # Mixed lists would be coerced, e.g. ints and floats to floats
+        if (data is None or data.dtype == object
+                or not _same_items(data.tolist(), value)):
+            kind = 'json'
+    elif isinstance(value, (bool, int, float, complex, str)):
+        kind, data = type(value).__name__, numpy.asarray(value)
+    else:
+        kind = 'json'
+
+    if kind == 'json' and not _json_round_trips(value):
+        import dill
+        kind = 'dill'
+
+    group.attrs[key + '_type'] = kind
+    if kind == 'json':
+        group.attrs[key + '_json'] = json.dumps(value)
+        return
+    if kind == 'dill':
+        group.attrs[key + '_dill'] = numpy.void(dill.dumps(value))
+        return
+
+    if data.dtype.kind == 'U':
+        group.create_dataset(key,
+                             data=data.astype(object),
+                             dtype=h5py.string_dtype())
+    else:
+        group.create_dataset(key, data=data)
+
+
+def _same_items(restored, value):
+    """
+    True if a list read back equals the written value, including the types of
+    its items
+    """
+    import numpy
+    if isinstance(value, (list, tuple)):
+        return (isinstance(restored, list) and len(restored) == len(value)
+                and all(
+                    _same_items(item, original)
+                    for item, original in zip(restored, value)))
+    if isinstance(value, numpy.generic):
+        value = value.item()
+    return type(restored) is type(value) and restored == value
+
+
+def _json_round_trips(value):
+    """
+    True if json restores value with its types, i.e. not for tuples, dicts
+    with keys other than strings or objects json cannot represent
+    """
+    try:
+        restored = json.loads(json.dumps(value))
+    except (TypeError, ValueError):
+        return False
+    return _same_json(restored, value)
+
+
+def _same_json(restored, value):
+    """
+    True if restored equals value, including the types of all items
+    """
+    if type(restored) is not type(value):
+        return False
+    if isinstance(value, dict):
+        return (list(restored) == list(value) and all(
+            _same_json(restored[key], value[key]) for key in value))
+    if isinstance(value, list):
+        return len(restored) == len(value) and all(
+            _same_json(item, original)
+            for item, original in zip(restored, value))
+    # nan does not equal itself
+    return restored == value or (restored != restored and value != value)
+
+
+def _read_h5_item(group, key, default=None):
+    """
+    Reads a value written by _write_h5_item, default if it was not written
+    """
+    import h5py
+    kind = group.attrs.get(key + '_type')
+    if kind is None:
+        return default
+    if kind == 'json':
+        return json.loads(group.attrs[key + '_json'])
+    if kind == 'dill':
+        import dill
+        return dill.loads(group.attrs[key + '_dill'].tobytes())
+
+    dataset = group[key]
+    if h5py.check_string_dtype(dataset.dtype) is not None:
+        data = dataset.asstr()[()]
+    else:
+        data = dataset[()]
+    if kind == 'ndarray':
+        return data
+    if kind == 'list':
+        return data.tolist()
+    return {
+        'bool': bool,
+        'int': int,
+        'float': float,
+        'complex': complex,
+        'str': str
+    }[kind](data)
+
+
+# Source of parameter versions. Every change draws a new, larger number, so
+# the largest version of a collection changes whenever one of its parameters
+# does.
+_VERSIONS = itertools.count(1)
+
+
 class Parameter(AbstractBaseClass):
     """
     Description of a single parameter
+
+    The attributes are stored in slots instead of a per instance dict, since
+    a calculator can hold thousands of parameters.
     """
+    __slots__ = ('name', 'unit', 'comment', 'value', 'legal_intervals',
+                 'illegal_intervals', 'options', '_constraints', '_version')
+
     def __init__(self, name, unit=None, comment=None):
         """
         Creates parameter with given name, optionally unit and comment
@@ -19,15 +203,145 @@ class Parameter(AbstractBaseClass):
         self.legal_intervals = []
         self.illegal_intervals = []
         self.options = []
+        # Compiled constraints, built on first check and reset when the
+        # constraints are changed through the add_* and clear_* methods
+        self._constraints = None
+        # Changed by set_value and set_values, see version
+        self._version = 0
 
     @classmethod
     def from_dict(cls, param_dict):
         param = cls(param_dict['name'], param_dict['unit'],
                     param_dict['comment'])
+        fields = cls._fields()
         for key in param_dict:
-            param.__dict__[key] = param_dict[key]
+            # Unknown keys, e.g. links of master parameters, are skipped
+            if key in fields and not key.startswith('_'):
+                setattr(param, key, param_dict[key])
+        return param
+
+    @classmethod
+    def _fields(cls):
+        """
+        Returns the names of all slots of this class and its bases
+        """
+        fields = _FIELDS.get(cls)
+        if fields is None:
+            fields = []
+            for klass in reversed(cls.__mro__):
+                slots = klass.__dict__.get('__slots__', ())
+                if isinstance(slots, str):
+                    slots = (slots, )
+                fields += [slot for slot in slots if slot not in fields]
+            fields = tuple(fields)
+            _FIELDS[cls] = fields
+        return fields
+
+    @property
+    def __dict__(self):
+        """
+        The public attributes as dict, see to_dict
+        """
+        return self.to_dict()
+
+    def __getstate__(self):
+        return {
+            key: getattr(self, key)
+            for key in self._fields() if key != '_constraints'
+        }
+
+    def __setstate__(self, state):
+        self._constraints = None
+        for key in state:
+            setattr(self, key, state[key])
+        # Versions are only comparable within one process
+        self._version = next(_VERSIONS)
+
+    def __copy__(self):
+        """
+        Returns a shallow copy with its own constraint lists, sharing the
+        compiled constraints until either side changes its constraints
+        """
+        new = self.__class__.__new__(self.__class__)
+        new.__setstate__(self.__getstate__())
+        new.legal_intervals = copy.copy(self.legal_intervals)
+        new.illegal_intervals = copy.copy(self.illegal_intervals)
+        new.options = copy.copy(self.options)
+        new._constraints = self._constraints
+        new._version = self._version
+        return new
+
+    @property
+    def version(self):
+        """
+        Number that changes whenever the value is set through set_value or
+        set_values. Assigning the value attribute directly is not tracked.
+        """
+        # Parameters pickled by older versions have no version
+        return getattr(self, '_version', 0)
+
+    def to_dict(self):
+        """
+        Returns the public attributes of this parameter as dict
+        """
+        return {
+            key: getattr(self, key)
+            for key in self._fields() if not key.startswith('_')
+        }
+
+    def to_h5(self, group):
+        """
+        Writes this parameter into an hdf5 group
+
+        Array values are stored as datasets, so they keep their type and are
+        not converted to text.
+
+        :param group: The h5py group to write to, usually named after the
+            parameter.
+        """
+        group.attrs['name'] = self.name
+        for key in ('unit', 'comment'):
+            if getattr(self, key) is not None:
+                group.attrs[key] = getattr(self, key)
+        for key in self._fields():
+            if key.startswith('_') or key in ('name', 'unit', 'comment'):
+                continue
+            value = getattr(self, key)
+            # Empty constraint lists are the default
+            if isinstance(value, list) and len(value) == 0:
+                continue
+            _write_h5_item(group, key, value)
+
+    @classmethod
+    def from_h5(cls, group):
+        """
+        Creates a parameter from an hdf5 group written by to_h5
+
+        :param group: The h5py group to read from.
+        """
+        attrs = group.attrs
+        param = cls(attrs['name'], attrs.get('unit'), attrs.get('comment'))
+        for key in cls._fields():
+            if key.startswith('_') or key in ('name', 'unit', 'comment'):
+                continue
+            setattr(param, key, _read_h5_item(group, key, getattr(param, key)))
         return param
 
+    def __compiled_constraints(self):
+        """
+        Returns the (illegal, legal, options) constraints compiled for fast
+        checks. The options are a set if all of them are hashable, else None.
+        """
+        if self._constraints is None:
+            try:
+                options = frozenset(self.options)
+            except TypeError:
+                options = None
+            self._constraints = (_IntervalIndex(self.illegal_intervals),
+                                 _IntervalIndex(self.legal_intervals),
+                                 options)
+        return self._constraints
+
     def add_legal_interval(self, min_value, max_value):
         """
         Sets a legal interval for this parameter, None for infinite
@@ -38,6 +352,7 @@ class Parameter(AbstractBaseClass):
             max_value = math.inf
 
         self.legal_intervals.append([min_value, max_value])
+        self._constraints = None
 
     def add_illegal_interval(self, min_value, max_value):
         """
@@ -49,6 +364,7 @@ class Parameter(AbstractBaseClass):
             max_value = math.inf
 
         self.illegal_intervals.append([min_value, max_value])
+        self._constraints = None
 
     def add_option(self, option):
         """
@@ -58,6 +374,7 @@ class Parameter(AbstractBaseClass):
             self.options += option
         else:
             self.options.append(option)
+        self._constraints = None
 
     def set_value(self, value):
         """
@@ -67,10 +384,69 @@ class Parameter(AbstractBaseClass):
         """
         if self.is_legal(value):
             self.value = value
+            self._version = next(_VERSIONS)
         else:
             print("WARNING: Value of parameter '" + self.name
                   + "' illegal, ignored.")
 
+    def set_values(self, values):
+        """
+        Sets an array of values as value of this parameter if every element is
+        legal, otherwise warning is shown
+        """
+        import numpy
+        if numpy.all(self.is_legal_many(values)):
+            self.value = values
+            self._version = next(_VERSIONS)
+        else:
+            print("WARNING: Values of parameter '" + self.name
+                  + "' illegal, ignored.")
+
+    def is_legal_many(self, values):
+        """
+        Checks an array of values against the constraints at once.
+
+        The constraints are evaluated with the same priorities as in is_legal,
+        but vectorized over all values.
+
+        :return: boolean array with the shape of values, True where legal
+        """
+        import numpy
+        values = numpy.asarray(values)
+        mask = numpy.ones(values.shape, dtype=bool)
+        illegal, legal, _ = self.__compiled_constraints()
+
+        # Check illegal intervals
+        if len(self.illegal_intervals) > 0:
+            mask &= ~illegal.contains_many(values)
+
+        # Check legal intervals
+        if len(self.legal_intervals) > 0:
+            mask &= legal.contains_many(values)
+
+        if len(self.options) > 0:
+            mask &= self.__match_options(values)
+
+        return mask
+
+    def __match_options(self, values):
+        """
+        Returns a boolean array, True where the value equals one of the options
+        """
+        import numpy
+        if values.dtype.kind in "biuf":
+            numeric_options = [
+                option for option in self.options
+                if isinstance(option, (int, float, numpy.number))
+            ]
+            return numpy.isin(values, numeric_options)
+
+        # Strings and mixed objects are compared one by one like in is_legal
+        matches = numpy.fromiter((value in self.options for value in values.flat),
+                                 dtype=bool,
+                                 count=values.size)
+        return matches.reshape(values.shape)
+
     def is_legal(self, value=None):
         """
         Checks whether or not given or contained value is legal given constraints.
@@ -82,24 +458,27 @@ class Parameter(AbstractBaseClass):
         if value is None:
             value = self.value
 
+        illegal, legal, options = self.__compiled_constraints()
+
         # Check illegal intervals
-        for illegal_interval in self.illegal_intervals:
-            if illegal_interval[0] < value < illegal_interval[1]:
-                return False
+        if len(self.illegal_intervals) > 0 and value in illegal:
+            return False
 
         # Check legal intervals
-        is_inside_a_legal_interval = False
-        for legal_interval in self.legal_intervals:
-            if legal_interval[0] < value < legal_interval[1]:
-                is_inside_a_legal_interval = True
-
-        if not is_inside_a_legal_interval and len(self.legal_intervals) > 0:
+        if len(self.legal_intervals) > 0 and value not in legal:
             return False
 
         # checked intervals, can return if options not used (frequent case)
         if len(self.options) == 0:
             return True
 
+        if options is not None:
+            try:
+                return value in options
+            except TypeError:
+                # Unhashable value, compare with each option below
+                pass
+
         for option in self.options:
             if option == value:
                 # If the value matches any option, it is legal
@@ -122,18 +501,21 @@ class Parameter(AbstractBaseClass):
         Clear the legal intervals of this parameter.
         """
         self.legal_intervals = []
+        self._constraints = None
 
     def clear_illegal_intervals(self):
         """
         Clear the illegal intervals of this parameter.
         """
         self.illegal_intervals = []
+        self._constraints = None
 
     def clear_options(self):
         """
         Clear the option values of this parameter.
         """
         self.options = []
+        self._constraints = None
 
     def print_line(self):
         """
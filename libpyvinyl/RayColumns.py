@@ -0,0 +1,157 @@
+"""
+:module RayColumns: Module hosting the columnar hdf5 storage of Shadow rays.
+"""
+
+####################################################################################
+#                                                                                  #
+# This file is part of libpyvinyl - The APIs for Virtual Neutron and x-raY            #
+# Laboratory.                                                                      #
+#                                                                                  #
+# Copyright (C) 2020  Carsten Fortmann-Grote                                       #
+#                                                                                  #
+# This program is free software: you can redistribute it and/or modify it under    #
+# the terms of the GNU Lesser General Public License as published by the Free      #
+# Software Foundation, either version 3 of the License, or (at your option) any    #
+# later version.                                                                   #
+#                                                                                  #
+# This program is distributed in the hope that it will be useful, but WITHOUT ANY  #
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A  #
+# PARTICULAR PURPOSE.  See the GNU Lesser General Public License for more details. #
+#                                                                                  #
+# You should have received a copy of the GNU Lesser General Public License along   #
+# with this program.  If not, see <https://www.gnu.org/licenses/                   #
+#                                                                                  #
+####################################################################################
+
+
+import numpy
+from libpyvinyl.H5Output import check_options, dataset_options
+from libpyvinyl.RayStatistics import FIELD_COLUMNS, FLAG_COLUMN
+
+# Names of the 18 columns of Shadow ray arrays, in order.
+COLUMN_NAMES = [
+    'x', 'y', 'z', 'vx', 'vy', 'vz', 'Es_x', 'Es_y', 'Es_z', 'flag', 'k',
+    'index', 'optical_path', 'phase_s', 'phase_p', 'Ep_x', 'Ep_y', 'Ep_z'
+]
+
+# Derived column computed from the electric fields when read.
+INTENSITY = 'intensity'
+
+# Default storage, gzip compressed chunks of 64k rays per column.
+DEFAULT_OPTIONS = {
+    'chunks': (65536, ),
+    'compression': 'gzip',
+    'compression_opts': 4,
+    'shuffle': True,
+}
+
+
+def column_name(column):
+    """
+    The name of a column.
+
+    :param column: The column number, counting from 1 as Shadow does, or name.
+    :type  column: int | str
+
+    """
+    if isinstance(column, str):
+        if column not in COLUMN_NAMES and column != INTENSITY:
+            raise KeyError("Unknown ray column '{}'.".format(column))
+        return column
+    if not 1 <= column <= len(COLUMN_NAMES):
+        raise KeyError("Ray columns are numbered 1 to {}.".format(
+            len(COLUMN_NAMES)))
+    return COLUMN_NAMES[column - 1]
+
+
+def write_rays(fname, rays, group="/rays", mode="w", **options):
+    """
+    Write a ray array as one dataset per column.
+
+    :param fname: The file to write.
+    :type  fname: str
+
+    :param rays: The ray array of shape (rays, 18), e.g. Shadow.Beam.rays.
+    :type  rays: numpy.ndarray
+
+    :param group: The group holding the columns.
+    :type  group: str
+
+    :param mode: The h5py file mode, "w" overwrites the file, "a" adds the
+        group to it.
+    :type  mode: str
+
+    :param options: Chunking and compression, see DEFAULT_OPTIONS and
+        H5Output.DEFAULT_OPTIONS.
+
+    """
+    import h5py
+    rays = numpy.asarray(rays)
+    if rays.ndim != 2 or rays.shape[1] != len(COLUMN_NAMES):
+        raise ValueError("rays should have shape (rays, {}).".format(
+            len(COLUMN_NAMES)))
+    complete = dict(DEFAULT_OPTIONS)
+    complete.update(options)
+    complete = check_options(complete)
+
+    with h5py.File(fname, mode) as h5:
+        h5group = h5.create_group(group, track_order=True)
+        h5group.attrs['rays'] = rays.shape[0]
+        for i, name in enumerate(COLUMN_NAMES):
+            column = numpy.ascontiguousarray(rays[:, i])
+            h5group.create_dataset(name,
+                                   data=column,
+                                   **dataset_options(column, complete))
+
+
+def read_rays(fname, columns=None, nolost=False, group="/rays"):
+    """
+    Read selected columns of rays written by write_rays.
+
+    Only the datasets of the requested columns are read, plus the flags if
+    nolost.
+
+    :param fname: The file to read.
+    :type  fname: str
+
+    :param columns: Column numbers (from 1) or names, 'intensity' reads the
+        electric fields and returns their squared sum. Default is all 18
+        columns, i.e. a ray array as Shadow.Beam.rays.
+    :type  columns: list
+
+    :param nolost: If True, return only good rays.
+    :type  nolost: bool
+
+    :param group: The group holding the columns.
+    :type  group: str
+
+    :return: Array of shape (rays, len(columns)).
+
+    """
+    import h5py
+    if columns is None:
+        columns = COLUMN_NAMES
+    names = [column_name(column) for column in columns]
+
+    with h5py.File(fname, "r") as h5:
+        h5group = h5[group]
+        n_rays = int(h5group.attrs['rays'])
+        mask = None
+        if nolost:
+            mask = h5group[COLUMN_NAMES[FLAG_COLUMN - 1]][()] > 0
+            n_rays = int(mask.sum())
+
+        def read(name):
+            data = h5group[name][()]
+            return data if mask is None else data[mask]
+
+        rays = numpy.empty((n_rays, len(names)))
+        for i, name in enumerate(names):
+            if name == INTENSITY:
+                # Squared fields summed one column at a time
+                rays[:, i] = 0.0
+                for column in FIELD_COLUMNS:
+                    rays[:, i] += read(COLUMN_NAMES[column - 1])**2
+            else:
+                rays[:, i] = read(name)
+    return rays
@@ -0,0 +1,561 @@
+"""
+:module RayStatistics: Module hosting vectorized statistics of Shadow ray
+arrays and reducers accumulating them batch by batch.
+"""
+
+####################################################################################
+#                                                                                  #
+# This file is part of libpyvinyl - The APIs for Virtual Neutron and x-raY            #
+# Laboratory.                                                                      #
+#                                                                                  #
+# Copyright (C) 2020  Carsten Fortmann-Grote                                       #
+#                                                                                  #
+# This program is free software: you can redistribute it and/or modify it under    #
+# the terms of the GNU Lesser General Public License as published by the Free      #
+# Software Foundation, either version 3 of the License, or (at your option) any    #
+# later version.                                                                   #
+#                                                                                  #
+# This program is distributed in the hope that it will be useful, but WITHOUT ANY  #
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A  #
+# PARTICULAR PURPOSE.  See the GNU Lesser General Public License for more details. #
+#                                                                                  #
+# You should have received a copy of the GNU Lesser General Public License along   #
+# with this program.  If not, see <https://www.gnu.org/licenses/                   #
+#                                                                                  #
+####################################################################################
+
+
+import numpy
+
+# Column of the flag in Shadow ray arrays, counting from 1 as Shadow does.
+# Rays with a positive flag are good, others are lost.
+FLAG_COLUMN = 10
+
+# Columns of the s- and p-polarized electric field vectors, their squared sum
+# is the intensity of a ray (Shadow's column 23).
+FIELD_COLUMNS = [7, 8, 9, 16, 17, 18]
+
+
+def good_rays(rays):
+    """
+    Mask of the good rays.
+
+    :param rays: The ray array of shape (rays, 18).
+    :type  rays: numpy.ndarray
+
+    :return: Boolean array, True for rays that were not lost.
+
+    """
+    return rays[:, FLAG_COLUMN - 1] > 0
+
+
+def ray_intensities(rays):
+    """
+    Intensity of each ray.
+
+    :param rays: The ray array of shape (rays, 18).
+    :type  rays: numpy.ndarray
+
+    :return: Array |E_s|^2 + |E_p|^2 per ray.
+
+    """
+    fields = rays[:, [column - 1 for column in FIELD_COLUMNS]]
+    return numpy.einsum('ij,ij->i', fields, fields)
+
+
+def intensity(rays, nolost=True):
+    """
+    Total intensity of the rays.
+
+    :param rays: The ray array of shape (rays, 18).
+    :type  rays: numpy.ndarray
+
+    :param nolost: If True, sum only good rays.
+    :type  nolost: bool
+
+    """
+    if nolost:
+        rays = rays[good_rays(rays)]
+    return float(ray_intensities(rays).sum())
+
+
+def histogram1d(values, bins, range, weights=None):
+    """
+    Histogram with equal bins, faster than numpy.histogram.
+
+    Values outside of range are not counted, the upper edge belongs to the
+    last bin as in numpy.histogram.
+
+    :param values: The values to count.
+    :type  values: numpy.ndarray
+
+    :param bins: The number of bins.
+    :type  bins: int
+
+    :param range: The (lower, upper) edges of the histogram.
+    :type  range: tuple
+
+    :param weights: Weight of each value. Default is 1.
+    :type  weights: numpy.ndarray
+
+    :return: Array of the bins' sums of weights.
+
+    """
+    lower, upper = range
+    values = numpy.asarray(values)
+    inside = (values >= lower) & (values <= upper)
+    index = ((values[inside] - lower) * (bins / (upper - lower))).astype(
+        numpy.intp)
+    numpy.minimum(index, bins - 1, out=index)
+    if weights is not None:
+        weights = numpy.asarray(weights)[inside]
+    return numpy.bincount(index, weights=weights,
+                          minlength=bins).astype(float)
+
+
+def histogram2d(x, y, bins, range, weights=None):
+    """
+    2D histogram with equal bins, much faster than numpy.histogram2d.
+
+    :param x: The values along the first axis.
+    :type  x: numpy.ndarray
+
+    :param y: The values along the second axis.
+    :type  y: numpy.ndarray
+
+    :param bins: The number of bins, or (bins_x, bins_y).
+    :type  bins: int | tuple
+
+    :param range: ((lower_x, upper_x), (lower_y, upper_y)).
+    :type  range: tuple
+
+    :param weights: Weight of each value pair. Default is 1.
+    :type  weights: numpy.ndarray
+
+    :return: Array of shape (bins_x, bins_y) of the bins' sums of weights.
+
+    """
+    if numpy.ndim(bins) == 0:
+        bins = (bins, bins)
+    x = numpy.asarray(x)
+    y = numpy.asarray(y)
+    (lower_x, upper_x), (lower_y, upper_y) = range
+    inside = (x >= lower_x) & (x <= upper_x) & (y >= lower_y) & (y <= upper_y)
+    index_x = ((x[inside] - lower_x) * (bins[0] / (upper_x - lower_x))).astype(
+        numpy.intp)
+    index_y = ((y[inside] - lower_y) * (bins[1] / (upper_y - lower_y))).astype(
+        numpy.intp)
+    numpy.minimum(index_x, bins[0] - 1, out=index_x)
+    numpy.minimum(index_y, bins[1] - 1, out=index_y)
+    if weights is not None:
+        weights = numpy.asarray(weights)[inside]
+    counts = numpy.bincount(index_x * bins[1] + index_y,
+                            weights=weights,
+                            minlength=bins[0] * bins[1])
+    return counts.astype(float).reshape(bins)
+
+
+def fwhm(counts, edges):
+    """
+    Full width at half maximum of a histogram.
+
+    The half maximum crossings are interpolated linearly between bin centers.
+
+    :param counts: The histogram.
+    :type  counts: numpy.ndarray
+
+    :param edges: The bin edges, one more than counts.
+    :type  edges: numpy.ndarray
+
+    :return: The width, nan for an empty histogram.
+
+    """
+    counts = numpy.asarray(counts, dtype=float)
+    if counts.size == 0 or counts.max() <= 0:
+        return numpy.nan
+    centers = 0.5 * (edges[:-1] + edges[1:])
+    half = 0.5 * counts.max()
+    above = numpy.nonzero(counts >= half)[0]
+    first, last = above[0], above[-1]
+
+    left = centers[first]
+    if first > 0:
+        left -= (counts[first] - half) / (counts[first] - counts[first - 1]) * (
+            centers[first] - centers[first - 1])
+    right = centers[last]
+    if last < counts.size - 1:
+        right += (counts[last] - half) / (counts[last] - counts[last + 1]) * (
+            centers[last + 1] - centers[last])
+    return float(right - left)
+
+
+def centroid(values, weights=None):
+    """
+    Weighted mean of values, e.g. a ray column.
+
+    :param values: The values.
+    :type  values: numpy.ndarray
+
+    :param weights: Weight of each value. Default is 1.
+    :type  weights: numpy.ndarray
+
+    :return: The centroid, nan without values or weights.
+
+    """
+    values = numpy.asarray(values)
+    total = values.size if weights is None else numpy.sum(weights)
+    if total == 0:
+        return numpy.nan
+    return float(numpy.average(values, weights=weights))
+
+
+def beam_statistics(rays, columns=(1, 3), bins=101, nolost=True):
+    """
+    Figures of merit of a beam along some columns.
+
+    :param rays: The ray array of shape (rays, 18).
+    :type  rays: numpy.ndarray
+
+    :param columns: The columns, counting from 1, default x and z.
+    :type  columns: tuple
+
+    :param bins: The number of bins of the histograms the FWHM is taken of.
+    :type  bins: int
+
+    :param nolost: If True, use only good rays.
+    :type  nolost: bool
+
+    :return: Dict with the number of rays 'good', the total 'intensity', and
+        per column the intensity weighted 'centroid', 'rms' and 'fwhm'.
+
+    """
+    mask = good_rays(rays)
+    if nolost:
+        rays = rays[mask]
+    weights = ray_intensities(rays)
+    statistics = {
+        'good': int(mask.sum()),
+        'intensity': float(weights.sum()),
+        'centroid': [],
+        'rms': [],
+        'fwhm': []
+    }
+    for column in columns:
+        values = rays[:, column - 1]
+        mean = centroid(values, weights)
+        statistics['centroid'].append(mean)
+        statistics['rms'].append(
+            numpy.sqrt(centroid((values - mean)**2, weights)))
+        if values.size == 0 or values.min() == values.max():
+            statistics['fwhm'].append(numpy.nan if values.size == 0 else 0.0)
+            continue
+        limits = (values.min(), values.max())
+        edges = numpy.linspace(limits[0], limits[1], bins + 1)
+        statistics['fwhm'].append(
+            fwhm(histogram1d(values, bins, limits, weights), edges))
+    return statistics
+
+
+def merge(reducers):
+    """
+    Merge reducers of the same kind, e.g. returned by worker processes.
+
+    :param reducers: The reducers, the first one accumulates all others.
+    :type  reducers: list
+
+    :return: The first reducer.
+
+    """
+    merged = reducers[0]
+    for reducer in reducers[1:]:
+        merged.merge(reducer)
+    return merged
+
+
+def reduce(batches, reducers):
+    """
+    Feed ray batches to reducers.
+
+    :param batches: Iterable of ray arrays of shape (rays, 18), e.g. the
+        generator of Shadow3Calculator.iter_rays.
+
+    :param reducers: The reducers to update with each batch.
+    :type  reducers: list
+
+    :return: The reducers.
+
+    Example:
+    ```
+    footprint = Histogram2D(1, 3, bins=101, range=((-0.1, 0.1), (-0.1, 0.1)))
+    moments = Moments([1, 3])
+    reduce(calculator.iter_rays(100000), [footprint, moments])
+    ```
+    """
+    for rays in batches:
+        for reducer in reducers:
+            reducer.update(rays)
+    return reducers
+
+
+def _columns(rays, columns, nolost, weighted=False):
+    """
+    The given columns (from 1) of the rays, only good rays if nolost, and
+    the ray intensities if weighted, else None.
+    """
+    if nolost:
+        rays = rays[good_rays(rays)]
+    weights = ray_intensities(rays) if weighted else None
+    return [rays[:, column - 1] for column in columns], weights
+
+
+def _check_mergeable(reducer, other, attributes):
+    """ Raise ValueError if the reducers accumulate different things. """
+    if type(reducer) is not type(other):
+        raise TypeError("Cannot merge {} with {}.".format(
+            type(reducer).__name__, type(other).__name__))
+    for attribute in attributes:
+        if not numpy.array_equal(getattr(reducer, attribute),
+                                 getattr(other, attribute)):
+            raise ValueError(
+                "Cannot merge reducers with different {}.".format(attribute))
+
+
+class Histogram():
+    """
+    :class Histogram: Histogram of one ray column accumulated over batches.
+
+    The range is fixed up front since the rays of later batches are unknown,
+    rays outside of it are not counted. Histograms of batches traced by
+    different workers add up with merge.
+    """
+    def __init__(self, column, bins, range, nolost=True, weighted=False):
+        """
+        :param column: The column, counting from 1 as Shadow does, e.g. 1 for x.
+        :type  column: int
+
+        :param bins: The number of bins.
+        :type  bins: int
+
+        :param range: The (lower, upper) edges of the histogram.
+        :type  range: tuple
+
+        :param nolost: If True, count only good rays.
+        :type  nolost: bool
+
+        :param weighted: If True, sum the ray intensities instead of counting.
+        :type  weighted: bool
+
+        """
+        self.column = column
+        self.nolost = nolost
+        self.weighted = weighted
+        self.edges = numpy.linspace(range[0], range[1], bins + 1)
+        self.counts = numpy.zeros(bins)
+
+    def update(self, rays):
+        """
+        Add the rays of a batch.
+
+        :param rays: The ray array of shape (rays, 18).
+        :type  rays: numpy.ndarray
+
+        """
+        (values, ), weights = _columns(rays, [self.column], self.nolost,
+                                       self.weighted)
+        self.counts += histogram1d(values, self.counts.size,
+                                   (self.edges[0], self.edges[-1]), weights)
+
+    def merge(self, other):
+        """
+        Add the counts of another histogram of the same column and bins.
+
+        :param other: The histogram to add.
+        :type  other: Histogram
+
+        :return: This histogram.
+
+        """
+        _check_mergeable(self, other,
+                         ['column', 'nolost', 'weighted', 'edges'])
+        self.counts += other.counts
+        return self
+
+    @property
+    def fwhm(self):
+        """ The full width at half maximum, see fwhm(). """
+        return fwhm(self.counts, self.edges)
+
+    @property
+    def centroid(self):
+        """ The mean of the bin centers weighted by the counts. """
+        return centroid(0.5 * (self.edges[:-1] + self.edges[1:]), self.counts)
+
+
+class Histogram2D():
+    """
+    :class Histogram2D: Histogram of two ray columns accumulated over batches,
+    e.g. the footprint on an optical element for columns 1 (x) and 3 (z).
+    """
+    def __init__(self,
+                 column_x,
+                 column_y,
+                 bins,
+                 range,
+                 nolost=True,
+                 weighted=False):
+        """
+        :param column_x: The first column, counting from 1.
+        :type  column_x: int
+
+        :param column_y: The second column, counting from 1.
+        :type  column_y: int
+
+        :param bins: The number of bins, or (bins_x, bins_y).
+        :type  bins: int | tuple
+
+        :param range: ((lower_x, upper_x), (lower_y, upper_y)).
+        :type  range: tuple
+
+        :param nolost: If True, count only good rays.
+        :type  nolost: bool
+
+        :param weighted: If True, sum the ray intensities instead of counting.
+        :type  weighted: bool
+
+        """
+        if numpy.ndim(bins) == 0:
+            bins = (bins, bins)
+        self.columns = (column_x, column_y)
+        self.nolost = nolost
+        self.weighted = weighted
+        self.edges_x = numpy.linspace(range[0][0], range[0][1], bins[0] + 1)
+        self.edges_y = numpy.linspace(range[1][0], range[1][1], bins[1] + 1)
+        self.counts = numpy.zeros(bins)
+
+    def update(self, rays):
+        """
+        Add the rays of a batch.
+
+        :param rays: The ray array of shape (rays, 18).
+        :type  rays: numpy.ndarray
+
+        """
+        (x, y), weights = _columns(rays, self.columns, self.nolost,
+                                   self.weighted)
+        self.counts += histogram2d(
+            x, y, self.counts.shape,
+            ((self.edges_x[0], self.edges_x[-1]),
+             (self.edges_y[0], self.edges_y[-1])), weights)
+
+    def merge(self, other):
+        """
+        Add the counts of another histogram of the same columns and bins.
+
+        :param other: The histogram to add.
+        :type  other: Histogram2D
+
+        :return: This histogram.
+
+        """
+        _check_mergeable(
+            self, other,
+            ['columns', 'nolost', 'weighted', 'edges_x', 'edges_y'])
+        self.counts += other.counts
+        return self
+
+
+class Moments():
+    """
+    :class Moments: Count, mean and standard deviation of ray columns
+    accumulated over batches, optionally weighted by the ray intensities.
+
+    Batches and reducers are combined with the pairwise update of Chan et al.
+    on means and summed squared deviations, which stays accurate for columns
+    with a large offset, e.g. the wavenumber.
+    """
+    def __init__(self, columns, nolost=True, weighted=False):
+        """
+        :param columns: The columns, counting from 1.
+        :type  columns: list
+
+        :param nolost: If True, use only good rays.
+        :type  nolost: bool
+
+        :param weighted: If True, weight the rays by their intensities.
+        :type  weighted: bool
+
+        """
+        self.columns = list(columns)
+        self.nolost = nolost
+        self.weighted = weighted
+        self.count = 0
+        # The sum of weights, the intensity if weighted
+        self.weight = 0.0
+        self._mean = numpy.zeros(len(self.columns))
+        # Weighted sum of squared deviations from the mean
+        self._m2 = numpy.zeros(len(self.columns))
+
+    def __combine(self, weight, mean, m2):
+        """ Add the moments of another set of rays. """
+        if weight == 0:
+            return
+        total = self.weight + weight
+        delta = mean - self._mean
+        self._mean = self._mean + delta * (weight / total)
+        self._m2 = self._m2 + m2 + delta**2 * (self.weight * weight / total)
+        self.weight = total
+
+    def update(self, rays):
+        """
+        Add the rays of a batch.
+
+        :param rays: The ray array of shape (rays, 18).
+        :type  rays: numpy.ndarray
+
+        """
+        values, weights = _columns(rays, self.columns, self.nolost,
+                                   self.weighted)
+        values = numpy.array(values)
+        self.count += values.shape[1]
+        if weights is None:
+            weight = float(values.shape[1])
+            if weight == 0:
+                return
+            mean = values.mean(axis=1)
+            m2 = ((values - mean[:, None])**2).sum(axis=1)
+        else:
+            weight = float(weights.sum())
+            if weight == 0:
+                return
+            mean = values @ weights / weight
+            m2 = (values - mean[:, None])**2 @ weights
+        self.__combine(weight, mean, m2)
+
+    def merge(self, other):
+        """
+        Add the moments of another reducer of the same columns.
+
+        :param other: The moments to add.
+        :type  other: Moments
+
+        :return: This reducer.
+
+        """
+        _check_mergeable(self, other, ['columns', 'nolost', 'weighted'])
+        self.count += other.count
+        self.__combine(other.weight, other._mean, other._m2)
+        return self
+
+    @property
+    def mean(self):
+        """ The mean of each column, nan without rays. """
+        if self.weight == 0:
+            return numpy.full(len(self.columns), numpy.nan)
+        return self._mean.copy()
+
+    @property
+    def std(self):
+        """ The standard deviation of each column, nan without rays. """
+        if self.weight == 0:
+            return numpy.full(len(self.columns), numpy.nan)
+        return numpy.sqrt(self._m2 / self.weight)
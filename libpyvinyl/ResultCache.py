@@ -0,0 +1,251 @@
+"""
+:module ResultCache: Module hosting the ResultCache class.
+"""
+
+####################################################################################
+#                                                                                  #
+# This file is part of libpyvinyl - The APIs for Virtual Neutron and x-raY            #
+# Laboratory.                                                                      #
+#                                                                                  #
+# Copyright (C) 2020  Carsten Fortmann-Grote                                       #
+#                                                                                  #
+# This program is free software: you can redistribute it and/or modify it under    #
+# the terms of the GNU Lesser General Public License as published by the Free      #
+# Software Foundation, either version 3 of the License, or (at your option) any    #
+# later version.                                                                   #
+#                                                                                  #
+# This program is distributed in the hope that it will be useful, but WITHOUT ANY  #
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A  #
+# PARTICULAR PURPOSE.  See the GNU Lesser General Public License for more details. #
+#                                                                                  #
+# You should have received a copy of the GNU Lesser General Public License along   #
+# with this program.  If not, see <https://www.gnu.org/licenses/                   #
+#                                                                                  #
+####################################################################################
+
+from tempfile import mkstemp
+import hashlib
+import json
+import os
+from libpyvinyl.LazyImports import is_instance
+
+
+def _json_default(obj):
+    """ Serialize objects the json module does not know, e.g. numpy arrays. """
+    if hasattr(obj, 'tolist'):
+        return obj.tolist()
+    return repr(obj)
+
+
+def parameters_fingerprint(parameters):
+    """
+    Stable hash of a CalculatorParameters instance.
+
+    :param parameters: The parameters to hash.
+    :type  parameters: CalculatorParameters
+
+    :return: Hex digest of the sorted json representation of the parameters.
+
+    """
+    if parameters is None:
+        dump = "null"
+    else:
+        dump = json.dumps(parameters.to_dict(),
+                          sort_keys=True,
+                          default=_json_default)
+    return hashlib.sha256(dump.encode('utf-8')).hexdigest()
+
+
+def data_fingerprint(data):
+    """
+    Stable hash of data, e.g. the input of a calculator.
+
+    hdf5 datasets are hashed by file, path and modification time, other
+    objects that are not numpy arrays by their dill pickle.
+
+    :param data: The data to hash.
+
+    :return: Hex digest of the data.
+
+    """
+    sha = hashlib.sha256()
+    if data is None:
+        sha.update(b"None")
+    elif is_instance(data, "numpy", "ndarray") and not data.dtype.hasobject:
+        import numpy
+        sha.update(str(data.dtype).encode('utf-8'))
+        sha.update(str(data.shape).encode('utf-8'))
+        # A byte view, contiguous data is hashed without copying it.
+        sha.update(
+            memoryview(numpy.ascontiguousarray(data).reshape(-1).view(
+                numpy.uint8)))
+    elif is_instance(data, "h5py", "Dataset"):
+        # Datasets cannot be pickled and may exceed memory, they are
+        # identified by file, path and modification time instead.
+        fname = os.path.abspath(data.file.filename)
+        sha.update(b"h5py.Dataset")
+        sha.update(fname.encode('utf-8'))
+        sha.update(data.name.encode('utf-8'))
+        sha.update(str(os.path.getmtime(fname)).encode('utf-8'))
+    else:
+        import dill
+        sha.update(dill.dumps(data))
+    return sha.hexdigest()
+
+
+def calculator_fingerprint(calculator):
+    """
+    Stable hash of a calculator's class, parameters and input.
+
+    :param calculator: The calculator to hash.
+    :type  calculator: BaseCalculator
+
+    :return: Hex digest, equal for calculators that compute the same result.
+
+    """
+    cls = calculator.__class__
+    sha = hashlib.sha256()
+    sha.update("{}.{}".format(cls.__module__, cls.__qualname__).encode('utf-8'))
+    sha.update(parameters_fingerprint(calculator.parameters).encode('utf-8'))
+    sha.update(data_fingerprint(calculator.input).encode('utf-8'))
+    return sha.hexdigest()
+
+
+class ResultCache():
+    """
+    :class ResultCache: On-disk cache of calculator results.
+
+    Results are keyed by a hash of the calculator class, its parameters and
+    its input. Entries are evicted least recently used first once the total
+    size of the cache exceeds max_size.
+    """
+    def __init__(self, path, max_size=None):
+        """
+        :param path: The directory holding the cached results.
+        :type  path: str
+
+        :param max_size: Maximum total size of the cache in bytes. Default is
+            unbounded.
+        :type  max_size: int
+
+        """
+        self.path = path
+        self.max_size = max_size
+        os.makedirs(self.path, exist_ok=True)
+
+    def key(self, calculator):
+        """
+        Compute the cache key of a calculator.
+
+        :param calculator: The calculator to compute the key for.
+        :type  calculator: BaseCalculator
+
+        :return: The key as hex digest, see calculator_fingerprint.
+
+        """
+        return calculator_fingerprint(calculator)
+
+    def __entry(self, key):
+        """ Return the path of an existing entry or None. """
+        for suffix in (".npy", ".dill"):
+            fname = os.path.join(self.path, key + suffix)
+            if os.path.isfile(fname):
+                return fname
+        return None
+
+    def __contains__(self, key):
+        return self.__entry(key) is not None
+
+    def load(self, key):
+        """
+        Load a cached result.
+
+        :param key: The cache key.
+        :type  key: str
+
+        :return: Tuple (found, data).
+
+        """
+        fname = self.__entry(key)
+        if fname is None:
+            return False, None
+        try:
+            if fname.endswith(".npy"):
+                import numpy
+                data = numpy.load(fname)
+            else:
+                import dill
+                with open(fname, 'rb') as fhandle:
+                    data = dill.load(fhandle)
+        except (OSError, EOFError):
+            # Evicted or truncated in the meantime.
+            return False, None
+
+        # Mark as recently used.
+        os.utime(fname)
+        return True, data
+
+    def store(self, key, data):
+        """
+        Store a result in the cache and evict old entries if needed.
+
+        :param key: The cache key.
+        :type  key: str
+
+        :param data: The result to store.
+
+        """
+        if is_instance(data, "numpy", "ndarray") and data.dtype != object:
+            suffix = ".npy"
+        else:
+            suffix = ".dill"
+        # Write to a temporary file first so readers never see partial entries.
+        handle, tmp = mkstemp(suffix=".tmp", dir=self.path)
+        with os.fdopen(handle, 'wb') as fhandle:
+            if suffix == ".npy":
+                import numpy
+                numpy.save(fhandle, data)
+            else:
+                import dill
+                dill.dump(data, fhandle)
+        os.replace(tmp, os.path.join(self.path, key + suffix))
+
+        self.__evict()
+
+    def size(self):
+        """ The total size of the cached results in bytes. """
+        return sum(size for _, _, size in self.__entries())
+
+    def clear(self):
+        """ Remove all cached results. """
+        for fname, _, _ in self.__entries():
+            os.remove(fname)
+
+    def __entries(self):
+        """ List (path, mtime, size) of all entries. """
+        entries = []
+        for fname in os.listdir(self.path):
+            if not fname.endswith((".npy", ".dill")):
+                continue
+            fname = os.path.join(self.path, fname)
+            try:
+                stat = os.stat(fname)
+            except FileNotFoundError:
+                continue
+            entries.append((fname, stat.st_mtime, stat.st_size))
+        return entries
+
+    def __evict(self):
+        """ Remove least recently used entries until below max_size. """
+        if self.max_size is None:
+            return
+        entries = sorted(self.__entries(), key=lambda entry: entry[1])
+        total = sum(entry[2] for entry in entries)
+        for fname, _, size in entries:
+            if total <= self.max_size:
+                break
+            try:
+                os.remove(fname)
+            except FileNotFoundError:
+                pass
+            total -= size
@@ -1,5 +1,8 @@
 from VyBase import VyBaseData, VyBaseParameters, VyBaseCalculator
+from libpyvinyl.RayColumns import read_rays, write_rays
+from libpyvinyl.RayStatistics import reduce as reduce_batches
 import Shadow
+import numpy
 
 class VyS3Parameters(VyBaseParameters):
 
@@ -50,11 +53,29 @@ class VyS3Data(VyBaseData):
     def is_valid(self):
         return isinstance(self._beam, Shadow.Beam)
 
-    def to_h5(self, **kwargs):
-        raise NotImplementedError()
+    def to_h5(self, filename="tmp.h5", group="/rays", **options):
+        """
+        writes the rays with one chunked, compressed dataset per column, see
+        libpyvinyl.RayColumns.write_rays for the options
+        """
+        write_rays(filename, self._beam.rays, group=group, **options)
 
-    def from_h5(self, **kwargs):
-        raise NotImplementedError()
+    def from_h5(self, filename="tmp.h5", group="/rays", nolost=False):
+        """
+        reads the rays written by to_h5 into the beam, only the good rays if
+        nolost
+        """
+        self._beam = Shadow.Beam()
+        self._beam.rays = read_rays(filename, nolost=nolost, group=group)
+        return self
+
+    @staticmethod
+    def read_columns(filename, columns, group="/rays", nolost=False):
+        """
+        reads only some columns, e.g. [1, 3, "intensity"], without building a
+        beam, see libpyvinyl.RayColumns.read_rays
+        """
+        return read_rays(filename, columns=columns, nolost=nolost, group=group)
 
 
 
@@ -84,12 +105,50 @@ class VyS3Calculator(VyBaseCalculator):
 
         return True # success!
 
+    def iter_rays(self, batch_size):
+        """
+        traces the rays in batches of at most batch_size rays, each with its own
+        seed, and yields the ray array of each batch instead of keeping the beam
+        """
+        source = self.get_parameters()["source"]
+        optical_elements = self.get_parameters()["optical_elements"]
+
+        npoint, seed = source.NPOINT, source.ISTAR1
+        offset = 0
+        try:
+            for k in range(max(1, -(-npoint // batch_size))):
+                source.NPOINT = min(batch_size, npoint - offset)
+                # Odd seeds stay odd
+                source.ISTAR1 = seed + 2 * k
+
+                beam = Shadow.Beam()
+                beam.genSource(source)
+                for i,optical_element in enumerate(optical_elements):
+                    beam.traceOE(optical_element, i+1)
+
+                rays = beam.rays
+                rays[:, 11] = numpy.arange(offset + 1, offset + rays.shape[0] + 1)
+                offset += rays.shape[0]
+                yield rays
+        finally:
+            source.NPOINT, source.ISTAR1 = npoint, seed
+
+    def reduce_rays(self, reducers, batch_size):
+        """
+        feeds the ray batches of iter_rays to reducers of
+        libpyvinyl.RayStatistics and returns the reducers
+        """
+        return reduce_batches(self.iter_rays(batch_size), reducers)
+
     def dump(self):
         raise NotImplementedError()
 
-    def to_h5(self, filename="tmp.h5"):
-        from orangecontrib.panosc.shadow.util.openPMD import saveShadowToHDF
-        saveShadowToHDF(self.get_data()._beam, filename=filename)
+    def to_h5(self, filename="tmp.h5", openpmd=False):
+        if openpmd:
+            from orangecontrib.panosc.shadow.util.openPMD import saveShadowToHDF
+            saveShadowToHDF(self.get_data()._beam, filename=filename)
+        else:
+            self.get_data().to_h5(filename)
 
 
 
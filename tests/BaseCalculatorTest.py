@@ -1,10 +1,14 @@
 import unittest
+import contextlib
+import io
 import os
 import shutil
 import numpy
 from jsons import JsonSerializable
 import copy
 import json
+import pickle
+import h5py
 
 from libpyvinyl.BaseCalculator import BaseCalculator, SpecializedCalculator
 from libpyvinyl.Parameters import CalculatorParameters, InstrumentParameters
@@ -13,6 +17,23 @@ from RandomImageCalculator import RandomImageCalculator
 
 import logging
 
+
+class FrameCalculator(BaseCalculator):
+    """ Calculator writing its frames one by one to an hdf5 file. """
+    def __init__(self, name, parameters=None, dumpfile=None, **kwargs):
+        super().__init__(name, parameters, dumpfile, **kwargs)
+
+    def backengine(self):
+        frames = self._create_h5_data((8, 16, 16), chunks=(1, 16, 16))
+        for i in range(frames.shape[0]):
+            frames[i] = numpy.full((16, 16), float(i))
+        return 0
+
+    def saveH5(self, fname=None, openpmd=False):
+        if fname is None:
+            fname = self.output_path
+        return self._write_h5(fname, {"/data": self.data})
+
 logging.basicConfig(format='%(asctime)s %(levelname)s:%(message)s',
                     level=logging.DEBUG)
 
@@ -102,6 +123,369 @@ class BaseCalculatorTest(unittest.TestCase):
         self.assertEqual(new_calculator_2.parameters['pulse_energy'].value,
                          34.87)
 
+    def test_copy_on_write(self):
+        """ Test the copy constructor sharing unchanged state. """
+        calculator = SpecializedCalculator(
+            'cow', copy.deepcopy(self.__default_parameters))
+        calculator.backengine()
+
+        new_calculator = calculator(copy_on_write=True)
+        self.assertIsInstance(new_calculator, SpecializedCalculator)
+        self.assertTrue(numpy.shares_memory(new_calculator.data,
+                                            calculator.data))
+        self.assertFalse(new_calculator.data.flags.writeable)
+        self.assertFalse(calculator.data.flags.writeable)
+        self.assertIsNot(new_calculator.parameters.parameters['pulse_energy'],
+                         calculator.parameters.parameters['pulse_energy'])
+
+        new_calculator.parameters['photon_energy'] = 10.0
+        self.assertEqual(new_calculator.parameters['photon_energy'].value,
+                         10.0)
+        self.assertEqual(calculator.parameters['photon_energy'].value, 109.98)
+
+        # Parameters held across copies do not leak into earlier clones.
+        photon_energy = calculator.parameters['photon_energy']
+        clones = []
+        for value in (1.0, 2.0, 3.0):
+            photon_energy.set_value(value)
+            clones.append(calculator(copy_on_write=True))
+        self.assertEqual(
+            [clone.parameters['photon_energy'].value for clone in clones],
+            [1.0, 2.0, 3.0])
+
+        # A rerun replaces the shared data of the clone only.
+        new_calculator.backengine()
+        self.assertFalse(
+            numpy.shares_memory(new_calculator.data, calculator.data))
+
+    def test_scan(self):
+        """ Test scanning parameters in worker processes. """
+
+        calculator = self.__default_calculator
+        calculator._run()
+        data = calculator.data
+        photon_energy = calculator.parameters['photon_energy']
+        values = {'photon_energy': [5.0, 10.0, 15.0], 'pulse_energy': [1.0, 2.0]}
+
+        for workers in [1, 2]:
+            results = calculator.scan(values, workers=workers)
+            self.assertEqual(len(results), 6)
+            self.assertEqual(results[0]['parameters'], {
+                'photon_energy': 5.0,
+                'pulse_energy': 1.0
+            })
+            self.assertEqual(results[5]['parameters'], {
+                'photon_energy': 15.0,
+                'pulse_energy': 2.0
+            })
+            for result in results:
+                self.assertEqual(result['status'], 0)
+                self.assertAlmostEqual(numpy.mean(result['data']),
+                                       result['parameters']['photon_energy'],
+                                       places=1)
+
+        # The original calculator is left untouched.
+        self.assertEqual(calculator.parameters['photon_energy'].value, 109.98)
+        self.assertIs(calculator.data, data)
+        self.assertTrue(calculator.data.flags.writeable)
+
+        # Parameters held across the scan still belong to the calculator.
+        self.assertIs(calculator.parameters['photon_energy'], photon_energy)
+        photon_energy.set_value(55.0)
+        self.assertEqual(calculator.parameters['photon_energy'].value, 55.0)
+
+    def test_scan_illegal_value(self):
+        """ Test that a scan over illegal values is rejected up front. """
+
+        parameters = copy.deepcopy(self.__default_parameters)
+        parameters['photon_energy'].add_legal_interval(0, 100)
+        calculator = SpecializedCalculator('scan', parameters)
+
+        self.assertRaises(ValueError, calculator.scan,
+                          {'photon_energy': [50.0, 150.0]})
+
+    def test_h5_data(self):
+        """ Test data written to and read from an hdf5 file lazily. """
+        fname = "frames.h5"
+        self.__files_to_remove.append(fname)
+        calculator = FrameCalculator('frames',
+                                     CalculatorParameters(),
+                                     output_path=fname)
+        self.assertEqual(calculator._run(), 0)
+
+        self.assertIsInstance(calculator.data, h5py.Dataset)
+        self.assertEqual(calculator.data.file.mode, "r")
+        self.assertEqual(calculator.data.shape, (8, 16, 16))
+        self.assertEqual(calculator.data.chunks, (1, 16, 16))
+        self.assertEqual(calculator.data[3, 0, 0], 3.0)
+
+        # Copies and pickles reopen the file instead of copying the data.
+        new_calculator = calculator()
+        self.assertIsInstance(new_calculator.data, h5py.Dataset)
+        self.assertEqual(new_calculator.data[5, 1, 1], 5.0)
+        unpickled = pickle.loads(pickle.dumps(calculator))
+        self.assertEqual(unpickled.data[7, 2, 2], 7.0)
+
+        dump = calculator.dump()
+        self.__files_to_remove.append(dump)
+        reloaded = FrameCalculator('dump', dumpfile=dump)
+        self.assertEqual(reloaded.data[6, 0, 0], 6.0)
+        reloaded.data.file.close()
+        unpickled.data.file.close()
+        new_calculator.data.file.close()
+
+        # Saving to the file holding the data adds the provenance to it.
+        calculator.saveH5()
+        self.assertEqual(calculator.data.file.mode, "r")
+        self.assertEqual(calculator.data[4, 0, 0], 4.0)
+        self.assertEqual(FrameCalculator.fingerprint_from_h5(fname),
+                         calculator.fingerprint())
+        restored = BaseCalculator.from_h5(fname)
+        self.assertEqual(restored.data[3, 0, 0], 3.0)
+        calculator.data.file.close()
+
+    def test_h5_data_mmap(self):
+        """ Test memory-mapping a contiguous hdf5 dataset. """
+        fname = "contiguous.h5"
+        self.__files_to_remove.append(fname)
+        with h5py.File(fname, "w") as h5:
+            h5.create_dataset("/data", data=numpy.arange(12.).reshape(3, 4))
+            h5.create_dataset("/chunked",
+                              data=numpy.arange(12.),
+                              chunks=(4, ))
+
+        calculator = SpecializedCalculator('mmap', output_path=fname)
+        data = calculator.open_h5_data(mmap=True)
+        self.assertIsInstance(data, numpy.memmap)
+        self.assertEqual(calculator.data[2, 3], 11.0)
+
+        self.assertRaises(ValueError,
+                          calculator.open_h5_data,
+                          dataset="/chunked",
+                          mmap=True)
+        lazy = calculator.open_h5_data(dataset="/chunked")
+        self.assertEqual(lazy[4:6].tolist(), [4.0, 5.0])
+        lazy.file.close()
+
+    def test_h5_output(self):
+        """ Test compression and chunking policies of saveH5. """
+        calculator = copy.deepcopy(self.__default_calculator)
+        calculator._run()
+        fname = "compressed.h5"
+        self.__files_to_remove.append(fname)
+
+        self.assertIsNone(calculator.h5_output['compression'])
+        self.assertRaises(KeyError, calculator.set_h5_output, level=4)
+        self.assertRaises(ValueError,
+                          calculator.set_h5_output,
+                          compression="zip")
+
+        calculator.set_h5_output(chunks=(4, ),
+                                 compression="gzip",
+                                 compression_opts=4,
+                                 shuffle=True)
+        calculator.output_path = fname
+        self.assertIsNone(calculator.saveH5())
+        with h5py.File(fname, "r") as h5:
+            self.assertEqual(h5["/data"].compression, "gzip")
+            self.assertEqual(h5["/data"].compression_opts, 4)
+            self.assertTrue(h5["/data"].shuffle)
+            self.assertEqual(h5["/data"].chunks, (4, ))
+            self.assertTrue(numpy.array_equal(h5["/data"][()],
+                                              calculator.data))
+
+    def test_h5_output_background(self):
+        """ Test writing hdf5 files in the background. """
+        calculator = copy.deepcopy(self.__default_calculator)
+        calculator._run()
+        fname = "background.h5"
+        self.__files_to_remove.append(fname)
+
+        calculator.set_h5_output(compression="lzf", background=True)
+        calculator.output_path = fname
+        future = calculator.saveH5()
+        calculator.wait_for_writes()
+        self.assertTrue(future.done())
+        self.assertIn('write', [record['stage'] for record in calculator.metrics])
+        with h5py.File(fname, "r") as h5:
+            self.assertEqual(h5["/data"].compression, "lzf")
+            self.assertTrue(numpy.array_equal(h5["/data"][()],
+                                              calculator.data))
+
+        # Errors of the writer thread are raised by wait_for_writes.
+        calculator.output_path = os.path.join("no_such_dir", fname)
+        calculator.saveH5()
+        self.assertRaises(OSError, calculator.wait_for_writes)
+
+    def test_h5_provenance(self):
+        """ Test restoring a calculator from its saveH5 output. """
+        calculator = copy.deepcopy(self.__default_calculator)
+        calculator._run()
+        fname = "provenance.h5"
+        self.__files_to_remove.append(fname)
+        calculator.output_path = fname
+        calculator.saveH5()
+
+        with h5py.File(fname, "r") as h5:
+            self.assertIn("/parameters/photon_energy", h5)
+            self.assertEqual(h5["/provenance"].attrs["class"],
+                             "SpecializedCalculator")
+        self.assertEqual(SpecializedCalculator.fingerprint_from_h5(fname),
+                         calculator.fingerprint())
+
+        restored = BaseCalculator.from_h5(fname)
+        self.assertIsInstance(restored, SpecializedCalculator)
+        self.assertEqual(restored.name, calculator.name)
+        self.assertEqual(restored.output_path, fname)
+        self.assertEqual(restored.parameters['photon_energy'].value,
+                         calculator.parameters['photon_energy'].value)
+        self.assertEqual(restored.parameters['photon_energy'].unit,
+                         calculator.parameters['photon_energy'].unit)
+        self.assertTrue(numpy.array_equal(restored.data, calculator.data))
+        self.assertEqual(restored.fingerprint(), calculator.fingerprint())
+        self.assertEqual(restored._run(), 0)
+
+        lazy = BaseCalculator.from_h5(fname, lazy=True)
+        self.assertIsInstance(lazy.data, h5py.Dataset)
+        self.assertEqual(lazy.data[3], calculator.data[3])
+        lazy.data.file.close()
+
+        # Parameters changed while writing in the background are not written.
+        calculator.set_h5_output(background=True)
+        calculator.saveH5()
+        calculator.parameters['photon_energy'] = 99.0
+        calculator.wait_for_writes()
+        self.assertNotEqual(SpecializedCalculator.fingerprint_from_h5(fname),
+                            calculator.fingerprint())
+
+        calculator.set_h5_output(provenance=False)
+        calculator.saveH5()
+        self.assertIsNone(SpecializedCalculator.fingerprint_from_h5(fname))
+        self.assertRaises(IOError, BaseCalculator.from_h5, fname)
+
+    def test_h5_provenance_unpicklable_input(self):
+        """ Test that an input without fingerprint does not break saveH5. """
+        calculator = copy.deepcopy(self.__default_calculator)
+        calculator._run()
+        fname = "provenance_input.h5"
+        self.__files_to_remove.append(fname)
+        calculator.output_path = fname
+        calculator.input = (i for i in range(3))
+        calculator.saveH5()
+
+        self.assertIsNone(SpecializedCalculator.fingerprint_from_h5(fname))
+        restored = BaseCalculator.from_h5(fname)
+        self.assertTrue(numpy.array_equal(restored.data, calculator.data))
+
+    def test_h5_provenance_types(self):
+        """ Test that saveH5 keeps the types of parameters and attributes. """
+        calculator = copy.deepcopy(self.__default_calculator)
+        calculator._run()
+        fname = "provenance_types.h5"
+        self.__files_to_remove.append(fname)
+        calculator.output_path = fname
+        calculator.shape = (2, 3)
+        calculator.parameters['photon_energy'] = 1.0 + 2.0j
+        calculator.parameters['pulse_energy'] = numpy.float32(0.5)
+        calculator.saveH5()
+
+        restored = BaseCalculator.from_h5(fname)
+        self.assertEqual(restored.shape, (2, 3))
+        self.assertEqual(restored.parameters['photon_energy'].value,
+                         1.0 + 2.0j)
+        self.assertIsInstance(restored.parameters['pulse_energy'].value,
+                              numpy.float32)
+
+        # Values that cannot be saved are dropped with a warning.
+        calculator.parameters['pulse_energy'] = (i for i in range(3))
+        calculator.numbers = (i for i in range(3))
+        with self.assertLogs('libpyvinyl', level='WARNING') as logs:
+            calculator.saveH5()
+        self.assertEqual(len(logs.records), 2)
+
+        restored = BaseCalculator.from_h5(fname)
+        self.assertEqual(restored.shape, (2, 3))
+        self.assertIsNone(restored.parameters)
+        self.assertTrue(numpy.array_equal(restored.data, calculator.data))
+
+    def test_checkpoint(self):
+        """ Test writing and restoring a checkpoint directory. """
+        calculator = SpecializedCalculator('checkpoint',
+                                           copy.deepcopy(
+                                               self.__default_parameters),
+                                           output_path="checkpoint.h5")
+        calculator.backengine()
+
+        dirname = calculator.checkpoint()
+        self.__dirs_to_remove.append(dirname)
+        self.assertEqual(
+            sorted(os.listdir(dirname)),
+            ['data.npy', 'manifest.json', 'parameters.json'])
+
+        restored = BaseCalculator.from_checkpoint(dirname)
+        self.assertIsInstance(restored, SpecializedCalculator)
+        self.assertEqual(restored.name, 'checkpoint')
+        self.assertEqual(restored.output_path, "checkpoint.h5")
+        self.assertEqual(restored.parameters['photon_energy'].value, 109.98)
+        self.assertTrue(numpy.array_equal(restored.data, calculator.data))
+
+        # The constructor accepts checkpoint directories as dumpfile.
+        constructed = SpecializedCalculator('other', dumpfile=dirname)
+        self.assertEqual(constructed.name, 'checkpoint')
+        self.assertTrue(numpy.array_equal(constructed.data, calculator.data))
+
+    def test_checkpoint_types(self):
+        """ Test that checkpoints restore attributes with their types. """
+        calculator = SpecializedCalculator('checkpoint',
+                                           copy.deepcopy(
+                                               self.__default_parameters))
+        calculator.shape = (2, 3)
+        calculator.labels = {1: 'a', 2: 'b'}
+        calculator.options = {'order': [1, 2.5]}
+        calculator.parameters['pulse_energy'] = (1.0, 2.0)
+
+        dirname = calculator.checkpoint()
+        self.__dirs_to_remove.append(dirname)
+        restored = BaseCalculator.from_checkpoint(dirname)
+
+        self.assertEqual(restored.shape, (2, 3))
+        self.assertEqual(restored.labels, {1: 'a', 2: 'b'})
+        self.assertEqual(restored.options, {'order': [1, 2.5]})
+        self.assertEqual(restored.parameters['pulse_energy'].value, (1.0, 2.0))
+        with open(os.path.join(dirname, 'manifest.json')) as fp:
+            self.assertEqual(json.load(fp)['attributes']['options'],
+                             {'order': [1, 2.5]})
+
+    def test_checkpoint_mmap(self):
+        """ Test memory-mapped restore and incremental checkpointing. """
+        calculator = SpecializedCalculator(
+            'checkpoint', copy.deepcopy(self.__default_parameters))
+        calculator.backengine()
+        dirname = calculator.checkpoint("checkpoint_dir")
+        self.__dirs_to_remove.append(dirname)
+        data_file = os.path.join(dirname, 'data.npy')
+        os.utime(data_file, (0, 0))
+
+        restored = SpecializedCalculator.from_checkpoint(dirname, mmap=True)
+        self.assertIsInstance(restored.data, numpy.memmap)
+        self.assertTrue(numpy.array_equal(restored.data, calculator.data))
+
+        # Only the parameters change, the data block is not rewritten.
+        restored.parameters['pulse_energy'] = 1.0
+        restored.checkpoint(dirname)
+        self.assertEqual(os.path.getmtime(data_file), 0)
+        self.assertEqual(
+            BaseCalculator.from_checkpoint(dirname).parameters['pulse_energy']
+            .value, 1.0)
+
+        # New data is written.
+        restored.backengine()
+        restored.checkpoint(dirname)
+        self.assertNotEqual(os.path.getmtime(data_file), 0)
+        self.assertTrue(
+            numpy.array_equal(
+                BaseCalculator.from_checkpoint(dirname).data, restored.data))
+
     def test_dump(self):
         """ Test dumping to file. """
         calculator = self.__default_calculator
@@ -130,6 +514,75 @@ class BaseCalculatorTest(unittest.TestCase):
 
         self.assertIsNotNone(calculator.data)
 
+    def test_resurrect_from_old_dump(self):
+        """ Test loading a dumpfile written by an older version. """
+
+        dump = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                            'baseline_dump.dill')
+        calculator = SpecializedCalculator('old', dumpfile=dump)
+
+        self.assertEqual(calculator.parameters['photon_energy'].value, 10.0)
+        self.assertEqual(calculator.parameters['photon_energy'].unit, 'eV')
+        self.assertIsInstance(calculator.parameters.version, int)
+        self.assertIsNotNone(calculator.data)
+
+        self.__files_to_remove.append(calculator.output_path)
+        self.assertIsNone(calculator.cache)
+        self.assertIsNone(calculator.input)
+        self.assertEqual(calculator._run(), 0)
+
+    def test_run_from_cli(self):
+        """ Test running many dumpfiles in one interpreter. """
+        dumps = []
+        for name in ("cli1", "cli2"):
+            dump = self.__default_calculator(name=name).dump(name + ".dill")
+            self.__files_to_remove.append(dump)
+            dumps.append(dump)
+        manifest = "cli_manifest.txt"
+        self.__files_to_remove.append(manifest)
+        with open(manifest, "w") as fhandle:
+            fhandle.write("# Jobs\n{}\n\n".format(dumps[1]))
+
+        self.assertEqual(SpecializedCalculator.run_dumpfiles(dumps),
+                         {dumps[0]: 0, dumps[1]: 0})
+        self.assertEqual(
+            SpecializedCalculator.run_dumpfiles(dumps, workers=2),
+            {dumps[0]: 0, dumps[1]: 0})
+
+        with self.assertRaises(SystemExit) as context:
+            SpecializedCalculator.run_from_cli(
+                [dumps[0], "--manifest", manifest])
+        self.assertEqual(context.exception.code, 0)
+
+        # Options may come between the dumpfiles.
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            with self.assertRaises(SystemExit) as context:
+                SpecializedCalculator.run_from_cli(
+                    [dumps[0], "--manifest", manifest, dumps[1]])
+        self.assertEqual(context.exception.code, 0)
+        self.assertEqual(output.getvalue(),
+                         "{}: 0\n{}: 0\n".format(dumps[0], dumps[1]))
+
+        # Files listed twice run and print once.
+        self.assertEqual(
+            SpecializedCalculator.run_dumpfiles([dumps[1], dumps[0], dumps[1]]),
+            {dumps[1]: 0, dumps[0]: 0})
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            with self.assertRaises(SystemExit) as context:
+                SpecializedCalculator.run_from_cli(
+                    [dumps[1], "--manifest", manifest])
+        self.assertEqual(context.exception.code, 0)
+        self.assertEqual(output.getvalue(), "{}: 0\n".format(dumps[1]))
+
+        # A broken file does not stop the others.
+        with self.assertLogs(level="ERROR"):
+            with self.assertRaises(SystemExit) as context:
+                SpecializedCalculator.run_from_cli(
+                    [dumps[0], "missing.dill"])
+        self.assertEqual(context.exception.code, 1)
+
     def test_attributes(self):
         """ Test that all required attributes are present. """
 
@@ -0,0 +1,46 @@
+import unittest
+import os
+import subprocess
+import sys
+
+# Root of the repository, so the subprocess imports this libpyvinyl.
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+
+class ImportTest(unittest.TestCase):
+    """
+    Test class for the import of libpyvinyl.
+    """
+    def run_python(self, code):
+        """ Run code in a fresh interpreter and return what it printed. """
+        env = dict(os.environ)
+        env['PYTHONPATH'] = os.pathsep.join(
+            [ROOT, env.get('PYTHONPATH', '')])
+        return subprocess.check_output([sys.executable, "-c", code], env=env)
+
+    def loaded_modules(self, statement, modules):
+        """ Run statement in a fresh interpreter and list the loaded modules. """
+        code = "import sys; {}; print([m for m in {!r} if m in sys.modules])".format(
+            statement, modules)
+        return eval(self.run_python(code))
+
+    def testLazyImports(self):
+        """ Testing that heavy dependencies are not imported eagerly """
+
+        heavy = ['dill', 'h5py', 'numpy', 'asyncio', 'multiprocessing']
+        for statement in ("import libpyvinyl.Parameters",
+                          "import libpyvinyl.BaseCalculator",
+                          "import libpyvinyl.Instrument"):
+            self.assertEqual(self.loaded_modules(statement, heavy), [],
+                             statement)
+
+    def testNoLoggingConfiguration(self):
+        """ Testing that importing does not configure the root logger """
+
+        code = ("import logging, libpyvinyl; "
+                "print(len(logging.getLogger().handlers))")
+        self.assertEqual(int(self.run_python(code)), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
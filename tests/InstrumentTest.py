@@ -1,11 +1,62 @@
 import unittest
+import asyncio
 import os
 import shutil
+import sys
+import tempfile
 
-from libpyvinyl.BaseCalculator import SpecializedCalculator
+from libpyvinyl.BaseCalculator import BaseCalculator, SpecializedCalculator
+from libpyvinyl.Parameters import CalculatorParameters
 from libpyvinyl.Instrument import Instrument
 
 
+class IncrementCalculator(BaseCalculator):
+    """ Calculator adding one to its input, used to check the hand-off. """
+    def __init__(self, name, parameters=None, dumpfile=None, **kwargs):
+        if parameters is None:
+            parameters = CalculatorParameters()
+        super().__init__(name, parameters, dumpfile, **kwargs)
+
+    def backengine(self):
+        if self.input is None:
+            self._set_data(1)
+        else:
+            self._set_data(self.input + 1)
+        return 0
+
+    def saveH5(self, fname, openpmd=False):
+        pass
+
+
+class SumCalculator(IncrementCalculator):
+    """ Calculator adding up the data of several upstream calculators. """
+    def backengine(self):
+        self._set_data(sum(self.input.values()))
+        return 0
+
+
+class FailingCalculator(IncrementCalculator):
+    """ Calculator whose backengine reports an error. """
+    def backengine(self):
+        return 1
+
+
+class ExternalIncrementCalculator(IncrementCalculator):
+    """ Calculator adding one to its input in an external process. """
+    def backengine_command(self):
+        value = 0 if self.input is None else self.input
+        return [
+            sys.executable, "-c",
+            "open({!r}, 'w').write(str({} + 1))".format(
+                self.output_path, value)
+        ]
+
+    def collect_backengine_output(self):
+        with open(self.output_path) as fhandle:
+            self._set_data(int(fhandle.read()))
+        return 0
+
+
 class InstrumentTest(unittest.TestCase):
     """
     Test class for the Detector class.
@@ -114,6 +165,186 @@ class InstrumentTest(unittest.TestCase):
         self.assertEqual(my_instrument.calculators["test2"].output_path,
                          'test/test2')
 
+    def testRun(self):
+        """ Testing running the calculators as a chain """
+
+        my_instrument = Instrument('myInstrument')
+        for name in ['source', 'propagator', 'detector']:
+            my_instrument.add_calculator(IncrementCalculator(name))
+        results = my_instrument.run()
+        self.assertEqual(results, [3])
+        self.assertEqual(my_instrument.calculators['propagator'].input, 1)
+        self.assertEqual(my_instrument.calculators['detector'].data, 3)
+
+    def testRunPipelined(self):
+        """ Testing running several shots through the pipeline """
+
+        my_instrument = Instrument('myInstrument')
+        for name in ['source', 'propagator', 'detector']:
+            my_instrument.add_calculator(IncrementCalculator(name))
+        my_instrument.calculators['source'].input = 10
+        results = my_instrument.run(shots=5, pipelined=True)
+        self.assertEqual(results, [13] * 5)
+
+    def testRunGraph(self):
+        """ Testing running branching calculators """
+
+        my_instrument = Instrument('myInstrument')
+        my_instrument.add_calculator(IncrementCalculator('source'))
+        my_instrument.add_calculator(IncrementCalculator('detector1'))
+        my_instrument.add_calculator(IncrementCalculator('detector2'),
+                                     inputs=['source'])
+        my_instrument.add_calculator(IncrementCalculator('detector3'),
+                                     inputs=['source'])
+        self.assertEqual(
+            my_instrument.graph(), {
+                'source': [],
+                'detector1': ['source'],
+                'detector2': ['source'],
+                'detector3': ['source']
+            })
+        self.assertEqual(my_instrument.run(), [{
+            'detector1': 2,
+            'detector2': 2,
+            'detector3': 2
+        }])
+        self.assertEqual(my_instrument.run(workers=1, shots=2),
+                         [{
+                             'detector1': 2,
+                             'detector2': 2,
+                             'detector3': 2
+                         }] * 2)
+        self.assertRaises(ValueError, my_instrument.run, pipelined=True)
+
+        my_instrument.add_calculator(SumCalculator('sum'), inputs=[])
+        my_instrument.add_link('detector2', 'sum')
+        my_instrument.add_link('detector3', 'sum')
+        self.assertEqual(my_instrument.run(), [{'detector1': 2, 'sum': 4}])
+
+        my_instrument.add_link('sum', 'source')
+        self.assertRaises(ValueError, my_instrument.run)
+        my_instrument.remove_calculator('sum')
+        my_instrument.add_link('unknown', 'detector1')
+        self.assertRaises(KeyError, my_instrument.run)
+
+    def testRunSkipUnchanged(self):
+        """ Testing that unchanged calculators are not run again """
+
+        my_instrument = Instrument('myInstrument')
+        source = SpecializedCalculator('source')
+        source.setParams()
+        my_instrument.add_calculator(source)
+        my_instrument.add_calculator(IncrementCalculator('detector1'))
+        my_instrument.add_calculator(IncrementCalculator('detector2'),
+                                     inputs=['source'])
+
+        def runs():
+            return {
+                name: len([
+                    record for record in calculator.metrics
+                    if record['stage'] == 'run'
+                ])
+                for name, calculator in my_instrument.calculators.items()
+            }
+
+        first = my_instrument.run(skip_unchanged=True)[0]
+        second = my_instrument.run(skip_unchanged=True)[0]
+        self.assertEqual(runs(), {'source': 1, 'detector1': 1, 'detector2': 1})
+        self.assertIs(first['detector1'], second['detector1'])
+
+        my_instrument.parameters['source']['photon_energy'] = 20.0
+        my_instrument.run(skip_unchanged=True)
+        self.assertEqual(runs(), {'source': 2, 'detector1': 2, 'detector2': 2})
+
+        my_instrument.run()
+        self.assertEqual(runs(), {'source': 3, 'detector1': 3, 'detector2': 3})
+
+    def testDirtyCalculators(self):
+        """ Testing that only calculators downstream of a change rerun """
+
+        my_instrument = Instrument('myInstrument')
+        for name in ['source', 'propagator', 'sample', 'detector']:
+            calculator = SpecializedCalculator(name)
+            calculator.setParams()
+            my_instrument.add_calculator(calculator)
+        my_instrument.add_master_parameter('sample_energy',
+                                           {'sample': 'photon_energy'})
+        self.assertEqual(my_instrument.dirty_calculators(),
+                         ['source', 'propagator', 'sample', 'detector'])
+
+        my_instrument.run()
+        self.assertEqual(my_instrument.dirty_calculators(), [])
+
+        my_instrument.master['sample_energy'] = 20.0
+        self.assertEqual(my_instrument.dirty_calculators(),
+                         ['sample', 'detector'])
+        source_data = my_instrument.calculators['source'].data
+        my_instrument.run(skip_unchanged=True)
+        self.assertIs(my_instrument.calculators['source'].data, source_data)
+        self.assertEqual(my_instrument.dirty_calculators(), [])
+
+        my_instrument.calculators['source'].input = 1.0
+        self.assertEqual(len(my_instrument.dirty_calculators()), 4)
+
+    def testRunUnpicklableInput(self):
+        """ Testing runs of a source whose input cannot be pickled """
+
+        my_instrument = Instrument('myInstrument')
+        source = SpecializedCalculator('source')
+        source.setParams()
+        source.input = (i for i in range(3))
+        my_instrument.add_calculator(source)
+        my_instrument.add_calculator(IncrementCalculator('detector'))
+
+        my_instrument.run()
+        my_instrument.run(skip_unchanged=True)
+        self.assertEqual(my_instrument.dirty_calculators(), [])
+
+        source.input = (i for i in range(3))
+        self.assertEqual(my_instrument.dirty_calculators(),
+                         ['source', 'detector'])
+
+    def testRunFailure(self):
+        """ Testing that a failing calculator stops the run """
+
+        my_instrument = Instrument('myInstrument')
+        my_instrument.add_calculator(IncrementCalculator('source'))
+        my_instrument.add_calculator(FailingCalculator('detector'))
+        self.assertRaises(RuntimeError, my_instrument.run)
+        self.assertRaises(RuntimeError,
+                          my_instrument.run,
+                          shots=3,
+                          pipelined=True)
+
+    def testArun(self):
+        """ Testing the asynchronous run of instruments """
+
+        tmpdir = tempfile.mkdtemp()
+        self.__dirs_to_remove.append(tmpdir)
+        instruments = []
+        for i in range(4):
+            my_instrument = Instrument('instrument{}'.format(i))
+            my_instrument.add_calculator(IncrementCalculator('source'))
+            my_instrument.add_calculator(
+                ExternalIncrementCalculator('detector',
+                                            output_path=os.path.join(
+                                                tmpdir,
+                                                'detector{}'.format(i))))
+            instruments.append(my_instrument)
+
+        async def run_all():
+            return await asyncio.gather(
+                *[my_instrument.arun(shots=2) for my_instrument in instruments])
+
+        self.assertEqual(asyncio.run(run_all()), [[2, 2]] * 4)
+        stages = [record['stage'] for record in instruments[0].report()]
+        self.assertEqual(stages.count('run'), 4)
+
+        my_instrument = Instrument('myInstrument')
+        my_instrument.add_calculator(IncrementCalculator('source'))
+        my_instrument.add_calculator(FailingCalculator('detector'))
+        self.assertRaises(RuntimeError, asyncio.run, my_instrument.arun())
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,133 @@
+import unittest
+import os
+import shutil
+import json
+import tempfile
+
+from libpyvinyl.BaseCalculator import SpecializedCalculator
+from libpyvinyl.Instrument import Instrument
+from libpyvinyl import Instrumentation
+
+
+class InstrumentationTest(unittest.TestCase):
+    """
+    Test class for the Instrumentation module.
+    """
+    def setUp(self):
+        """ Setting up a test. """
+        self.__dirs_to_remove = []
+        self.tmpdir = tempfile.mkdtemp()
+        self.__dirs_to_remove.append(self.tmpdir)
+
+    def tearDown(self):
+        """ Tearing down a test. """
+
+        for d in self.__dirs_to_remove:
+            if os.path.isdir(d):
+                shutil.rmtree(d)
+
+    def testRunRecords(self):
+        """ Testing the records of runs, saves and dumps """
+
+        calculator = SpecializedCalculator('stage',
+                                           output_path=os.path.join(
+                                               self.tmpdir, 'out.h5'))
+        calculator.setParams()
+        calculator._run()
+        calculator.saveH5()
+        calculator.dump(os.path.join(self.tmpdir, 'dump.dill'))
+
+        stages = [record['stage'] for record in calculator.metrics]
+        self.assertEqual(stages, ['run', 'saveH5', 'dump'])
+
+        run = calculator.metrics[0]
+        self.assertEqual(run['calculator'], 'stage')
+        self.assertEqual(run['class'], 'SpecializedCalculator')
+        self.assertEqual(run['status'], 0)
+        self.assertGreaterEqual(run['wall_time'], 0.0)
+        self.assertGreaterEqual(run['cpu_time'], 0.0)
+        self.assertIsNone(run['bytes_written'])
+
+        save = calculator.metrics[1]
+        self.assertEqual(save['bytes_written'],
+                         os.path.getsize(calculator.output_path))
+        self.assertGreater(calculator.metrics[2]['bytes_written'], 0)
+
+        # Copies start with an empty record list.
+        self.assertEqual(list(calculator().metrics), [])
+        self.assertEqual(list(calculator(copy_on_write=True).metrics), [])
+
+        # Records are neither pickled nor written to checkpoints.
+        self.assertNotIn('_BaseCalculator__metrics', calculator.__getstate__())
+        dirname = calculator.checkpoint(os.path.join(self.tmpdir, 'chk'))
+        with open(os.path.join(dirname, 'manifest.json')) as fp:
+            self.assertNotIn('_BaseCalculator__metrics',
+                             json.load(fp)['attributes'])
+
+    def testMaxRecords(self):
+        """ Testing that only the last records are kept """
+
+        max_records = Instrumentation.MAX_RECORDS
+        Instrumentation.MAX_RECORDS = 2
+        try:
+            calculator = SpecializedCalculator('stage')
+        finally:
+            Instrumentation.MAX_RECORDS = max_records
+        calculator.setParams()
+        for i in range(3):
+            calculator._run()
+        self.assertEqual(len(calculator.metrics), 2)
+
+    def testLoadRecords(self):
+        """ Testing the records of loading dumps and checkpoints """
+
+        calculator = SpecializedCalculator('stage')
+        calculator.setParams()
+        calculator.backengine()
+        dump = calculator.dump(os.path.join(self.tmpdir, 'dump.dill'))
+        reloaded = SpecializedCalculator('reloaded', dumpfile=dump)
+        self.assertEqual(reloaded.metrics[-1]['stage'], 'load')
+        self.assertEqual(reloaded.metrics[-1]['calculator'], 'stage')
+        self.assertIsNone(reloaded.metrics[-1]['bytes_written'])
+        self.assertEqual(reloaded.metrics[-1]['bytes_read'],
+                         os.path.getsize(dump))
+
+        dirname = calculator.checkpoint(os.path.join(self.tmpdir, 'chk'))
+        self.assertEqual(calculator.metrics[-1]['stage'], 'checkpoint')
+        restored = SpecializedCalculator.from_checkpoint(dirname)
+        self.assertEqual(restored.metrics[-1]['stage'], 'load')
+
+    def testHooksAndReport(self):
+        """ Testing hooks and the instrument report """
+
+        fname = os.path.join(self.tmpdir, 'metrics.jsonl')
+        hook = Instrumentation.JsonLinesHook(fname)
+        seen = []
+        Instrumentation.add_hook(hook)
+        Instrumentation.add_hook(seen.append)
+        try:
+            instrument = Instrument('instrument')
+            for name in ['source', 'detector']:
+                calculator = SpecializedCalculator(name)
+                calculator.setParams()
+                instrument.add_calculator(calculator)
+            instrument.run(shots=2)
+        finally:
+            Instrumentation.remove_hook(hook)
+            Instrumentation.remove_hook(seen.append)
+
+        self.assertEqual(len(seen), 4)
+        with open(fname, 'r') as fp:
+            lines = [json.loads(line) for line in fp]
+        self.assertEqual([line['calculator'] for line in lines],
+                         ['source', 'detector', 'source', 'detector'])
+
+        report = instrument.report()
+        self.assertEqual(len(report), 4)
+        summary = Instrumentation.summarize(report)
+        self.assertEqual(summary[('source', 'run')]['calls'], 2)
+        self.assertEqual(summary[('detector', 'run')]['calls'], 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
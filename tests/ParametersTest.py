@@ -1,10 +1,13 @@
 import unittest
 import os
 import tempfile
+import numpy
+import pickle
 
 from libpyvinyl.Parameters import Parameter
 from libpyvinyl.Parameters import CalculatorParameters
 from libpyvinyl.Parameters import InstrumentParameters
+from libpyvinyl.ResultCache import parameters_fingerprint
 
 
 class Test_Parameter(unittest.TestCase):
@@ -54,6 +57,92 @@ class Test_Parameter(unittest.TestCase):
         self.assertTrue(par.is_legal("A"))
         self.assertTrue(par.is_legal(38))
 
+    def test_parameter_is_legal_many(self):
+        par = Parameter("test")
+        par.add_legal_interval(None, 8.5)
+        par.add_legal_interval(10, 12)
+        par.add_illegal_interval(3, 4.5)
+
+        values = numpy.linspace(-5, 15, 201)
+        mask = par.is_legal_many(values)
+        self.assertEqual(mask.shape, values.shape)
+        self.assertEqual(list(mask), [par.is_legal(v) for v in values])
+
+        grid = values.reshape(3, 67)
+        self.assertEqual(par.is_legal_many(grid).shape, (3, 67))
+
+    def test_parameter_is_legal_many_options(self):
+        par = Parameter("test")
+        par.add_option(9.8)
+        par.add_option(True)
+        par.add_option(["A", 38])
+
+        self.assertEqual(list(par.is_legal_many([10, 9.8, 38, 1])),
+                         [False, True, True, True])
+        self.assertEqual(list(par.is_legal_many(["A", "B"])), [True, False])
+
+    def test_parameter_many_intervals(self):
+        par = Parameter("test")
+        rng = numpy.random.default_rng(42)
+        for start in rng.uniform(0, 1000, 300):
+            par.add_legal_interval(start, start + rng.uniform(0, 5))
+        par.add_legal_interval(2000, 2001)
+        par.add_legal_interval(2001, 2002)
+        par.add_illegal_interval(500, 510)
+
+        def brute_force(value):
+            if any(i[0] < value < i[1] for i in par.illegal_intervals):
+                return False
+            return any(i[0] < value < i[1] for i in par.legal_intervals)
+
+        values = list(rng.uniform(-10, 1010, 2000)) + [2000.5, 2001, 2001.5]
+        for value in values:
+            self.assertEqual(par.is_legal(value), brute_force(value))
+        self.assertEqual(list(par.is_legal_many(values)),
+                         [brute_force(v) for v in values])
+
+    def test_parameter_constraints_update(self):
+        par = Parameter("test")
+        par.add_legal_interval(3, 4.5)
+        self.assertFalse(par.is_legal(5.0))
+        par.add_legal_interval(4, 6)
+        self.assertTrue(par.is_legal(5.0))
+        par.add_illegal_interval(4.9, 5.1)
+        self.assertFalse(par.is_legal(5.0))
+        par.clear_illegal_intervals()
+        self.assertTrue(par.is_legal(5.0))
+        par.add_option([5.0, 7.0])
+        self.assertTrue(par.is_legal(5.0))
+        self.assertFalse(par.is_legal(5.5))
+        par.clear_options()
+        par.clear_legal_intervals()
+        self.assertTrue(par.is_legal(7.0))
+
+    def test_parameter_to_dict(self):
+        par = Parameter("test", unit="cm")
+        par.add_legal_interval(3, 4.5)
+        par.set_value(4.0)
+        self.assertEqual(
+            par.to_dict(), {
+                "name": "test",
+                "unit": "cm",
+                "comment": None,
+                "value": 4.0,
+                "legal_intervals": [[3, 4.5]],
+                "illegal_intervals": [],
+                "options": []
+            })
+
+    def test_parameter_set_values(self):
+        par = Parameter("test")
+        par.add_legal_interval(3, 4.5)
+
+        par.set_values([3.5, 4.0])
+        self.assertEqual(par.value, [3.5, 4.0])
+
+        par.set_values([3.5, 5.0])  # Since this is not allowed, will be ignored
+        self.assertEqual(par.value, [3.5, 4.0])
+
     def test_parameter_set_value(self):
         par = Parameter("test")
         par.add_legal_interval(3, 4.5)
@@ -71,6 +160,19 @@ class Test_Parameter(unittest.TestCase):
         par_from_dict = Parameter.from_dict(par.__dict__)
         self.assertEqual(par_from_dict.value, 4.0)
 
+    def test_parameter_slots(self):
+        par = Parameter("test", unit="cm")
+        par.add_legal_interval(3, 4.5)
+        par.set_value(4.0)
+
+        with self.assertRaises(AttributeError):
+            par.undefined_attribute = 1
+        self.assertEqual(par.__dict__, par.to_dict())
+
+        par_copy = pickle.loads(pickle.dumps(par))
+        self.assertEqual(par_copy.to_dict(), par.to_dict())
+        self.assertFalse(par_copy.is_legal(5.0))
+
     def test_print_legal_interval(self):
         par = Parameter("test")
         par.add_legal_interval(3, 4.5)
@@ -126,6 +228,124 @@ class Test_Parameters(unittest.TestCase):
         parameters.add(par2)
         print(parameters)
 
+    def test_copy_on_write(self):
+        par1 = Parameter("test")
+        par1.set_value(8)
+        par2 = Parameter("test2", unit="meV")
+        par2.add_legal_interval(0, 100)
+        par2.set_value(10)
+        parameters = CalculatorParameters([par1, par2])
+
+        new_parameters = parameters.copy_on_write()
+        self.assertIsNot(new_parameters.parameters["test"], par1)
+        self.assertEqual(new_parameters["test"].value, 8)
+
+        new_parameters["test2"] = 20
+        new_parameters["test2"].add_legal_interval(200, 300)
+        self.assertEqual(new_parameters["test2"].value, 20)
+        self.assertEqual(parameters["test2"].value, 10)
+        self.assertEqual(parameters["test2"].legal_intervals, [[0, 100]])
+        self.assertFalse(par2.is_legal(250))
+
+        parameters["test"] = 9
+        self.assertEqual(new_parameters["test"].value, 8)
+
+        # References obtained before the copy do not reach the copy.
+        clones = []
+        for value in (1, 2, 3):
+            par1.set_value(value)
+            clones.append(parameters.copy_on_write())
+        self.assertEqual([clone["test"].value for clone in clones], [1, 2, 3])
+        clones[0]["test"].set_value(10)
+        self.assertEqual(par1.value, 3)
+
+    def test_h5(self):
+        parameters = CalculatorParameters()
+        array = parameters.new_parameter("array", unit="m", comment="Array")
+        array.add_legal_interval(0, None)
+        array.set_values(numpy.arange(1.0, 7.0).reshape(2, 3))
+        string = parameters.new_parameter("string")
+        string.add_option(["a", "b"])
+        string.set_value("b")
+        mixed = parameters.new_parameter("mixed")
+        mixed.add_option([1, "a", True])
+        mixed.set_value(True)
+        parameters.new_parameter("integer").set_value(3)
+        parameters.new_parameter("numbers").set_value([1, 2.5])
+        parameters.new_parameter("empty")
+        parameters.new_parameter("complex").set_value(1.0 - 1.0j)
+        parameters.new_parameter("scalar").set_value(numpy.float32(0.5))
+        parameters.new_parameter("mapping").set_value({1: (2, 3)})
+
+        with tempfile.TemporaryDirectory() as d:
+            fname = os.path.join(d, "parameters.h5")
+            parameters.to_h5(fname)
+            loaded = CalculatorParameters.from_h5(fname)
+
+        self.assertEqual(
+            list(loaded.parameters),
+            ["array", "string", "mixed", "integer", "numbers", "empty",
+             "complex", "scalar", "mapping"])
+        self.assertIsInstance(loaded["array"].value, numpy.ndarray)
+        self.assertTrue(
+            numpy.array_equal(loaded["array"].value, array.value))
+        self.assertEqual(loaded["array"].unit, "m")
+        self.assertEqual(loaded["array"].comment, "Array")
+        self.assertEqual(loaded["array"].legal_intervals,
+                         [[0, float("inf")]])
+        self.assertEqual(loaded["string"].value, "b")
+        self.assertEqual(loaded["string"].options, ["a", "b"])
+        self.assertIs(loaded["mixed"].value, True)
+        self.assertEqual(loaded["mixed"].options, [1, "a", True])
+        self.assertEqual(loaded["integer"].value, 3)
+        self.assertIsNone(loaded["empty"].value)
+        self.assertIsNone(loaded["empty"].unit)
+        self.assertEqual(loaded["complex"].value, 1.0 - 1.0j)
+        self.assertIsInstance(loaded["scalar"].value, numpy.float32)
+        self.assertEqual(loaded["mapping"].value, {1: (2, 3)})
+
+        # Mixed ints and floats keep their types, so the fingerprint is kept.
+        self.assertIs(type(loaded["array"].legal_intervals[0][0]), int)
+        self.assertIs(type(loaded["numbers"].value[0]), int)
+        self.assertEqual(loaded["numbers"].value, [1, 2.5])
+        self.assertEqual(parameters_fingerprint(loaded),
+                         parameters_fingerprint(parameters))
+
+    def test_version(self):
+        par1 = Parameter("test")
+        par1.add_legal_interval(0, 10)
+        par2 = Parameter("test2")
+        parameters = CalculatorParameters([par1, par2])
+
+        version = parameters.version
+        parameters["test"].value
+        self.assertEqual(parameters.version, version)
+
+        parameters["test"] = 5
+        self.assertNotEqual(parameters.version, version)
+        version = parameters.version
+        self.assertEqual(par1.version, version)
+
+        # Illegal values are ignored and do not change the version.
+        parameters["test"] = 50
+        self.assertEqual(parameters.version, version)
+
+        par2.set_values(numpy.arange(3))
+        self.assertNotEqual(parameters.version, version)
+        version = parameters.version
+
+        del parameters["test2"]
+        self.assertNotEqual(parameters.version, version)
+        version = parameters.version
+        parameters.new_parameter("test3")
+        self.assertNotEqual(parameters.version, version)
+
+        # Unchanged parameters shared by a copy-on-write copy keep their version.
+        version = parameters.version
+        new_parameters = parameters.copy_on_write()
+        new_parameters["test"].value
+        self.assertEqual(new_parameters.version, version)
+
     def test_json(self):
         par1 = Parameter("test")
         par1.set_value(8)
@@ -235,6 +455,71 @@ class Test_Instruments(unittest.TestCase):
         self.assertEqual(self.instr_parameters.master["absorption"].links,
                          links)
 
+    def test_set_many(self):
+        self.instr_parameters.add_master_parameter(
+            "absorption", {
+                "Sample top": "absorption",
+                "Sample bottom": "absorption"
+            })
+        self.instr_parameters.add_master_parameter("height",
+                                                   {"Sample top": "height"})
+        master = self.instr_parameters.master
+        top = self.instr_parameters["Sample top"]
+        bottom = self.instr_parameters["Sample bottom"]
+
+        master.set_many({"absorption": 2.0, "height": 5.0})
+        self.assertEqual(top["absorption"].value, 2.0)
+        self.assertEqual(bottom["absorption"].value, 2.0)
+        self.assertEqual(top["height"].value, 5.0)
+
+        # An illegal value for one target leaves every parameter unchanged.
+        self.assertRaises(ValueError, master.set_many, {
+            "absorption": 3.0,
+            "height": -1.0
+        })
+        self.assertEqual(top["absorption"].value, 2.0)
+        self.assertEqual(master["absorption"].value, 2.0)
+        master["absorption"] = -1.0
+        self.assertEqual(bottom["absorption"].value, 2.0)
+
+        # Links follow parameters replaced by copy-on-write.
+        shared = top.copy_on_write()
+        master["absorption"] = 4.0
+        self.assertEqual(top["absorption"].value, 4.0)
+        self.assertEqual(shared["absorption"].value, 2.0)
+
+        # And parameters replaced by deletion and addition.
+        del bottom["absorption"]
+        bottom.new_parameter("absorption")
+        master["absorption"] = 5.0
+        self.assertEqual(bottom["absorption"].value, 5.0)
+
+    def test_h5(self):
+        links = {"Sample top": "absorption", "Sample bottom": "absorption"}
+        self.instr_parameters.add_master_parameter("absorption",
+                                                   links,
+                                                   unit="barns")
+        self.instr_parameters.master["absorption"] = 3.4
+        self.instr_parameters["Source"]["position"].set_values(
+            numpy.array([-1.0, 0.0, 1.0]))
+        temp_file = os.path.join(self.d.name, 'test.h5')
+        self.instr_parameters.to_h5(temp_file)
+
+        instr_h5 = InstrumentParameters.from_h5(temp_file)
+        self.assertEqual(list(instr_h5.parameters_dict),
+                         ["Source", "Sample top", "Sample bottom"])
+        self.assertEqual(instr_h5['Source']['energy'].value, 4000)
+        self.assertEqual(instr_h5['Sample top']['absorption'].value, 3.4)
+        self.assertEqual(instr_h5.master['absorption'].links, links)
+        self.assertEqual(instr_h5.master['absorption'].unit, "barns")
+        instr_h5.master['absorption'] = 1.0
+        self.assertEqual(instr_h5['Sample bottom']['absorption'].value, 1.0)
+
+        source = InstrumentParameters.calculator_from_h5(temp_file, "Source")
+        self.assertIsInstance(source, CalculatorParameters)
+        self.assertTrue(
+            numpy.array_equal(source['position'].value, [-1.0, 0.0, 1.0]))
+
     def test_print(self):
         print(self.instr_parameters)
 
@@ -1,6 +1,5 @@
 from libpyvinyl.BaseCalculator import BaseCalculator, CalculatorParameters
 import numpy
-import h5py
 
 
 class RandomImageCalculator(BaseCalculator):
@@ -32,7 +31,4 @@ class RandomImageCalculator(BaseCalculator):
         return 0
 
     def saveH5(self, openpmd=False):
-        with h5py.File(self.output_path, "w") as h5:
-            ds = h5.create_dataset("/data", data=self.data)
-
-            h5.close()
+        return self._write_h5(self.output_path, {"/data": self.data})
@@ -0,0 +1,82 @@
+import unittest
+import os
+import shutil
+import tempfile
+import h5py
+import numpy
+
+from libpyvinyl.RayColumns import COLUMN_NAMES, read_rays, write_rays
+from libpyvinyl.RayStatistics import ray_intensities
+
+from RayStatisticsTest import make_rays
+
+
+class RayColumnsTest(unittest.TestCase):
+    """
+    Test class for the columnar hdf5 storage of rays.
+    """
+    def setUp(self):
+        """ Setting up a test. """
+        self.__dirs_to_remove = []
+        self.tmp_dir = tempfile.mkdtemp()
+        self.__dirs_to_remove.append(self.tmp_dir)
+        self.fname = os.path.join(self.tmp_dir, "rays.h5")
+
+    def tearDown(self):
+        """ Tearing down a test. """
+
+        for d in self.__dirs_to_remove:
+            if os.path.isdir(d):
+                shutil.rmtree(d)
+
+    def testRoundTrip(self):
+        """ Testing that all columns are written chunked and compressed """
+
+        rays = make_rays(1000)
+        write_rays(self.fname, rays, chunks=(256, ))
+
+        with h5py.File(self.fname, "r") as h5:
+            self.assertEqual(list(h5["/rays"].keys()), COLUMN_NAMES)
+            self.assertEqual(h5["/rays"].attrs['rays'], 1000)
+            self.assertEqual(h5["/rays/x"].chunks, (256, ))
+            self.assertEqual(h5["/rays/x"].compression, 'gzip')
+
+        self.assertTrue(numpy.array_equal(read_rays(self.fname), rays))
+
+    def testPartialRead(self):
+        """ Testing reads of selected columns and good rays """
+
+        rays = make_rays(1000)
+        write_rays(self.fname, rays)
+        good = rays[rays[:, 9] > 0]
+
+        columns = read_rays(self.fname, columns=[1, 'z', 'intensity'])
+        self.assertEqual(columns.shape, (1000, 3))
+        self.assertTrue(numpy.array_equal(columns[:, 0], rays[:, 0]))
+        self.assertTrue(numpy.array_equal(columns[:, 1], rays[:, 2]))
+        self.assertTrue(numpy.allclose(columns[:, 2], ray_intensities(rays)))
+
+        columns = read_rays(self.fname, columns=['x', 'flag'], nolost=True)
+        self.assertTrue(numpy.array_equal(columns, good[:, [0, 9]]))
+        self.assertTrue(numpy.array_equal(read_rays(self.fname, nolost=True),
+                                          good))
+
+        with self.assertRaises(KeyError):
+            read_rays(self.fname, columns=['w'])
+        with self.assertRaises(KeyError):
+            read_rays(self.fname, columns=[19])
+
+    def testGroups(self):
+        """ Testing several beams in one file """
+
+        write_rays(self.fname, make_rays(10, seed=1), group="/oe1")
+        write_rays(self.fname, make_rays(20, seed=2), group="/oe2", mode="a")
+        self.assertEqual(read_rays(self.fname, group="/oe1").shape, (10, 18))
+        self.assertEqual(read_rays(self.fname, group="/oe2").shape, (20, 18))
+
+        with self.assertRaises(ValueError):
+            write_rays(self.fname, numpy.zeros((10, 3)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,162 @@
+import unittest
+import numpy
+
+from libpyvinyl.RayStatistics import (reduce, merge, Histogram, Histogram2D,
+                                      Moments, good_rays, ray_intensities,
+                                      intensity, histogram1d, histogram2d,
+                                      fwhm, centroid, beam_statistics)
+
+
+def make_rays(n, seed=0):
+    """ Random Shadow-like ray array with about a tenth of lost rays. """
+    rng = numpy.random.default_rng(seed)
+    rays = rng.normal(size=(n, 18))
+    rays[:, 9] = numpy.where(rng.random(n) < 0.1, -1.0, 1.0)
+    return rays
+
+
+class RayStatisticsTest(unittest.TestCase):
+    """
+    Test class for the ray statistics reducers.
+    """
+    def testReduceBatches(self):
+        """ Testing that reducing batches equals reducing all rays at once """
+
+        rays = make_rays(10000)
+        batches = numpy.array_split(rays, 7)
+
+        streamed = reduce(batches, [
+            Histogram(1, 50, (-3, 3)),
+            Histogram2D(1, 3, (20, 30), ((-3, 3), (-2, 2))),
+            Moments([1, 3])
+        ])
+        whole = reduce([rays], [
+            Histogram(1, 50, (-3, 3)),
+            Histogram2D(1, 3, (20, 30), ((-3, 3), (-2, 2))),
+            Moments([1, 3])
+        ])
+
+        self.assertTrue(numpy.array_equal(streamed[0].counts, whole[0].counts))
+        self.assertTrue(numpy.array_equal(streamed[1].counts, whole[1].counts))
+        self.assertEqual(streamed[1].counts.shape, (20, 30))
+        self.assertEqual(streamed[2].count, whole[2].count)
+        self.assertTrue(numpy.allclose(streamed[2].mean, whole[2].mean))
+        self.assertTrue(numpy.allclose(streamed[2].std, whole[2].std))
+
+    def testNolost(self):
+        """ Testing that lost rays are skipped unless asked for """
+
+        rays = make_rays(1000)
+        good = rays[rays[:, 9] > 0]
+
+        moments = reduce([rays], [Moments([1, 2])])[0]
+        self.assertEqual(moments.count, good.shape[0])
+        self.assertTrue(numpy.allclose(moments.mean, good[:, :2].mean(axis=0)))
+        self.assertTrue(numpy.allclose(moments.std, good[:, :2].std(axis=0)))
+
+        histogram = reduce([rays], [Histogram(1, 10, (-10, 10),
+                                              nolost=False)])[0]
+        self.assertEqual(histogram.counts.sum(), 1000)
+
+    def testLargeOffset(self):
+        """ Testing the standard deviation of a column with a large offset """
+
+        rays = make_rays(10000)
+        # Wavenumbers around 5e8 with a relative bandwidth of 1e-5.
+        rays[:, 10] = 5e8 * (1.0 + 1e-5 * rays[:, 0])
+        good = rays[rays[:, 9] > 0, 10]
+
+        moments = reduce(numpy.array_split(rays, 7), [Moments([11])])[0]
+        self.assertAlmostEqual(moments.std[0] / good.std(), 1.0, places=9)
+        self.assertAlmostEqual(moments.mean[0] / good.mean(), 1.0, places=12)
+
+    def testEmpty(self):
+        """ Testing moments without rays """
+
+        moments = Moments([1])
+        self.assertEqual(moments.count, 0)
+        self.assertTrue(numpy.isnan(moments.mean[0]))
+        self.assertTrue(numpy.isnan(moments.std[0]))
+
+    def testHistograms(self):
+        """ Testing the histograms against numpy """
+
+        rays = make_rays(10000)
+        x, z = rays[:, 0], rays[:, 2]
+        weights = ray_intensities(rays)
+
+        counts = histogram1d(x, 40, (-2, 2), weights)
+        expected = numpy.histogram(x, 40, (-2, 2), weights=weights)[0]
+        self.assertTrue(numpy.allclose(counts, expected))
+
+        counts = histogram2d(x, z, (20, 30), ((-2, 2), (-1, 3)))
+        expected = numpy.histogram2d(x, z, (20, 30), ((-2, 2), (-1, 3)))[0]
+        self.assertTrue(numpy.array_equal(counts, expected))
+
+        # The upper edge belongs to the last bin.
+        self.assertEqual(list(histogram1d([0.0, 1.0, 2.0], 2, (0, 1))),
+                         [1.0, 1.0])
+
+    def testFigures(self):
+        """ Testing good rays, intensity, FWHM and centroids """
+
+        rays = make_rays(1000)
+        mask = good_rays(rays)
+        self.assertEqual(mask.sum(), (rays[:, 9] > 0).sum())
+
+        fields = rays[:, [6, 7, 8, 15, 16, 17]]
+        self.assertTrue(
+            numpy.allclose(ray_intensities(rays), (fields**2).sum(axis=1)))
+        self.assertAlmostEqual(intensity(rays),
+                               (fields[mask]**2).sum(),
+                               places=6)
+
+        edges = numpy.linspace(-5, 5, 201)
+        centers = 0.5 * (edges[:-1] + edges[1:])
+        gaussian = numpy.exp(-0.5 * (centers - 0.5)**2)
+        self.assertAlmostEqual(fwhm(gaussian, edges), 2.3548, places=2)
+        self.assertTrue(numpy.isnan(fwhm(numpy.zeros(10), numpy.arange(11))))
+
+        self.assertAlmostEqual(centroid([1.0, 3.0], [1.0, 3.0]), 2.5)
+        self.assertTrue(numpy.isnan(centroid([])))
+
+        statistics = beam_statistics(rays)
+        self.assertEqual(statistics['good'], mask.sum())
+        self.assertEqual(len(statistics['fwhm']), 2)
+        self.assertAlmostEqual(
+            statistics['centroid'][0],
+            numpy.average(rays[mask, 0], weights=ray_intensities(rays[mask])))
+
+    def testMerge(self):
+        """ Testing that merged reducers of several workers equal one reducer """
+
+        rays = make_rays(10000)
+
+        def reducers():
+            return [
+                Histogram(1, 50, (-3, 3), weighted=True),
+                Histogram2D(1, 3, 20, ((-3, 3), (-3, 3))),
+                Moments([1, 3], weighted=True)
+            ]
+
+        workers = [reduce([batch], reducers())
+                   for batch in numpy.array_split(rays, 3)]
+        merged = [merge(list(kind)) for kind in zip(*workers)]
+        whole = reduce([rays], reducers())
+
+        self.assertTrue(numpy.allclose(merged[0].counts, whole[0].counts))
+        self.assertTrue(numpy.array_equal(merged[1].counts, whole[1].counts))
+        self.assertEqual(merged[2].count, whole[2].count)
+        self.assertTrue(numpy.allclose(merged[2].mean, whole[2].mean))
+        self.assertTrue(numpy.allclose(merged[2].std, whole[2].std))
+        self.assertAlmostEqual(merged[0].fwhm, whole[0].fwhm)
+        self.assertAlmostEqual(merged[2].weight, intensity(rays))
+
+        with self.assertRaises(ValueError):
+            Histogram(1, 50, (-3, 3)).merge(Histogram(1, 40, (-3, 3)))
+        with self.assertRaises(TypeError):
+            Histogram(1, 50, (-3, 3)).merge(Moments([1]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,125 @@
+import unittest
+import os
+import shutil
+import tempfile
+import numpy
+import h5py
+
+from libpyvinyl.BaseCalculator import SpecializedCalculator
+from libpyvinyl.ResultCache import ResultCache, data_fingerprint
+
+
+class ResultCacheTest(unittest.TestCase):
+    """
+    Test class for the ResultCache class.
+    """
+    def setUp(self):
+        """ Setting up a test. """
+        self.__dirs_to_remove = []
+        self.cache_dir = tempfile.mkdtemp()
+        self.__dirs_to_remove.append(self.cache_dir)
+
+    def tearDown(self):
+        """ Tearing down a test. """
+
+        for d in self.__dirs_to_remove:
+            if os.path.isdir(d):
+                shutil.rmtree(d)
+
+    def testCacheHit(self):
+        """ Testing that identical parameters restore the cached data """
+
+        calculator = SpecializedCalculator('cached')
+        calculator.setParams(photon_energy=10.0)
+        calculator.cache = ResultCache(self.cache_dir)
+
+        self.assertEqual(calculator._run(), 0)
+        first = calculator.data
+
+        # The backengine draws random numbers, a rerun only reproduces the data
+        # when it comes from the cache.
+        self.assertEqual(calculator._run(), 0)
+        self.assertTrue(numpy.array_equal(first, calculator.data))
+
+        other = SpecializedCalculator('other')
+        other.setParams(photon_energy=10.0)
+        other.cache = calculator.cache
+        other._run()
+        self.assertTrue(numpy.array_equal(first, other.data))
+
+    def testCacheMiss(self):
+        """ Testing that changed parameters or input rerun the backengine """
+
+        calculator = SpecializedCalculator('cached')
+        calculator.setParams(photon_energy=10.0)
+        calculator.cache = ResultCache(self.cache_dir)
+        key = calculator.cache.key(calculator)
+        calculator._run()
+        self.assertIn(key, calculator.cache)
+
+        calculator.parameters['photon_energy'] = 20.0
+        self.assertNotEqual(calculator.cache.key(calculator), key)
+        calculator._run()
+        self.assertAlmostEqual(numpy.mean(calculator.data), 20.0, places=1)
+
+        calculator.parameters['photon_energy'] = 10.0
+        calculator.input = numpy.arange(3)
+        self.assertNotEqual(calculator.cache.key(calculator), key)
+
+    def testEviction(self):
+        """ Testing least recently used eviction """
+
+        cache = ResultCache(self.cache_dir, max_size=2500)
+        data = numpy.zeros(100)
+        cache.store('a', data)
+        cache.store('b', data)
+        os.utime(os.path.join(self.cache_dir, 'a.npy'), (0, 0))
+        os.utime(os.path.join(self.cache_dir, 'b.npy'), (1, 1))
+        cache.load('a')
+        cache.store('c', data)
+
+        self.assertIn('a', cache)
+        self.assertNotIn('b', cache)
+        self.assertIn('c', cache)
+        self.assertLessEqual(cache.size(), 2500)
+
+        cache.clear()
+        self.assertEqual(cache.size(), 0)
+
+    def testFingerprints(self):
+        """ Testing fingerprints of array views and hdf5 datasets """
+
+        data = numpy.arange(20.0).reshape(4, 5)
+        self.assertEqual(data_fingerprint(data[:, ::2]),
+                         data_fingerprint(data[:, ::2].copy()))
+        self.assertNotEqual(data_fingerprint(data),
+                            data_fingerprint(data.astype(numpy.float32)))
+
+        fname = os.path.join(self.cache_dir, "input.h5")
+        with h5py.File(fname, "w") as h5:
+            h5["/a"] = data
+            h5["/b"] = data
+        with h5py.File(fname, "r") as h5:
+            self.assertEqual(data_fingerprint(h5["/a"]),
+                             data_fingerprint(h5["/a"]))
+            self.assertNotEqual(data_fingerprint(h5["/a"]),
+                                data_fingerprint(h5["/b"]))
+
+            # A cached calculator downstream of hdf5 backed data.
+            calculator = SpecializedCalculator('cached')
+            calculator.setParams(photon_energy=10.0)
+            calculator.cache = ResultCache(self.cache_dir)
+            calculator.input = h5["/a"]
+            self.assertEqual(calculator._run(), 0)
+            self.assertIn(calculator.cache.key(calculator), calculator.cache)
+
+    def testWrongType(self):
+        """ Testing that only ResultCache instances are accepted """
+
+        calculator = SpecializedCalculator('cached')
+        with self.assertRaises(TypeError):
+            calculator.cache = self.cache_dir
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,6 +1,99 @@
 from libpyvinyl.BaseCalculator import BaseCalculator, CalculatorParameters
+from libpyvinyl.RayColumns import write_rays
+from libpyvinyl.RayStatistics import reduce as reduce_batches
 import Shadow
+import collections
 import inspect
+import numpy
+import os
+
+# (name, default value) of the variables of Shadow.Source and Shadow.OE, see
+# _get_variables
+_VARIABLES = {}
+
+
+def _get_variables(shadow_class):
+    """
+    returns the (name, default value) pairs of the Shadow.Source or Shadow.OE
+    variables, inspected once per class
+    """
+    variables = _VARIABLES.get(shadow_class)
+    if variables is None:
+        variables = tuple((name, value)
+                          for name, value in inspect.getmembers(shadow_class())
+                          if name.isupper())
+        _VARIABLES[shadow_class] = variables
+    return variables
+
+
+# Marks parameters that were not marshalled yet
+_UNSET = object()
+
+
+def _is_equal(value, other):
+    """
+    returns True if two marshalled values are equal, e.g. a value and the
+    default of its variable
+    """
+    if isinstance(value, numpy.ndarray) or isinstance(other, numpy.ndarray):
+        return numpy.array_equal(value, other)
+    return type(value) == type(other) and value == other
+
+
+def _trace(assignments, npoint=None, seed=None):
+    """
+    runs the source and the optical elements, with the given number of rays
+    and seed (ISTAR1) instead of the ones in assignments if given
+    """
+    beam = Shadow.Beam()
+    # Fresh objects hold the defaults, only other values are set
+    oe0 = Shadow.Source()
+    for name, value in assignments[0].items():
+        setattr(oe0, name, value)
+    if npoint is not None:
+        oe0.NPOINT = npoint
+    if seed is not None:
+        oe0.ISTAR1 = seed
+
+    beam.genSource(oe0)
+
+    for i in range(1, len(assignments)):
+        oe_i = Shadow.OE()
+        for name, value in assignments[i].items():
+            setattr(oe_i, name, value)
+
+        beam.traceOE(oe_i, i)
+
+    return beam
+
+
+def _trace_batch(args):
+    """
+    traces a single ray batch, executed in a worker process
+    """
+    assignments, npoint, seed = args
+    return _trace(assignments, npoint, seed).rays
+
+
+def _ray_batches(npoint, seed, batches):
+    """
+    returns (number of rays, seed) of each batch, the seeds are odd if seed is
+    """
+    sizes = [npoint // batches + (1 if k < npoint % batches else 0)
+             for k in range(batches)]
+    return [(size, seed + 2 * k) for k, size in enumerate(sizes) if size > 0]
+
+
+def _merge_rays(rays):
+    """
+    merges the rays of several batches into a single beam
+    """
+    beam = Shadow.Beam()
+    beam.rays = numpy.concatenate(rays)
+    # Column 12 holds the ray index, renumbered to stay unique
+    beam.rays[:, 11] = numpy.arange(1, beam.rays.shape[0] + 1)
+    return beam
+
 
 class Shadow3Calculator(BaseCalculator):
     def __init__(self,
@@ -16,6 +109,32 @@ class Shadow3Calculator(BaseCalculator):
                          output_path=output_path)
 
         self.number_of_optical_elements = 0
+        # Per element 0 (source) to N: (parameter name, variable, default)
+        self.__variable_map = None
+        # Per element: variable -> marshalled value, for non-default values
+        self.__assignments = None
+        # Parameter name -> value of the last marshalling, before encoding
+        self.__values = {}
+        self.ray_batches = 1
+        self.workers = None
+
+    def set_ray_split(self, batches, workers=None):
+        """
+        splits the source into independent ray batches traced in parallel
+
+        :param batches: Number of batches, each with NPOINT/batches rays and its
+            own seed ISTAR1 + 2*k. If 1, all rays are traced in one go.
+        :type  batches: int
+
+        :param workers: Number of worker processes. Default is the number of
+            processors on the machine. If 1, the batches run in this process.
+        :type  workers: int
+
+        """
+        if batches < 1:
+            raise ValueError("batches should be at least 1.")
+        self.ray_batches = batches
+        self.workers = workers
 
     def setParams(self,
             source=None,
@@ -41,11 +160,11 @@ class Shadow3Calculator(BaseCalculator):
             self.parameters = CalculatorParameters()
 
         for key in oe0_dict.keys():
-            self.parameters.new_parameter("oe0."+key)
+            parameter = self.parameters.new_parameter("oe0."+key)
             if isinstance(oe0_dict[key], bytes):
-                self.parameters["oe0."+key].set_value(oe0_dict[key].decode("utf-8"))
+                parameter.set_value(oe0_dict[key].decode("utf-8"))
             else:
-                self.parameters["oe0."+key].set_value(oe0_dict[key])
+                parameter.set_value(oe0_dict[key])
 
         # beamline
         if len(beamline) == 0 and number_of_optical_elements > 0:
@@ -63,67 +182,168 @@ class Shadow3Calculator(BaseCalculator):
                 self.parameters = CalculatorParameters()
 
             for key in oe_i_dict.keys():
-                self.parameters.new_parameter("oe%d.%s" % (i+1, key))
+                parameter = self.parameters.new_parameter("oe%d.%s" % (i+1, key))
                 if isinstance(oe_i_dict[key], bytes):
-                    self.parameters["oe%d.%s" % (i+1, key)].set_value(oe_i_dict[key].decode("utf-8"))
+                    parameter.set_value(oe_i_dict[key].decode("utf-8"))
                 else:
-                    self.parameters["oe%d.%s" % (i+1, key)].set_value(oe_i_dict[key])
+                    parameter.set_value(oe_i_dict[key])
 
         self.number_of_optical_elements = number_of_optical_elements
+        self.__compile_variables()
 
-    def __get_valiable_list(self, object1):
+    def __compile_variables(self):
         """
-        returns a list of the Shadow.Source or Shadow.OE variables
+        maps the parameters "oeN.NAME" to the variables of the Shadow objects
         """
-        mem = inspect.getmembers(object1)
-        mylist = []
-        for i,var in enumerate(mem):
-            if var[0].isupper():
-                mylist.append(var[0])
-        return(mylist)
+        variable_map = [[("oe0." + name, name, default)
+                         for name, default in _get_variables(Shadow.Source)]]
+        for i in range(self.number_of_optical_elements):
+            variable_map.append([("oe%d.%s" % (i + 1, name), name, default)
+                                 for name, default in _get_variables(Shadow.OE)])
 
-    def backengine(self):
-        beam = Shadow.Beam()
-        oe0 = Shadow.Source()
+        self.__variable_map = variable_map
+        self.__assignments = [{} for element in variable_map]
+        self.__values = {}
 
+    def __update_assignments(self):
+        """
+        marshals the parameters whose values changed since the last run
+        """
+        if self.__dict__.get("_Shadow3Calculator__variable_map") is None:
+            self.__compile_variables()
 
-        oe0_list = self.__get_valiable_list(oe0)
+        parameters = self.parameters.parameters
+        last_values = self.__values
+        # Copies, since copy-on-write copies of this calculator share them
+        assignments = None
+        values = None
+        for element, variables in enumerate(self.__variable_map):
+            for parameter_name, name, default in variables:
+                try:
+                    value = parameters[parameter_name].value
+                except KeyError:
+                    raise Exception("Error setting parameters name %s" % name)
+                # The raw values are compared, by value since assigning
+                # Parameter.value directly does not change the version. Only
+                # changed values are encoded.
+                last = last_values.get(parameter_name, _UNSET)
+                if last is value or (last is not _UNSET
+                                     and _is_equal(value, last)):
+                    continue
 
-        for name in oe0_list:
-            try:
-                value = self.parameters["oe0."+name].value
+                if assignments is None:
+                    assignments = [dict(a) for a in self.__assignments]
+                    values = dict(last_values)
+                if isinstance(value, numpy.ndarray):
+                    # Arrays may be changed in place later
+                    value = value.copy()
+                values[parameter_name] = value
                 if isinstance(value, str):
                     value = bytes(value, 'UTF-8')
-                setattr(oe0, name, value)
-            except:
-                raise Exception("Error setting parameters name %s" % name)
+                if _is_equal(value, default):
+                    assignments[element].pop(name, None)
+                else:
+                    assignments[element][name] = value
 
+        if assignments is not None:
+            self.__assignments = assignments
+            self.__values = values
 
-        beam.genSource(oe0)
+    def backengine(self):
+        self.__update_assignments()
 
-        if self.number_of_optical_elements > 0:
-            oei_list = self.__get_valiable_list(Shadow.OE())
-            for i in range(self.number_of_optical_elements):
-                oe_i = Shadow.OE()
-                for name in oei_list:
-                    try:
-                        value = self.parameters["oe%d.%s" % (i+1, name)].value
-                        if isinstance(value, str):
-                            value = bytes(value, 'UTF-8')
-                        setattr(oe_i, name, value)
-                    except:
-                        raise Exception("Error setting parameters name %s" % name)
-
-                beam.traceOE(oe_i, i+1)
-
-        self._set_data(beam)
+        batches = getattr(self, "ray_batches", 1)
+        if batches == 1:
+            self._set_data(_trace(self.__assignments))
+            return 0
+
+        parameters = self.parameters.parameters
+        jobs = [(self.__assignments, npoint, seed)
+                for npoint, seed in _ray_batches(
+                    parameters["oe0.NPOINT"].value,
+                    parameters["oe0.ISTAR1"].value, batches)]
+
+        workers = getattr(self, "workers", None)
+        if workers == 1:
+            rays = [_trace_batch(job) for job in jobs]
+        else:
+            from concurrent.futures import ProcessPoolExecutor
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                rays = list(executor.map(_trace_batch, jobs))
+
+        self._set_data(_merge_rays(rays))
         return 0
 
 
+    def iter_rays(self, batch_size, workers=1):
+        """
+        traces the rays in batches of at most batch_size rays and yields the
+        ray array of each batch, so that only a few batches are in memory
+
+        :param batch_size: The maximum number of rays per batch.
+        :type  batch_size: int
+
+        :param workers: Number of worker processes tracing batches ahead.
+            Default is 1, tracing each batch in this process when it is
+            requested. None uses the number of processors on the machine.
+        :type  workers: int
+
+        """
+        self.__update_assignments()
+
+        parameters = self.parameters.parameters
+        npoint = parameters["oe0.NPOINT"].value
+        batches = max(1, -(-npoint // batch_size))
+        jobs = [(self.__assignments, size, seed)
+                for size, seed in _ray_batches(
+                    npoint, parameters["oe0.ISTAR1"].value, batches)]
+
+        offset = 0
+        for rays in self.__trace_ahead(jobs, workers):
+            # Column 12 holds the ray index, numbered across the batches
+            rays[:, 11] = numpy.arange(offset + 1, offset + rays.shape[0] + 1)
+            offset += rays.shape[0]
+            yield rays
+
+    def __trace_ahead(self, jobs, workers):
+        """
+        yields the rays of the jobs in order, tracing at most workers batches
+        ahead of the consumer
+        """
+        if workers == 1:
+            for job in jobs:
+                yield _trace_batch(job)
+            return
+
+        if workers is None:
+            workers = os.cpu_count() or 1
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            pending = collections.deque()
+            for job in jobs:
+                pending.append(executor.submit(_trace_batch, job))
+                if len(pending) >= workers:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+
+    def reduce_rays(self, reducers, batch_size, workers=1):
+        """
+        feeds the ray batches of iter_rays to reducers of
+        libpyvinyl.RayStatistics and returns the reducers, see iter_rays for
+        batch_size and workers, by default 1
+        """
+        return reduce_batches(self.iter_rays(batch_size, workers), reducers)
+
     def dump(self,filename="star.01"): # overwritten method
         self.data.write(filename)
 
     def saveH5(self, filename="tmp.h5", openpmd=False):
-        from orangecontrib.panosc.shadow.util.openPMD import saveShadowToHDF
-        saveShadowToHDF(self.data, filename=filename)
+        if openpmd:
+            from orangecontrib.panosc.shadow.util.openPMD import saveShadowToHDF
+            saveShadowToHDF(self.data, filename=filename)
+        else:
+            # One chunked, compressed dataset per ray column, see
+            # libpyvinyl.RayColumns.read_rays for partial reads
+            write_rays(filename, self.data.rays)
 
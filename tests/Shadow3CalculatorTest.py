@@ -0,0 +1,172 @@
+import unittest
+import importlib
+import sys
+import types
+from unittest import mock
+import numpy
+
+
+class StubElement():
+    """ Stands in for Shadow.Source and Shadow.OE, records assignments. """
+    defaults = {}
+
+    def __init__(self):
+        self.__dict__.update(
+            {name: numpy.copy(value) if isinstance(value, numpy.ndarray)
+             else value
+             for name, value in self.defaults.items()})
+        self.__dict__['assigned'] = {}
+
+    def __setattr__(self, name, value):
+        self.__dict__['assigned'][name] = value
+        self.__dict__[name] = value
+
+    def to_dictionary(self):
+        return {name: getattr(self, name) for name in self.defaults}
+
+
+class StubSource(StubElement):
+    defaults = {
+        'NPOINT': 5000,
+        'ISTAR1': 5676561,
+        'FDISTR': 2,
+        'FILE_SOURCE': b"begin.dat",
+    }
+
+
+class StubOE(StubElement):
+    defaults = {
+        'T_SOURCE': 10.0,
+        'FMIRR': 5,
+        'CCC': numpy.zeros(3),
+    }
+
+
+class StubBeam():
+    """ Stands in for Shadow.Beam, rays hold the source seed in column 11. """
+    def __init__(self):
+        self.rays = None
+        self.elements = []
+
+    def genSource(self, source):
+        self.elements.append(source)
+        self.rays = numpy.zeros((source.NPOINT, 18))
+        self.rays[:, 9] = 1.0
+        self.rays[:, 10] = source.ISTAR1
+        self.rays[:, 11] = numpy.arange(1, source.NPOINT + 1)
+
+    def traceOE(self, oe, i):
+        self.elements.append(oe)
+
+
+def make_shadow():
+    """ A module standing in for Shadow. """
+    shadow = types.ModuleType('Shadow')
+    shadow.Source = StubSource
+    shadow.OE = StubOE
+    shadow.Beam = StubBeam
+    return shadow
+
+
+class Shadow3CalculatorTest(unittest.TestCase):
+    """
+    Test class for the Shadow3Calculator, with Shadow replaced by a stub.
+    """
+    def setUp(self):
+        """ Setting up a test. """
+        self.__patch = mock.patch.dict(sys.modules, {'Shadow': make_shadow()})
+        self.__patch.start()
+        sys.modules.pop('Shadow3Calculator', None)
+        self.module = importlib.import_module('Shadow3Calculator')
+
+    def tearDown(self):
+        """ Tearing down a test. """
+        self.__patch.stop()
+
+    def make_calculator(self):
+        calculator = self.module.Shadow3Calculator("shadow")
+        calculator.setParams(number_of_optical_elements=1)
+        return calculator
+
+    def testRayBatches(self):
+        """ Testing the split of the rays into batches """
+
+        self.assertEqual(self.module._ray_batches(10, 5, 3),
+                         [(4, 5), (3, 7), (3, 9)])
+        self.assertEqual(self.module._ray_batches(2, 1, 3), [(1, 1), (1, 3)])
+
+    def testIsEqual(self):
+        """ Testing the comparison of marshalled values """
+
+        is_equal = self.module._is_equal
+        self.assertTrue(is_equal(numpy.zeros(3), numpy.zeros(3)))
+        self.assertFalse(is_equal(numpy.zeros(3), numpy.ones(3)))
+        self.assertTrue(is_equal(b"a", b"a"))
+        self.assertFalse(is_equal("a", b"a"))
+        self.assertFalse(is_equal(1, 1.0))
+
+    def testMarshalling(self):
+        """ Testing that only non-default and changed values are set """
+
+        calculator = self.make_calculator()
+        calculator.parameters["oe0.NPOINT"].value = 100
+        calculator.parameters["oe0.FILE_SOURCE"].value = "other.dat"
+        calculator.backengine()
+
+        source, oe1 = calculator.data.elements
+        self.assertEqual(source.assigned, {
+            'NPOINT': 100,
+            'FILE_SOURCE': b"other.dat"
+        })
+        self.assertEqual(oe1.assigned, {})
+
+        # Unchanged values are neither encoded nor marshalled again.
+        assignments = calculator._Shadow3Calculator__assignments
+        calculator.backengine()
+        self.assertIs(calculator._Shadow3Calculator__assignments, assignments)
+        self.assertIs(
+            calculator._Shadow3Calculator__values["oe0.FILE_SOURCE"],
+            calculator.parameters["oe0.FILE_SOURCE"].value)
+
+        # Plain value assignments after the first run are picked up.
+        calculator.parameters["oe0.NPOINT"].value = 200
+        calculator.parameters["oe1.CCC"].value[1] = 1.0
+        calculator.backengine()
+        source, oe1 = calculator.data.elements
+        self.assertEqual(source.assigned['NPOINT'], 200)
+        self.assertEqual(list(oe1.assigned['CCC']), [0.0, 1.0, 0.0])
+
+        # Back to the default, the variable is not set anymore.
+        calculator.parameters["oe0.NPOINT"].value = 5000
+        calculator.backengine()
+        self.assertNotIn('NPOINT', calculator.data.elements[0].assigned)
+
+    def testRaySplit(self):
+        """ Testing ray batches traced with distinct seeds and merged """
+
+        calculator = self.make_calculator()
+        calculator.parameters["oe0.NPOINT"].value = 10
+        calculator.set_ray_split(3, workers=1)
+        calculator.backengine()
+
+        rays = calculator.data.rays
+        self.assertEqual(rays.shape, (10, 18))
+        self.assertEqual(sorted(set(rays[:, 10])),
+                         [5676561, 5676563, 5676565])
+        self.assertEqual(list(rays[:, 11]), list(range(1, 11)))
+        self.assertRaises(ValueError, calculator.set_ray_split, 0)
+
+    def testIterRays(self):
+        """ Testing the streaming of ray batches """
+
+        calculator = self.make_calculator()
+        calculator.parameters["oe0.NPOINT"].value = 10
+        batches = list(calculator.iter_rays(4, workers=1))
+
+        self.assertEqual([batch.shape[0] for batch in batches], [4, 3, 3])
+        self.assertEqual(list(numpy.concatenate(batches)[:, 11]),
+                         list(range(1, 11)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -28,12 +28,18 @@ import unittest
 import os, sys
 
 from BaseCalculatorTest import BaseCalculatorTest
+from Shadow3CalculatorTest import Shadow3CalculatorTest
 from DetectorTest import DetectorTest
 from RadiationSampleInteractorTest import RadiationSampleInteractorTest
 from BeamlinePropagatorTest import BeamlinePropagatorTest, BeamlinePropagatorParametersTest
 from SignalGeneratorTest import SignalGeneratorTest
 from ParametersTest import Test_Parameter, Test_Parameters, Test_Instruments
 from InstrumentTest import InstrumentTest
+from ResultCacheTest import ResultCacheTest
+from InstrumentationTest import InstrumentationTest
+from ImportTest import ImportTest
+from RayStatisticsTest import RayStatisticsTest
+from RayColumnsTest import RayColumnsTest
 
 # Are we running on CI server?
 is_travisCI = ("TRAVIS_BUILD_DIR" in list(
@@ -43,6 +49,7 @@ is_travisCI = ("TRAVIS_BUILD_DIR" in list(
 def suite():
     suites = [
         unittest.makeSuite(BaseCalculatorTest, 'test'),
+        unittest.makeSuite(Shadow3CalculatorTest, 'test'),
         unittest.makeSuite(DetectorTest, 'test'),
         unittest.makeSuite(RadiationSampleInteractorTest, 'test'),
         unittest.makeSuite(BeamlinePropagatorTest, 'test'),
@@ -52,6 +59,11 @@ def suite():
         unittest.makeSuite(Test_Parameters, 'test'),
         unittest.makeSuite(Test_Instruments, 'test'),
         unittest.makeSuite(InstrumentTest, 'test'),
+        unittest.makeSuite(ResultCacheTest, 'test'),
+        unittest.makeSuite(InstrumentationTest, 'test'),
+        unittest.makeSuite(ImportTest, 'test'),
+        unittest.makeSuite(RayStatisticsTest, 'test'),
+        unittest.makeSuite(RayColumnsTest, 'test'),
     ]
 
     return unittest.TestSuite(suites)